@@ -14,4 +14,6 @@ rm -rf dist/geoapi/log/logs/*.log
 rm -rf dist/geoapi/log/logs/*.prof
 rm -rf dist/geoapi/static/tmp/*.jpg
 rm -rf dist/geoapi/static/tmp/*.tif
+rm -rf dist/geoapi/static/tmp/*.json
+rm -rf dist/geoapi/static/tmp/*.tmp
 
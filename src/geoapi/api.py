@@ -12,7 +12,11 @@ import asyncio
 from typing import Optional, Dict
 from fastapi import FastAPI
 from starlette.staticfiles import StaticFiles
+import geoapi.config.api_configurator as config
 from geoapi.data.db import DB
+import geoapi.data.migrations as migrations
+import geoapi.common.worker_pool as worker_pool
+import geoapi.common.http_client as http_client
 from geoapi.routes import create_routes
 
 
@@ -78,10 +82,24 @@ def create_api(database_url: str,
                     raise exc
             break
         logger.info('connected to db')
+        if int(config.API_CONFIG['GEOAPI_MIGRATE_ON_STARTUP']):
+            applied = await migrations.migrate(db_api.connection)
+            logger.info('migrations applied: %s', applied or 'none, schema is current')
+        missing_indexes = await migrations.verify(db_api.connection)
+        if missing_indexes:
+            logger.error('missing or invalid spatial indexes: %s',
+                         missing_indexes)
+        await http_client.startup()
+        if db_api.geocode_replica is not None:
+            await db_api.geocode_replica.start()
 
     @api.on_event("shutdown")
     async def shutdown():
+        if db_api.geocode_replica is not None:
+            await db_api.geocode_replica.stop()
         await db_api.connection.disconnect()
+        await http_client.shutdown()
+        worker_pool.shutdown_pools()
 
     # 4. setup api home route
     @api.get("/")
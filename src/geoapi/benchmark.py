@@ -0,0 +1,219 @@
+"""Benchmarks for CPU bound code paths, no database is needed
+
+Synthetic db rows are built in memory in the formats returned by the database,
+so only the python side of each path is measured.
+
+Usage:
+    cd to the src folder and run:
+        python -m geoapi.benchmark --rows 10000
+"""
+
+import argparse
+import json
+import time
+from typing import Callable, Dict, List
+import geoalchemy2
+from shapely import geometry
+from shapely.affinity import translate
+from fastapi.routing import APIRoute, serialize_response
+from starlette.responses import JSONResponse, Response
+import geoapi.common.raw_json as raw_json
+from geoapi.common.json_models import RealPropertyOut
+
+# property used in the api docs and tests
+_GEOCODE = geometry.Point(-73.748751, 40.918548)
+_PARCEL = geometry.Polygon([(-73.748527, 40.918404), (-73.748847, 40.918296),
+                            (-73.748993, 40.918552), (-73.748663, 40.918656),
+                            (-73.748527, 40.918404)])
+_BUILDING = geometry.Polygon([(-73.74885, 40.918602), (-73.748832, 40.918567),
+                              (-73.748887, 40.918551), (-73.748663, 40.918465),
+                              (-73.748623, 40.918528), (-73.748684, 40.918649),
+                              (-73.74885, 40.918602)])
+_IMAGE_BOUNDS = [-73.74917, 40.918232, -73.748332, 40.918865]
+_IMAGE_URL = 'https://docs.mapbox.com/help/data/landsat.tif'
+
+
+def _geo_json_text(shapely_geometry, precision: int) -> str:
+    """approximates ST_AsGeoJSON output"""
+    mapping = geometry.mapping(shapely_geometry)
+
+    def round_coordinates(coordinates):
+        if isinstance(coordinates[0], (int, float)):
+            return [round(value, precision) for value in coordinates]
+        return [round_coordinates(value) for value in coordinates]
+
+    return json.dumps({
+        'type': mapping['type'],
+        'coordinates': round_coordinates(mapping['coordinates'])
+    })
+
+
+def wkb_rows(rows: int) -> List[Dict]:
+    """rows as returned by a select of the table (geography columns as wkb)"""
+    out_rows = []
+    for index in range(rows):
+        offset = index * 1e-4
+        out_rows.append({
+            'id': '{:032x}'.format(index),
+            'geocode_geo': geoalchemy2.shape.from_shape(
+                translate(_GEOCODE, offset, offset), srid=4326),
+            'parcel_geo': geoalchemy2.shape.from_shape(
+                translate(_PARCEL, offset, offset), srid=4326),
+            'building_geo': geoalchemy2.shape.from_shape(
+                translate(_BUILDING, offset, offset), srid=4326),
+            'image_bounds': _IMAGE_BOUNDS,
+            'image_url': _IMAGE_URL,
+        })
+    return out_rows
+
+
+def geo_json_rows(rows: int, precision: int = 9) -> List[Dict]:
+    """rows as returned by a select with ST_AsGeoJSON on the geography columns"""
+    out_rows = []
+    for index in range(rows):
+        offset = index * 1e-4
+        out_rows.append({
+            'id': '{:032x}'.format(index),
+            'geocode_geo': _geo_json_text(translate(_GEOCODE, offset, offset),
+                                          precision),
+            'parcel_geo': _geo_json_text(translate(_PARCEL, offset, offset),
+                                         precision),
+            'building_geo': _geo_json_text(
+                translate(_BUILDING, offset, offset), precision),
+            'image_bounds': _IMAGE_BOUNDS,
+            'image_url': _IMAGE_URL,
+        })
+    return out_rows
+
+
+def _time_per_row(func: Callable[[], int], repeat: int) -> float:
+    """returns the best cpu time per row in microseconds, func returns the row count"""
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.process_time()
+        row_count = func()
+        best = min(best, (time.process_time() - start) / row_count)
+    return best * 1e6
+
+
+def _report(name: str, baseline: float, candidate: float) -> None:
+    print('{:<28} {:>12.1f} {:>12.1f} {:>9.1f}x'.format(
+        name, baseline, candidate, baseline / candidate))
+
+
+def run_db_geo_json(rows: int, repeat: int) -> None:
+    """python side cpu time per row: wkb decoding (from_db)
+    versus geojson encoded by the db (from_db_geo_json)"""
+
+    wkb = wkb_rows(rows)
+    geo_json = geo_json_rows(rows)
+
+    def get(factory, db_rows):
+        def run():
+            for db_row in db_rows:
+                factory(db_row).json()
+            return len(db_rows)
+        return run
+
+    def get_all(factory, db_rows):
+        def run():
+            json.dumps([factory(db_row).dict() for db_row in db_rows])
+            return len(db_rows)
+        return run
+
+    def stream(factory, db_rows):
+        def run():
+            for db_row in db_rows:
+                factory(db_row).json() + '\n'  # pylint: disable=expression-not-assigned
+            return len(db_rows)
+        return run
+
+    print('cpu time per row (microseconds), {} rows'.format(rows))
+    print('{:<28} {:>12} {:>12} {:>10}'.format('path', 'from_db',
+                                               'from_db_geo_json', 'speedup'))
+    single_wkb, single_geo_json = wkb[:1] * rows, geo_json[:1] * rows
+    _report('get',
+            _time_per_row(get(RealPropertyOut.from_db, single_wkb), repeat),
+            _time_per_row(
+                get(RealPropertyOut.from_db_geo_json, single_geo_json),
+                repeat))
+    _report('get_all',
+            _time_per_row(get_all(RealPropertyOut.from_db, wkb), repeat),
+            _time_per_row(get_all(RealPropertyOut.from_db_geo_json, geo_json),
+                          repeat))
+    _report('stream (ndjson)',
+            _time_per_row(stream(RealPropertyOut.from_db, wkb), repeat),
+            _time_per_row(stream(RealPropertyOut.from_db_geo_json, geo_json),
+                          repeat))
+
+
+def run_raw_json(rows: int, repeat: int) -> None:
+    """python side cpu time per row of the property responses: models validated against
+    the response_model and encoded by FastAPI versus json stitched from the db geojson text
+    (GEOAPI_RAW_JSON)"""
+
+    geo_json = geo_json_rows(rows)
+
+    def response_field(response_model):
+        # the field FastAPI validates the responses of a route with
+        return APIRoute('/', endpoint=lambda: None,
+                        response_model=response_model).secure_cloned_response_field
+
+    def send(field, response):
+        content = serialize_response(field=field, response=response)
+        return JSONResponse(content).body
+
+    def get_validated():
+        field = response_field(RealPropertyOut)
+        for db_row in geo_json:
+            send(field, RealPropertyOut.from_db_geo_json(db_row))
+        return rows
+
+    def get_stitched():
+        for db_row in geo_json:
+            Response(raw_json.property_json(db_row), media_type='application/json')
+        return rows
+
+    def get_all_validated():
+        send(response_field(List[RealPropertyOut]),
+             [RealPropertyOut.from_db_geo_json(db_row) for db_row in geo_json])
+        return rows
+
+    def get_all_stitched():
+        Response(raw_json.property_list_json(geo_json), media_type='application/json')
+        return rows
+
+    def stream_models():
+        for db_row in geo_json:
+            RealPropertyOut.from_db_geo_json(db_row).json()
+        return rows
+
+    def stream_stitched():
+        for db_row in geo_json:
+            raw_json.property_json(db_row)
+        return rows
+
+    print('cpu time per row (microseconds), {} rows'.format(rows))
+    print('{:<28} {:>12} {:>12} {:>10}'.format('path', 'response_model',
+                                               'raw_json', 'speedup'))
+    _report('get', _time_per_row(get_validated, repeat),
+            _time_per_row(get_stitched, repeat))
+    _report('get_all (one page)', _time_per_row(get_all_validated, repeat),
+            _time_per_row(get_all_stitched, repeat))
+    _report('stream (ndjson)', _time_per_row(stream_models, repeat),
+            _time_per_row(stream_stitched, repeat))
+
+
+def main() -> None:
+    """runs the benchmarks"""
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--rows', type=int, default=10000)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+    run_db_geo_json(args.rows, args.repeat)
+    print()
+    run_raw_json(args.rows, args.repeat)
+
+
+if __name__ == '__main__':
+    main()
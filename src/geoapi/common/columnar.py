@@ -0,0 +1,136 @@
+"""Columnar Encoding of Properties as Arrow IPC Streams and GeoParquet
+
+Batches of db records (see RealPropertyQueries.export_batches) are encoded one at a time,
+as record batches of an Arrow IPC stream or as row groups of a GeoParquet file,
+so memory use is bounded by the batch size whatever the table size.
+Geography columns are WKB binary columns, described by the GeoParquet "geo" metadata.
+Needs pyarrow.
+"""
+
+import asyncio
+import io
+import json
+from typing import Any, AsyncGenerator, Dict, List
+from geoapi.common.json_models import ExportFormatEnum
+
+MEDIA_TYPES = {
+    ExportFormatEnum.arrow: 'application/vnd.apache.arrow.stream',
+    ExportFormatEnum.parquet: 'application/vnd.apache.parquet',
+}
+FILE_EXTENSIONS = {
+    ExportFormatEnum.arrow: '.arrows',
+    ExportFormatEnum.parquet: '.parquet',
+}
+
+# wkb geometry columns and their geometry types
+_GEOMETRY_COLUMNS = {
+    'geocode_geo': 'Point',
+    'parcel_geo': 'Polygon',
+    'building_geo': 'Polygon'
+}
+
+
+class _ChunkSink(io.RawIOBase):
+    """write only file that hands out what was written since the last take.
+    Keeps the position of the whole output, parquet writes it into the file footer."""
+
+    def __init__(self):
+        super().__init__()
+        self._chunks: List[bytes] = []
+        self._position = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        chunk = bytes(data)
+        self._chunks.append(chunk)
+        self._position += len(chunk)
+        return len(chunk)
+
+    def tell(self) -> int:
+        return self._position
+
+    def take(self) -> bytes:
+        """returns and forgets the bytes written since the last take"""
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def geo_metadata() -> Dict[str, Any]:
+    """GeoParquet file metadata of the geometry columns"""
+    return {
+        'version': '1.0.0',
+        'primary_column': 'geocode_geo',
+        'columns': {
+            name: {
+                'encoding': 'WKB',
+                'geometry_types': [geometry_type]
+            } for name, geometry_type in _GEOMETRY_COLUMNS.items()
+        }
+    }
+
+
+def _schema(pa):
+    return pa.schema([
+        pa.field('id', pa.string(), nullable=False),
+        pa.field('geocode_geo', pa.binary()),
+        pa.field('parcel_geo', pa.binary()),
+        pa.field('building_geo', pa.binary()),
+        pa.field('image_bounds', pa.list_(pa.float64())),
+        pa.field('image_url', pa.string()),
+    ], metadata={'geo': json.dumps(geo_metadata())})
+
+
+def _table(pa, schema, db_rows: List[Any]):
+    """one batch of db records as an arrow table, column by column"""
+    return pa.Table.from_arrays([
+        pa.array([db_row[field.name] for db_row in db_rows], type=field.type)
+        for field in schema
+    ], schema=schema)
+
+
+def _write_batch(pa, schema, writer, db_rows: List[Any]) -> None:
+    """converts and encodes one batch of db records, run off the event loop"""
+    writer.write_table(_table(pa, schema, db_rows))
+
+
+async def encode(db_batches: AsyncGenerator[List[Any], None],
+                 export_format: ExportFormatEnum) -> AsyncGenerator[bytes, None]:
+    """Encodes batches of db records, each batch is converted and encoded in a thread
+    so the event loop keeps serving other requests.
+    db_batches is closed when encoding ends, also if the generator is closed early
+    (e.g. the client disconnected), which releases its cursor and connection.
+
+    Args:
+        db_batches (AsyncGenerator[List[Any], None]): batches of records with the columns id,
+            geocode_geo, parcel_geo, building_geo (wkb), image_bounds and image_url
+        export_format (ExportFormatEnum): Arrow IPC stream or GeoParquet
+
+    Yields:
+        bytes: the encoded output, a chunk per batch
+    """
+
+    import pyarrow as pa  # pylint: disable=import-outside-toplevel
+    import pyarrow.parquet as pq  # pylint: disable=import-outside-toplevel
+    schema = _schema(pa)
+    sink = _ChunkSink()
+    if export_format == ExportFormatEnum.arrow:
+        writer = pa.RecordBatchStreamWriter(sink, schema)
+    else:
+        writer = pq.ParquetWriter(sink, schema, compression='snappy')
+    write = None
+    try:
+        async for db_rows in db_batches:
+            write = asyncio.get_event_loop().run_in_executor(
+                None, _write_batch, pa, schema, writer, db_rows)
+            await asyncio.shield(write)
+            yield sink.take()
+    finally:
+        if write is not None:
+            # cancelled while writing, the writer is closed once the thread is done with it
+            await asyncio.wait([write])
+        await db_batches.aclose()
+        writer.close()
+    yield sink.take()
@@ -9,3 +9,13 @@ class ResourceNotFoundError(Exception):
 class ResourceMissingDataError(Exception):
     """An API resource does not have required data
     """
+
+
+class ServiceUnavailableError(Exception):
+    """The API cannot take on more of this kind of work right now
+    """
+
+
+class ResourceTimeoutError(Exception):
+    """Getting or building an API resource took too long
+    """
@@ -0,0 +1,85 @@
+"""Heatmap Rasterization
+
+Renders building density tiles as PNG images. Each point (a property geocode) carries its
+building area as a share of the ground area of one pixel. The points are accumulated into
+a pixel grid padded by the kernel radius, smoothed with a separable gaussian kernel
+(two matrix products with banded kernel matrices) and mapped to colors with a lookup table,
+all in numpy without a per point python loop.
+The padding lets points of neighbouring tiles contribute, so tiles join without seams.
+"""
+
+import io
+from functools import lru_cache
+from typing import List
+import numpy as np
+from PIL import Image
+
+# color stops (intensity, red, green, blue, alpha), transparent where there are no buildings
+_COLOR_STOPS = np.array([
+    [0.0, 0, 0, 255, 0],
+    [0.25, 0, 0, 255, 120],
+    [0.5, 0, 255, 255, 160],
+    [0.75, 255, 255, 0, 200],
+    [1.0, 255, 0, 0, 230],
+])
+# rgba per intensity byte
+_COLORS = np.stack([
+    np.interp(np.linspace(0, 1, 256), _COLOR_STOPS[:, 0], _COLOR_STOPS[:, channel])
+    for channel in range(1, 5)
+], axis=1).round().astype(np.uint8)
+
+
+def _kernel_matrix(size: int, radius: int) -> np.ndarray:
+    """banded matrix applying a normalized 1d gaussian of radius pixels (2 standard deviations),
+    from the padded grid (size + 2 * radius) to the tile (size)"""
+    offsets = np.arange(-radius, radius + 1)
+    kernel = np.exp(-0.5 * (offsets / max(radius / 2, 0.5))**2)
+    kernel /= kernel.sum()
+    matrix = np.zeros((size, size + 2 * radius))
+    matrix[np.arange(size)[:, None],
+           np.arange(size)[:, None] + radius + offsets[None, :]] = kernel
+    return matrix
+
+
+def _encode(rgba: np.ndarray) -> bytes:
+    buffer = io.BytesIO()
+    Image.fromarray(rgba, 'RGBA').save(buffer, 'PNG')
+    return buffer.getvalue()
+
+
+@lru_cache(maxsize=4)
+def empty_png(size: int) -> bytes:
+    """a fully transparent tile"""
+    return _encode(np.zeros((size, size, 4), dtype=np.uint8))
+
+
+def render_png(columns: List[float], rows: List[float], weights: List[float],
+               size: int, radius: int, max_coverage: float) -> bytes:
+    """Renders a heatmap tile. Runs in the image worker pool.
+
+    Args:
+        columns (List[float]): point (or pixel) columns, from the west edge of the tile
+        rows (List[float]): point (or pixel) rows, from the north edge of the tile
+        weights (List[float]): building area of the points (summed per pixel) in pixel areas
+        size (int): tile width and height in pixels
+        radius (int): kernel radius in pixels, points up to radius pixels outside
+            the tile contribute
+        max_coverage (float): smoothed building coverage (0 to 1) with the most intense color
+
+    Returns:
+        bytes: PNG image
+    """
+
+    padded = size + 2 * radius
+    columns = np.floor(np.asarray(columns, dtype=np.float64)).astype(np.int64) + radius
+    rows = np.floor(np.asarray(rows, dtype=np.float64)).astype(np.int64) + radius
+    weights = np.asarray(weights, dtype=np.float64)
+    inside = (columns >= 0) & (columns < padded) & (rows >= 0) & (rows < padded)
+    grid = np.bincount(rows[inside] * padded + columns[inside],
+                       weights=weights[inside],
+                       minlength=padded * padded).reshape(padded, padded)
+    kernel = _kernel_matrix(size, radius)
+    coverage = kernel @ grid @ kernel.T
+    # square root, so sparse buildings stay visible next to dense blocks
+    intensity = np.sqrt(np.clip(coverage / max_coverage, 0, 1))
+    return _encode(_COLORS[(intensity * 255).astype(np.uint8)])
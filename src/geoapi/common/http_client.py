@@ -0,0 +1,44 @@
+"""Shared HTTP Client
+
+One aiohttp session for the lifetime of the api, opened and closed by the api
+startup and shutdown events. Its connector keeps connections alive between requests,
+caches dns lookups and limits connections in total and per host.
+"""
+
+from typing import Optional
+import aiohttp
+import geoapi.config.api_configurator as config
+
+# shared session, see get_session()
+_SESSION: Optional[aiohttp.ClientSession] = None
+
+
+def get_session() -> aiohttp.ClientSession:
+    """returns the shared session, created from the configuration on first use.
+    Must be called from a coroutine running on the api event loop."""
+    global _SESSION  # pylint: disable=global-statement
+    if _SESSION is None or _SESSION.closed:
+        connector = aiohttp.TCPConnector(
+            limit=int(config.API_CONFIG['GEOAPI_HTTP_MAX_CONNECTIONS']),
+            limit_per_host=int(
+                config.API_CONFIG['GEOAPI_HTTP_MAX_CONNECTIONS_PER_HOST']),
+            keepalive_timeout=float(config.API_CONFIG['GEOAPI_HTTP_KEEPALIVE']),
+            ttl_dns_cache=300)
+        timeout = aiohttp.ClientTimeout(
+            total=float(config.API_CONFIG['GEOAPI_HTTP_TIMEOUT']),
+            connect=float(config.API_CONFIG['GEOAPI_HTTP_CONNECT_TIMEOUT']))
+        _SESSION = aiohttp.ClientSession(connector=connector, timeout=timeout)
+    return _SESSION
+
+
+async def startup() -> None:
+    """opens the shared session, called on api startup"""
+    get_session()
+
+
+async def shutdown() -> None:
+    """closes the shared session and its connections, called on api shutdown"""
+    global _SESSION  # pylint: disable=global-statement
+    if _SESSION is not None:
+        await _SESSION.close()
+        _SESSION = None
@@ -0,0 +1,357 @@
+"""Disk Backed Property Image Cache
+
+Images are content addressed by image url, properties sharing an image share its entry.
+For every entry the cache keeps the downloaded source image, its jpeg conversion and
+a small json metadata file with the validators (ETag/Last-Modified) of the download.
+Entries younger than GEOAPI_IMAGE_CACHE_MAX_AGE seconds are served directly, older entries
+are revalidated with a conditional request and only downloaded again if they changed.
+Total size is bounded by GEOAPI_IMAGE_CACHE_MAX_BYTES, least recently used entries are evicted,
+except entries pinned by a request that is still sending the jpeg (see get and release).
+Every file is written to a temporary name and renamed into place,
+so a request never sees a half-written file.
+"""
+
+import os
+import json
+import asyncio
+import hashlib
+import logging
+import re
+import uuid
+from collections import OrderedDict
+from pathlib import Path
+from time import time
+from typing import Any, Dict, Optional
+import aiohttp
+import aiofiles
+from PIL import Image
+import geoapi.config.api_configurator as config
+import geoapi.common.worker_pool as worker_pool
+import geoapi.common.http_client as http_client
+
+# shared image cache, see get_image_cache()
+_IMAGE_CACHE: Optional['ImageCache'] = None
+
+
+def get_image_cache() -> 'ImageCache':
+    """returns the shared image cache, created from the configuration on first use"""
+    global _IMAGE_CACHE  # pylint: disable=global-statement
+    if _IMAGE_CACHE is None:
+        _IMAGE_CACHE = ImageCache(
+            directory=Path(config.API_CONFIG['GEOAPI_IMAGE_CACHE_DIR']),
+            max_bytes=int(config.API_CONFIG['GEOAPI_IMAGE_CACHE_MAX_BYTES']),
+            max_age=int(config.API_CONFIG['GEOAPI_IMAGE_CACHE_MAX_AGE']))
+    return _IMAGE_CACHE
+
+
+def _temporary_path(path: Path) -> Path:
+    """unique temporary file next to path, so the final rename is atomic"""
+    return path.with_name('{}.{}.tmp'.format(path.name, uuid.uuid4().hex))
+
+
+# files of the cache are named after their key (see ImageCache.key)
+_CACHE_FILE = re.compile(r'[0-9a-f]{64}\.')
+# seconds since the last write of a file of no entry before it is removed as an orphan,
+# files being downloaded or converted by other api processes are written to more recently
+_ORPHAN_AGE = 3600
+
+
+def convert_to_jpeg(source_path: str, jpeg_path: str) -> None:
+    """converts an image file to jpeg, writing to a temporary file first.
+    Runs in the image worker pool."""
+    temporary_path = _temporary_path(Path(jpeg_path))
+    try:
+        img = Image.open(source_path)
+        img.save(temporary_path, "JPEG", quality=100)
+        os.replace(temporary_path, jpeg_path)
+    finally:
+        if temporary_path.exists():
+            temporary_path.unlink()
+
+
+class ImageCache():
+    """Disk backed, size bounded cache of property images"""
+
+    def __init__(self, directory: Path, max_bytes: int, max_age: int):
+        self._directory = directory
+        self._max_bytes = max_bytes
+        self._max_age = max_age
+        # key -> bytes on disk, least recently used first
+        self._entries: 'OrderedDict[str, int]' = OrderedDict()
+        self._bytes = 0
+        self._counters = {
+            'hits': 0,
+            'revalidated': 0,
+            'misses': 0,
+            'coalesced': 0,
+            'evictions': 0
+        }
+        # downloads in progress by key
+        self._in_flight: Dict[str, 'asyncio.Future[Path]'] = {}
+        # requests using the jpeg of a key, pinned entries are not evicted
+        self._pins: Dict[str, int] = {}
+        self.logger = logging.getLogger(__name__)
+        self._directory.mkdir(parents=True, exist_ok=True)
+        self._load()
+
+    @staticmethod
+    def key(image_url: str) -> str:
+        """content address of an image"""
+        return hashlib.sha256(image_url.encode()).hexdigest()
+
+    def _metadata_path(self, key: str) -> Path:
+        return self._directory / (key + '.json')
+
+    def _jpeg_path(self, key: str) -> Path:
+        return self._directory / (key + '.jpg')
+
+    def _source_path(self, key: str, image_url: str) -> Path:
+        suffix = os.path.splitext(os.path.basename(image_url))[1] or '.img'
+        return self._directory / (key + suffix)
+
+    def _load(self) -> None:
+        """rebuilds the index from the files on disk, oldest access first.
+        Cache files of no complete entry (e.g. left by a crash) are removed
+        once they are _ORPHAN_AGE seconds old."""
+        entries = []
+        entry_files = set()
+        for metadata_path in self._directory.glob('*.json'):
+            key = metadata_path.stem
+            metadata = self._read_metadata(key)
+            if metadata is None or not self._jpeg_path(key).exists():
+                continue
+            entries.append((self._jpeg_path(key).stat().st_mtime, key,
+                            metadata['size']))
+            entry_files.update((metadata_path.name, self._jpeg_path(key).name,
+                                metadata['source_file']))
+        for path in self._directory.iterdir():
+            if (_CACHE_FILE.match(path.name) and path.name not in entry_files and
+                    time() - path.stat().st_mtime > _ORPHAN_AGE):
+                self.logger.warning('removing orphaned image cache file: %s', path.name)
+                self._unlink(path)
+        for _, key, size in sorted(entries):
+            self._entries[key] = size
+            self._bytes += size
+
+    def _read_metadata(self, key: str) -> Optional[Dict[str, Any]]:
+        try:
+            with open(self._metadata_path(key)) as metadata_file:
+                return json.load(metadata_file)
+        except (OSError, ValueError):
+            return None
+
+    def _write_metadata(self, key: str, metadata: Dict[str, Any]) -> None:
+        metadata_path = self._metadata_path(key)
+        temporary_path = _temporary_path(metadata_path)
+        with open(temporary_path, 'w') as metadata_file:
+            json.dump(metadata, metadata_file)
+        os.replace(temporary_path, metadata_path)
+
+    def _touch(self, key: str) -> bool:
+        """marks an entry as most recently used, also on disk for restarts.
+        Returns False if its jpeg is gone (e.g. removed by an operator)"""
+        self._entries.move_to_end(key)
+        try:
+            os.utime(self._jpeg_path(key))
+        except FileNotFoundError:
+            return False
+        return True
+
+    def _remove(self, key: str) -> None:
+        size = self._entries.pop(key, 0)
+        self._bytes -= size
+        metadata = self._read_metadata(key)
+        paths = [self._metadata_path(key), self._jpeg_path(key)]
+        if metadata is not None:
+            paths.append(self._directory / metadata['source_file'])
+        for path in paths:
+            self._unlink(path)
+
+    @staticmethod
+    def _unlink(path: Path) -> None:
+        try:
+            path.unlink()
+        except FileNotFoundError:
+            pass
+
+    def _store(self, key: str, size: int) -> None:
+        """accounts for a new or replaced entry and evicts to stay within the byte quota"""
+        self._bytes -= self._entries.pop(key, 0)
+        self._entries[key] = size
+        self._bytes += size
+        # least recently used first, the new entry and pinned entries are kept
+        evictable = [
+            old_key for old_key in self._entries
+            if old_key != key and not self._pins.get(old_key)
+        ]
+        for old_key in evictable:
+            if self._bytes <= self._max_bytes:
+                break
+            self._remove(old_key)
+            self._counters['evictions'] += 1
+
+    def _pin(self, key: str) -> None:
+        self._pins[key] = self._pins.get(key, 0) + 1
+
+    def _unpin(self, key: str) -> None:
+        self._pins[key] -= 1
+        if not self._pins[key]:
+            del self._pins[key]
+
+    def release(self, jpeg_path: str) -> None:
+        """Releases a jpeg returned by get once it is sent, it can be evicted again
+
+        Args:
+            jpeg_path (str): path returned by get
+        """
+        self._unpin(Path(jpeg_path).stem)
+
+    async def _download(self, response: aiohttp.ClientResponse,
+                        source_path: Path) -> int:
+        """streams a response body to source_path, returns the byte count"""
+        # with temporary placeholder for progress reporting
+        total_size = 0
+        start = time()
+        print_size = 0.0
+        temporary_path = _temporary_path(source_path)
+        try:
+            async with aiofiles.open(temporary_path, 'wb') as fd:
+                self.logger.info('file download started: %s', response.url)
+                while True:
+                    chunk = await response.content.read(16144)
+                    if not chunk:
+                        break
+                    await fd.write(chunk)
+                    total_size += len(chunk)
+                    print_size += len(chunk)
+                    if (print_size / (1024 * 1024)
+                       ) > 100:  # print every 100MB download
+                        msg = (f'{time() - start:0.2f}s, '
+                               f'downloaded: {total_size / (1024 * 1024):0.0f}MB')
+                        self.logger.info(msg)
+                        print_size = (print_size / (1024 * 1024)) - 100
+            os.replace(temporary_path, source_path)
+        finally:
+            if temporary_path.exists():
+                temporary_path.unlink()
+        self.logger.info('file downloaded: %s', source_path)
+        log_msg = (f'total time: {time() - start:0.2f}s, '
+                   f'total size: {total_size / (1024 * 1024):0.0f}MB')
+        self.logger.info(log_msg)
+        return total_size
+
+    async def get(self, image_url: str) -> Path:
+        """Gets the jpeg for a property image, downloading and converting it only when needed.
+        Concurrent requests for the same image, also of different properties,
+        share one download and conversion.
+        The entry stays pinned, not evicted, until the caller releases the returned path.
+
+        Args:
+            image_url (str): url of the source image
+
+        Raises:
+            aiohttp.ClientError: if the image cannot be downloaded and there is no cached copy
+            ServiceUnavailableError: if the image conversion pool is saturated
+            ResourceTimeoutError: if the image conversion takes too long
+
+        Returns:
+            Path: path to the jpeg file, to be released (see release) once it is sent
+        """
+
+        key = self.key(image_url)
+        # pinned before waiting, a concurrent miss can't evict it before the caller gets it
+        self._pin(key)
+        in_flight = self._in_flight.get(key)
+        if in_flight is not None:
+            self._counters['coalesced'] += 1
+        else:
+            in_flight = asyncio.ensure_future(
+                self._get(key, image_url))
+            self._in_flight[key] = in_flight
+            in_flight.add_done_callback(
+                lambda _: self._in_flight.pop(key, None))
+        try:
+            # shield - a cancelled request does not cancel the shared download
+            return await asyncio.shield(in_flight)
+        except BaseException:
+            self._unpin(key)
+            raise
+
+    async def _get(self, key: str, image_url: str) -> Path:
+        jpeg_path = self._jpeg_path(key)
+        metadata = self._read_metadata(key) if key in self._entries else None
+        if metadata is not None and not self._touch(key):
+            # jpeg removed behind the cache's back, a miss
+            self._remove(key)
+            metadata = None
+        if metadata is not None and time() - metadata['checked'] < self._max_age:
+            self._counters['hits'] += 1
+            return jpeg_path
+
+        headers = {}
+        if metadata is not None:
+            if metadata.get('etag'):
+                headers['If-None-Match'] = metadata['etag']
+            if metadata.get('last_modified'):
+                headers['If-Modified-Since'] = metadata['last_modified']
+
+        source_path = self._source_path(key, image_url)
+        try:
+            session = http_client.get_session()
+            async with session.get(image_url, headers=headers) as response:
+                if response.status == 304 and metadata is not None:
+                    self._counters['revalidated'] += 1
+                    metadata['checked'] = time()
+                    self._write_metadata(key, metadata)
+                    if self._touch(key):
+                        return jpeg_path
+                    # jpeg removed while revalidating, download it again
+                    self._remove(key)
+                    return await self._get(key, image_url)
+                response.raise_for_status()
+                source_size = await self._download(response, source_path)
+                etag = response.headers.get('ETag')
+                last_modified = response.headers.get('Last-Modified')
+        except aiohttp.ClientError as exc:
+            if metadata is None:
+                raise
+            # serve the cached copy if the origin cannot be reached
+            if not self._touch(key):
+                raise
+            self.logger.warning('revalidation failed, serving cached image: %s',
+                                str(exc))
+            return jpeg_path
+
+        # convert to jpeg
+        self._counters['misses'] += 1
+        try:
+            await worker_pool.get_image_pool().run(convert_to_jpeg,
+                                                   str(source_path),
+                                                   str(jpeg_path))
+            size = source_size + jpeg_path.stat().st_size
+        except BaseException:
+            # nothing of a failed conversion stays on disk outside the quota,
+            # including a replaced entry and a jpeg written by a timed out job
+            self._remove(key)
+            temporary_paths = self._directory.glob(jpeg_path.name + '.*.tmp')
+            for path in [source_path, jpeg_path, *temporary_paths]:
+                self._unlink(path)
+            raise
+        self._write_metadata(
+            key, {
+                'image_url': image_url,
+                'source_file': source_path.name,
+                'etag': etag,
+                'last_modified': last_modified,
+                'checked': time(),
+                'size': size,
+            })
+        self._store(key, size)
+        return jpeg_path
+
+    def stats(self) -> Dict[str, Any]:
+        """returns cache counters and current usage"""
+        return dict(self._counters,
+                    entries=len(self._entries),
+                    bytes=self._bytes,
+                    max_bytes=self._max_bytes)
@@ -1,9 +1,9 @@
 """Data Transfer Objects used throughout the Application
 """
 
-from enum import IntEnum
+from enum import IntEnum, Enum
 from typing import Optional, List, Dict
-from pydantic import BaseModel, UrlStr
+from pydantic import BaseModel, UrlStr, conint
 from geojson import Point, Polygon
 import geoapi.common.spatial_utils as spatial_utils
 
@@ -17,6 +17,24 @@ class LogEnum(IntEnum):
     DEBUG = 10
 
 
+class StreamFormatEnum(str, Enum):
+    """Class for the streaming formats of property lists"""
+    ndjson = 'ndjson'  #: newline delimited json, one property per line
+    geojson = 'geojson'  #: Geojson FeatureCollection, one feature per property
+
+
+class ExportFormatEnum(str, Enum):
+    """Class for the columnar export formats of the property table"""
+    arrow = 'arrow'  #: Arrow IPC stream, one record batch per db batch
+    parquet = 'parquet'  #: GeoParquet file, one row group per db batch
+
+
+class ChangeKindEnum(str, Enum):
+    """Class for the kinds of change in the property change feed"""
+    upsert = 'upsert'  #: inserted or updated, the property is included
+    delete = 'delete'  #: deleted
+
+
 class RealPropertyBase(BaseModel):
     """Base for all property Geojson Data Transfer Objects"""
     id: str  #: property id
@@ -34,6 +52,17 @@ class RealPropertyBase(BaseModel):
 class RealPropertyIn(RealPropertyBase):
     """Geojson Data Transfer Object for incoming property data to the API"""
 
+    @classmethod
+    def from_feature(cls, feature: Dict, geometry_field: str = 'geocode_geo'):
+        """Factory method - create instance from a Geojson Feature
+        with the geocode as its geometry (the inverse of RealPropertyOut.to_feature),
+        or with the geometry of another geography field given by geometry_field"""
+        properties = dict(feature.get('properties') or {})
+        if 'id' not in properties and 'id' in feature:
+            properties['id'] = feature['id']
+        properties[geometry_field] = feature.get('geometry')
+        return cls(**properties)
+
 
 class RealPropertyOut(RealPropertyBase):
     """Geojson Data Transfer Object for outgoing property data from the API"""
@@ -53,6 +82,45 @@ class RealPropertyOut(RealPropertyBase):
                    image_bounds=image_bounds_geo_json,
                    image_url=db_row["image_url"])
 
+    @classmethod
+    def from_db_geo_json(cls, db_row):
+        """Factory method - create instance from db row
+        where the geography columns are already encoded as geojson text by the db"""
+        return cls(id=db_row["id"],
+                   geocode_geo=spatial_utils.from_geo_json_text(
+                       db_row["geocode_geo"]),
+                   parcel_geo=spatial_utils.from_geo_json_text(
+                       db_row["parcel_geo"]),
+                   building_geo=spatial_utils.from_geo_json_text(
+                       db_row["building_geo"]),
+                   image_bounds=spatial_utils.from_bbox_array(
+                       db_row["image_bounds"]),
+                   image_url=db_row["image_url"])
+
+    def to_feature(self) -> Dict:
+        """returns a Geojson Feature with the geocode as its geometry"""
+        return {
+            'type': 'Feature',
+            'id': self.id,
+            'geometry': self.geocode_geo,
+            'properties': self.dict(exclude={'geocode_geo'}),
+        }
+
+
+class GeometryOutputIn(BaseModel):
+    """Data Transfer Object for the requested resolution of outgoing geometries.
+    Also reports the geojson bytes of the outgoing geometries, and what they would have been
+    at full resolution (no simplification, GEOAPI_GEOJSON_PRECISION decimal places).
+    """
+    simplify: Optional[float] = None  #: polygon simplification tolerance in meters
+    precision: Optional[int] = None  #: decimal places of coordinates
+    geometry_bytes: int = 0  #: geojson bytes of the outgoing geometries
+    full_geometry_bytes: int = 0  #: geojson bytes of the geometries at full resolution
+
+    def bytes_saved(self) -> int:
+        """geojson bytes saved by the requested resolution"""
+        return self.full_geometry_bytes - self.geometry_bytes
+
 
 class GeometryAndDistanceIn(BaseModel):
     """Geojson Data Transfer Object for incoming data for find query.
@@ -60,7 +128,22 @@ class GeometryAndDistanceIn(BaseModel):
     Should improve by adding validation for input geometry.
     """
     location_geo: Dict = {}  #: Geojson geometry representing simple point, line or polygon
-    distance: int  #: Distance in meters
+    distance: conint(gt=0)  #: Distance in meters
+
+
+class GeometryAndDistanceLimitIn(GeometryAndDistanceIn):
+    """Geojson Data Transfer Object for one geometry of a batch find query.
+    Optionally limits the result to the nearest limit properties.
+    """
+    limit: Optional[conint(ge=1)] = None  #: Maximum number of property ids, nearest first
+
+
+class NearestIn(BaseModel):
+    """Geojson Data Transfer Object for incoming data for nearest query.
+    Takes any simple point, line or polygon geometry and the number of properties.
+    """
+    location_geo: Dict  #: Geojson geometry representing simple point, line or polygon
+    k: conint(ge=1) = 10  #: Number of nearest properties
 
 
 class IdAndDistanceIn(BaseModel):
@@ -69,7 +152,39 @@ class IdAndDistanceIn(BaseModel):
     Should improve by adding validation for input geometry.
     """
     property_id: str  #: property id
-    distance: int  #: Distance in meters
+    distance: conint(gt=0)  #: Distance in meters, the zone of a distance of 0 has no area
+
+
+class BulkRowStatusEnum(str, Enum):
+    """Class for the outcomes of a row in a bulk insert"""
+    created = 'created'  #: inserted
+    conflict = 'conflict'  #: not inserted, a property with the same id already exists
+    invalid = 'invalid'  #: not inserted, the row is not a valid property
+
+
+class BulkRowResultOut(BaseModel):
+    """Json Data Transfer Object for the outcome of one row of a bulk insert
+    """
+    index: int  #: position of the row in the request body, starting at 0
+    id: Optional[str] = None  #: property id, if the row has one
+    status: BulkRowStatusEnum  #: outcome of the row
+    message: Optional[str] = None  #: reason for an invalid row
+
+
+class BulkResultOut(BaseModel):
+    """Json Data Transfer Object for outgoing data from a bulk insert.
+    """
+    created: int  #: number of rows inserted
+    conflicts: int  #: number of rows with an id that already exists
+    invalid: int  #: number of rows that are not valid properties
+    results: List[BulkRowResultOut]  #: outcome per row, in request order
+
+
+class PropertyDistanceOut(BaseModel):
+    """Json Data Transfer Object for outgoing data from nearest query.
+    """
+    id: str  #: property id
+    distance: float  #: distance in meters from the property geocode to the query geometry
 
 
 class StatisticsOut(BaseModel):
@@ -81,3 +196,41 @@ class StatisticsOut(BaseModel):
         int]]  #: list of building areas (square meters) and distances to zone center (meters)
     zone_area: int  #: square meters
     zone_density: float  #: percentage of building area in zone
+
+
+class AggregateCellOut(BaseModel):
+    """Json Data Transfer Object for one grid cell of an aggregation query.
+    """
+    x: int  #: column of the cell, from the west
+    y: int  #: row of the cell, from the north
+    bbox: List[float]  #: cell bounds, min longitude, min latitude, max longitude, max latitude
+    count: int  #: number of properties with a geocode in the cell
+    parcel_area: int  #: square meters, total area of the parcels of these properties
+    building_area: int  #: square meters, total area of the buildings of these properties
+    building_coverage: float  #: percentage of the cell area covered by these buildings
+
+
+class StatisticsResultOut(BaseModel):
+    """Json Data Transfer Object for the outcome of one request of a batch statistics query.
+    """
+    index: int  #: position of the request in the request body, starting at 0
+    property_id: str  #: property id of the request
+    distance: int  #: search radius of the request in meters
+    statistics: Optional[StatisticsOut] = None  #: statistics, if the property was found and located
+    message: Optional[str] = None  #: reason there are no statistics
+
+
+class PropertyChangeOut(BaseModel):
+    """Json Data Transfer Object for one change of the property change feed.
+    """
+    id: str  #: property id
+    change: ChangeKindEnum  #: kind of change
+    property: Optional[RealPropertyOut] = None  #: the property as it is now, for upserts
+
+
+class ChangesOut(BaseModel):
+    """Json Data Transfer Object for a page of the property change feed.
+    """
+    changes: List[PropertyChangeOut]  #: changes, oldest first
+    next_token: str  #: since token of the next request, also when there are no changes
+    has_more: bool  #: whether more changes are ready now, false once caught up
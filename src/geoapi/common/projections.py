@@ -0,0 +1,74 @@
+"""Projection Registry
+Builds pyproj transformers once and caches them by (source crs, target crs).
+pyproj transformers are not safe to share between threads,
+so each thread keeps its own cache.
+
+The projected crs used for metric calculations is configurable in config.ini:
+    GEOAPI_SOURCE_CRS - crs of the stored geographies, e.g. epsg:4326
+    GEOAPI_PROJECTED_CRS - either 'utm' to select the local UTM zone from the input geometry
+        or any explicit crs, e.g. epsg:3857
+"""
+
+import threading
+from typing import Dict, Tuple
+import pyproj
+import geoapi.config.api_configurator as config
+
+# used by 'utm' selection outside of the UTM latitude band or for empty geometries
+FALLBACK_PROJECTED_CRS = 'epsg:3857'
+
+_LOCAL = threading.local()
+
+
+def get_transformer(source_crs: str, target_crs: str) -> pyproj.Transformer:
+    """returns a cached transformer for the current thread, creating it on first use.
+    Axis order is always longitude, latitude (x, y)."""
+
+    transformers: Dict[Tuple[str, str], pyproj.Transformer] = getattr(
+        _LOCAL, 'transformers', None)
+    if transformers is None:
+        transformers = {}
+        _LOCAL.transformers = transformers
+    key = (source_crs.lower(), target_crs.lower())
+    transformer = transformers.get(key)
+    if transformer is None:
+        transformer = pyproj.Transformer.from_crs(key[0],
+                                                  key[1],
+                                                  always_xy=True)
+        transformers[key] = transformer
+    return transformer
+
+
+def source_crs() -> str:
+    """returns the configured crs of the stored geographies"""
+    return config.API_CONFIG['GEOAPI_SOURCE_CRS']
+
+
+def utm_crs(longitude: float, latitude: float) -> str:
+    """returns the WGS84 UTM zone crs containing a longitude, latitude pair"""
+    if not -80.0 <= latitude <= 84.0:
+        return FALLBACK_PROJECTED_CRS
+    zone = min(int((longitude + 180.0) // 6.0) + 1, 60)
+    zone = max(zone, 1)
+    if latitude >= 0.0:
+        return 'epsg:{}'.format(32600 + zone)
+    return 'epsg:{}'.format(32700 + zone)
+
+
+def projected_crs(longitude: float, latitude: float) -> str:
+    """returns the configured projected crs to use for metric calculations
+    at a longitude, latitude pair"""
+    configured_crs = config.API_CONFIG['GEOAPI_PROJECTED_CRS']
+    if configured_crs.lower() == 'utm':
+        return utm_crs(longitude, latitude)
+    return configured_crs
+
+
+def projected_crs_for_geometry(shapely_geometry) -> str:
+    """returns the configured projected crs to use for metric calculations
+    for a shapely geometry in the source crs"""
+    if shapely_geometry is None or shapely_geometry.is_empty:
+        # pole is outside the utm band, so this gives the fallback crs
+        return projected_crs(0.0, 90.0)
+    centroid = shapely_geometry.centroid
+    return projected_crs(centroid.x, centroid.y)
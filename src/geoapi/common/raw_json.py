@@ -0,0 +1,48 @@
+"""Property Json Stitched from DB Rows
+
+The property routes declare RealPropertyOut response models for the api docs, but building
+the models, validating them again in FastAPI and encoding them with json.dumps costs as much
+as the query on large pages. With GEOAPI_RAW_JSON the responses are stitched from the db rows
+instead: the geography columns are geojson text encoded by the db (ST_AsGeoJSON) and are copied
+in as they are, only the id, image bounds and image url are encoded.
+The output is the json of RealPropertyOut, see RealPropertyOut.json and to_feature.
+"""
+
+import json
+from typing import Any, List, Optional
+import geoapi.common.spatial_utils as spatial_utils
+
+
+def _geometry(geo_json_text: Optional[str]) -> str:
+    """geojson text of the db as a json value"""
+    return 'null' if geo_json_text is None else geo_json_text
+
+
+def _properties(db_row: Any) -> str:
+    """json members of a row after the geocode"""
+    return '"parcel_geo": {}, "building_geo": {}, "image_bounds": {}, "image_url": {}'.format(
+        _geometry(db_row['parcel_geo']), _geometry(db_row['building_geo']),
+        json.dumps(spatial_utils.from_bbox_array(db_row['image_bounds'])),
+        json.dumps(db_row['image_url']))
+
+
+def property_json(db_row: Any) -> str:
+    """a property as json, from a row with the geography columns as geojson text"""
+    return '{{"id": {}, "geocode_geo": {}, {}}}'.format(
+        json.dumps(db_row['id']), _geometry(db_row['geocode_geo']),
+        _properties(db_row))
+
+
+def property_list_json(db_rows: List[Any]) -> str:
+    """a json array of properties, from rows with the geography columns as geojson text"""
+    return '[' + ', '.join(property_json(db_row) for db_row in db_rows) + ']'
+
+
+def feature_json(db_row: Any) -> str:
+    """a property as a Geojson Feature with the geocode as its geometry,
+    from a row with the geography columns as geojson text"""
+    return ('{{"type": "Feature", "id": {id}, "geometry": {geometry}, '
+            '"properties": {{"id": {id}, {properties}}}}}').format(
+                id=json.dumps(db_row['id']),
+                geometry=_geometry(db_row['geocode_geo']),
+                properties=_properties(db_row))
@@ -0,0 +1,105 @@
+"""Response bodies and response classes of the routes
+
+- the streamed property bodies, closed (and their db cursors released) with the response
+- request body readers of the bulk route
+- responses that release their resources once sent, or once the client disconnected
+"""
+
+import asyncio
+import json
+from typing import AsyncGenerator, Dict
+from starlette.requests import Request
+from starlette.responses import FileResponse, StreamingResponse
+import geoapi.common.image_cache as image_cache
+from geoapi.common.json_models import RealPropertyOut, StreamFormatEnum
+
+
+async def encode_properties(real_properties: AsyncGenerator[RealPropertyOut, None],
+                            stream_format: StreamFormatEnum
+                           ) -> AsyncGenerator[str, None]:
+    """encodes properties one at a time as json or as json geojson features,
+    closes real_properties when closed"""
+    try:
+        async for real_property in real_properties:
+            if stream_format == StreamFormatEnum.ndjson:
+                yield real_property.json()
+            else:
+                yield json.dumps(real_property.to_feature())
+    finally:
+        await real_properties.aclose()
+
+
+async def stream_properties(property_texts: AsyncGenerator[str, None],
+                            stream_format: StreamFormatEnum
+                           ) -> AsyncGenerator[str, None]:
+    """joins encoded properties (see encode_properties) into ndjson lines
+    or a geojson FeatureCollection, closes property_texts when closed"""
+    try:
+        if stream_format == StreamFormatEnum.ndjson:
+            async for property_text in property_texts:
+                yield property_text + '\n'
+            return
+        yield '{"type": "FeatureCollection", "features": ['
+        separator = ''
+        async for property_text in property_texts:
+            yield separator + property_text
+            separator = ', '
+        yield ']}'
+    finally:
+        await property_texts.aclose()
+
+
+async def ndjson_lines(request: Request) -> AsyncGenerator[bytes, None]:
+    """yields the non empty lines of an ndjson request body as it is received"""
+    remainder = b''
+    async for chunk in request.stream():
+        lines = (remainder + chunk).split(b'\n')
+        remainder = lines.pop()
+        for line in lines:
+            if line.strip():
+                yield line
+    if remainder.strip():
+        yield remainder
+
+
+async def features(feature_collection: Dict) -> AsyncGenerator[Dict, None]:
+    """yields the features of a Geojson FeatureCollection"""
+    for feature in feature_collection.get('features') or []:
+        yield feature
+
+
+class CachedImageResponse(FileResponse):
+    """jpeg of the image cache, released for eviction once it is sent (or sending failed)"""
+
+    async def __call__(self, scope, receive, send) -> None:
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            image_cache.get_image_cache().release(self.path)
+
+
+class ClosingStreamingResponse(StreamingResponse):
+    """streamed async generator, stopped as soon as the client disconnects and closed once
+    it is sent (or sending failed), so the db cursor and connection behind it are released.
+    The server does not fail sends to a disconnected client, the disconnect is only
+    reported by receive, which is watched while streaming."""
+
+    async def __call__(self, scope, receive, send) -> None:
+        streaming = asyncio.ensure_future(super().__call__(scope, receive, send))
+        disconnected = asyncio.ensure_future(wait_for_disconnect(receive))
+        try:
+            await asyncio.wait([streaming, disconnected],
+                               return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for task in (streaming, disconnected):
+                task.cancel()
+            await asyncio.wait([streaming, disconnected])
+            await self.body_iterator.aclose()
+        if not streaming.cancelled():
+            streaming.result()
+
+
+async def wait_for_disconnect(receive) -> None:
+    """returns once the client disconnected"""
+    while (await receive())['type'] != 'http.disconnect':
+        pass
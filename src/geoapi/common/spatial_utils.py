@@ -1,21 +1,21 @@
 """Spatial Processing Functions
-EPSG 4326 and 3857 are harcoded in these functions.
-TODO: Update to detect and use other CRS/SRS as configurable constants
-    as well as inputs to functions
+Conversions between geojson, geoalchemy elements and the db bbox arrays, and bounds.
+Inputs are in the configured source crs (GEOAPI_SOURCE_CRS, e.g. EPSG 4326),
+areas and distances of the geographies are calculated by the db.
 """
 
 import json
 import decimal
-from functools import lru_cache
 from typing import Optional, List, Dict
 import geoalchemy2
 from geoalchemy2.types import WKBElement
 import geojson
-import pyproj
+import numpy as np
 import shapely
 from shapely import geometry
-from shapely.ops import transform
-import geoapi.common.decorators as decorators
+
+# radius in meters of the sphere with the area of the WGS84 ellipsoid
+_AUTHALIC_RADIUS = 6371007.2
 
 
 def to_geo_json(geoalchemy_geometry: WKBElement):
@@ -52,17 +52,28 @@ def from_lon_lat(lon: float, lat: float) -> Optional[WKBElement]:
     return None
 
 
+def from_geo_json_text(geo_json_text: Optional[str]) -> Optional[Dict]:
+    """returns a geojson geometry dict from geojson text, e.g. the result of ST_AsGeoJSON,
+    without building any intermediate geometry objects"""
+    if geo_json_text is not None:
+        return json.loads(geo_json_text)
+
+    return None
+
+
 def from_bbox_array(bbox_array: List[decimal.Decimal]):
     """returns a geojson geometry object from a bounding box array.
     Keeping default number of decimal places to 6 for now,
-    can change depending on data precision requirements."""
+    can change depending on data precision requirements.
+    Ring order is the same as shapely.geometry.box (counter clockwise from max x, min y)."""
     if bbox_array:
-        shapely_geometry = shapely.geometry.box(bbox_array[0], bbox_array[1],
-                                                bbox_array[2], bbox_array[3])
-        shapely_geo_json = shapely.geometry.mapping(shapely_geometry)
-        json_geometry = json.dumps(shapely_geo_json)
-        geo_json_obj = geojson.loads(json_geometry)
-        return geo_json_obj
+        min_x, min_y, max_x, max_y = (bbox_array[0], bbox_array[1],
+                                      bbox_array[2], bbox_array[3])
+        return {
+            'type': 'Polygon',
+            'coordinates': [[[max_x, min_y], [max_x, max_y], [min_x, max_y],
+                             [min_x, min_y], [max_x, min_y]]]
+        }
 
     return None
 
@@ -85,83 +96,38 @@ def to_bbox_array(geo_json) -> Optional[List[decimal.Decimal]]:
     return None
 
 
-# @decorators.logprofile
-# @decorators.logtime(5)
-# @lru_cache(maxsize=128, typed=False)
-def _buffer(json_geometry: str, distance: int) -> WKBElement:
-    """assumes source crs is 4326 and projected crs to use is 3857"""
-
-    geo_json_obj = geojson.loads(json_geometry)
-    shapely_geo_json = geometry.shape(geo_json_obj)
-    # project to create buffer
-    project_in = pyproj.Transformer.from_proj(
-        pyproj.Proj(init='epsg:4326'),  # source
-        pyproj.Proj(init='epsg:3857'))  # destination
-    shapely_geo_json_projected = transform(project_in.transform,
-                                           shapely_geo_json)
-    # buffer
-    shapely_geojson_buffer_project = shapely_geo_json_projected.buffer(
-        distance)
-    # project back
-    project_out = pyproj.Transformer.from_proj(
-        pyproj.Proj(init='epsg:3857'),  # source
-        pyproj.Proj(init='epsg:4326'))  # destination
-    shapely_geo_json_buffered = transform(
-        project_out.transform, shapely_geojson_buffer_project)
-    # convert to geoalchemy element
-    geoalchemy_element = geoalchemy2.shape.from_shape(
-        shapely_geo_json_buffered)
-    return geoalchemy_element
-
-
-
-def buffer(geo_json, distance: int) -> Optional[WKBElement]:
-    """assumes source crs is 4326 and projected crs to use is 3857"""
-
-    if geo_json and distance:
-        json_geometry = json.dumps(geo_json)
-        # _buffer exists since it can be cached
-        # alternative to string conversion are custom geojson hashable geometry classes
-        geoalchemy_element = _buffer(json_geometry, distance)
-        return geoalchemy_element
+def vertex_count(geo_json) -> int:
+    """returns the number of positions in a geojson geometry, without parsing it into a shape"""
 
-    return None
+    def count(coordinates) -> int:
+        if not coordinates:
+            return 0
+        if isinstance(coordinates[0], (int, float, decimal.Decimal)):
+            return 1
+        return sum(count(value) for value in coordinates)
+
+    if not geo_json:
+        return 0
+    if geo_json.get('type') == 'GeometryCollection':
+        return sum(vertex_count(part) for part in geo_json.get('geometries', []))
+    return count(geo_json.get('coordinates'))
+
+
+def bounds(geo_jsons) -> Optional[tuple]:
+    """returns the bounds (min x, min y, max x, max y) of geojson geometries,
+    None values are skipped, None if there is no geometry"""
+
+    shapes = [geometry.shape(geo_json) for geo_json in geo_jsons if geo_json]
+    shapes = [shape for shape in shapes if not shape.is_empty]
+    if not shapes:
+        return None
+    all_bounds = np.array([shape.bounds for shape in shapes])
+    return (all_bounds[:, 0].min(), all_bounds[:, 1].min(),
+            all_bounds[:, 2].max(), all_bounds[:, 3].max())
 
 
-def area_distance(geoalchemy_polygon: WKBElement,
-                  geocode_geo_json=None) -> Dict[str, int]:
-    """calculates area of polygon wkbelement and
-    optionally distance to a geojson gemetry if it is provided.
-
-    Args:
-        geoalchemy_polygon (WKBElement): polygon whose area is desired
-        geocode_geo_json (geojson geometry): geometry to calculate distance to
-
-    Returns:
-        Dict[str, int]: {'area': area in sqm, 'distance': distance in meters}
-        if no input geojson geometry for distance calculation then returns -1 for distance
-    """
-
-    input_polygon_shapely_geometry = geoalchemy2.shape.to_shape(
-        geoalchemy_polygon)
-    # project
-    project_in = pyproj.Transformer.from_proj(
-        pyproj.Proj(init='epsg:4326'),  # source
-        pyproj.Proj(init='epsg:3857'))  # destination
-
-    # get area
-    input_polygon_projected = transform(project_in.transform,
-                                        input_polygon_shapely_geometry)
-    area = round(input_polygon_projected.area)
-
-    # get distance
-    if geocode_geo_json:
-        geocode_json_geometry = json.dumps(geocode_geo_json)
-        geocode_geo_json_obj = geojson.loads(geocode_json_geometry)
-        geocode_shapely = geometry.shape(geocode_geo_json_obj)
-        geocode_projected = transform(project_in.transform, geocode_shapely)
-        distance = round(
-            geocode_projected.distance(input_polygon_projected.centroid))
-        return {'area': area, 'distance': distance}
-
-    return {'area': area, 'distance': -1}
+def bbox_area(lon_lat_bounds) -> float:
+    """returns the area in square meters of a longitude/latitude box on the authalic sphere"""
+    min_lon, min_lat, max_lon, max_lat = lon_lat_bounds
+    return (_AUTHALIC_RADIUS**2 * np.radians(max_lon - min_lon) *
+            (np.sin(np.radians(max_lat)) - np.sin(np.radians(min_lat))))
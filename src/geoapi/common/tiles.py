@@ -0,0 +1,185 @@
+"""Web Mercator Tiles, Grid Cells and the Vector Tile Cache
+
+Tiles are addressed by zoom z and column x / row y counted from the north west corner
+(the XYZ scheme of web maps). Tile bounds are in web mercator (EPSG 3857) meters.
+Aggregation grid cells are squares of any size in web mercator meters,
+addressed the same way from the north west corner of the world.
+
+Encoded tiles (vector tiles and heatmaps, keyed by format, z, x, y) are kept in a size bounded
+in-memory cache of each api process. A write invalidates the cached tiles of every zoom
+whose content reaches the bounds of the written geometries, bulk writes clear the cache.
+Writes made by other processes are not seen, so entries also expire after
+GEOAPI_TILE_CACHE_MAX_AGE seconds.
+"""
+
+import math
+from time import time
+from typing import Dict, Hashable, Optional, Tuple
+import geoapi.config.api_configurator as config
+from geoapi.common.cache import LRUByteCache
+
+# half the width of the web mercator world in meters
+MERCATOR_EXTENT = 20037508.342789244
+# latitude limit of web mercator, the world is square
+MAX_LATITUDE = 85.0511287798066
+
+# shared tile cache, see tile_cache()
+_TILE_CACHE: Optional[LRUByteCache] = None
+# incremented by every invalidation, tiles read before an invalidation are not cached
+_GENERATION = 0
+
+
+def tile_cache() -> LRUByteCache:
+    """returns the shared tile cache, created from the configuration on first use"""
+    global _TILE_CACHE  # pylint: disable=global-statement
+    if _TILE_CACHE is None:
+        _TILE_CACHE = LRUByteCache(
+            max_entries=int(config.API_CONFIG['GEOAPI_TILE_CACHE_MAX_ENTRIES']),
+            max_bytes=int(config.API_CONFIG['GEOAPI_TILE_CACHE_MAX_BYTES']))
+    return _TILE_CACHE
+
+
+def is_valid(zoom: int, x: int, y: int) -> bool:
+    """whether a tile exists, up to zoom GEOAPI_TILE_MAX_ZOOM"""
+    max_zoom = int(config.API_CONFIG['GEOAPI_TILE_MAX_ZOOM'])
+    return 0 <= zoom <= max_zoom and 0 <= x < 2**zoom and 0 <= y < 2**zoom
+
+
+def tile_size(zoom: int) -> float:
+    """width (and height) of the tiles of a zoom in web mercator meters"""
+    return 2 * MERCATOR_EXTENT / 2**zoom
+
+
+def tile_bounds(zoom: int, x: int, y: int) -> Tuple[float, float, float, float]:
+    """returns the web mercator bounds (min x, min y, max x, max y) of a tile"""
+    size = tile_size(zoom)
+    return (-MERCATOR_EXTENT + x * size, MERCATOR_EXTENT - (y + 1) * size,
+            -MERCATOR_EXTENT + (x + 1) * size, MERCATOR_EXTENT - y * size)
+
+
+def to_mercator(lon: float, lat: float) -> Tuple[float, float]:
+    """projects a longitude/latitude to web mercator meters, latitudes are clamped"""
+    lat = max(-MAX_LATITUDE, min(MAX_LATITUDE, lat))
+    return (MERCATOR_EXTENT * lon / 180,
+            MERCATOR_EXTENT / math.pi * math.log(
+                math.tan(math.pi / 4 + math.radians(lat) / 2)))
+
+
+def from_mercator(x: float, y: float) -> Tuple[float, float]:
+    """returns the longitude/latitude of web mercator meters"""
+    return (180 * x / MERCATOR_EXTENT,
+            math.degrees(2 * math.atan(math.exp(math.pi * y / MERCATOR_EXTENT)) -
+                         math.pi / 2))
+
+
+def cell_size(zoom: int) -> float:
+    """size of the aggregation cells of a zoom in web mercator meters,
+    GEOAPI_AGGREGATE_TILE_CELLS cells across a tile"""
+    return tile_size(zoom) / int(config.API_CONFIG['GEOAPI_AGGREGATE_TILE_CELLS'])
+
+
+def cells_in_bounds(lon_lat_bounds: Tuple[float, float, float, float],
+                    size: float) -> Tuple[range, range]:
+    """returns the column and row ranges of the grid cells of a size (web mercator meters)
+    intersecting longitude/latitude bounds"""
+    min_lon, min_lat, max_lon, max_lat = lon_lat_bounds
+    min_x, min_y = to_mercator(min_lon, min_lat)
+    max_x, max_y = to_mercator(max_lon, max_lat)
+    last = int(math.ceil(2 * MERCATOR_EXTENT / size)) - 1
+
+    def index(value: float) -> int:
+        return max(0, min(last, int(math.floor(value / size))))
+
+    return (range(index(min_x + MERCATOR_EXTENT),
+                  index(max_x + MERCATOR_EXTENT) + 1),
+            range(index(MERCATOR_EXTENT - max_y),
+                  index(MERCATOR_EXTENT - min_y) + 1))
+
+
+def cell_bounds(x: int, y: int, size: float) -> Tuple[float, float, float, float]:
+    """returns the longitude/latitude bounds (min lon, min lat, max lon, max lat) of a grid cell"""
+    min_lon, min_lat = from_mercator(-MERCATOR_EXTENT + x * size,
+                                     max(-MERCATOR_EXTENT, MERCATOR_EXTENT - (y + 1) * size))
+    max_lon, max_lat = from_mercator(min(MERCATOR_EXTENT, -MERCATOR_EXTENT + (x + 1) * size),
+                                     MERCATOR_EXTENT - y * size)
+    return (min_lon, min_lat, max_lon, max_lat)
+
+
+def tiles_in_bounds(zoom: int, bounds: Tuple[float, float, float, float],
+                    margin: float = 0) -> Tuple[range, range]:
+    """returns the column and row ranges of the tiles of a zoom intersecting
+    web mercator bounds grown by margin meters"""
+    size = tile_size(zoom)
+    last = 2**zoom - 1
+
+    def index(value: float) -> int:
+        return max(0, min(last, int(math.floor(value / size))))
+
+    min_x, min_y, max_x, max_y = bounds
+    return (range(index(min_x - margin + MERCATOR_EXTENT),
+                  index(max_x + margin + MERCATOR_EXTENT) + 1),
+            range(index(MERCATOR_EXTENT - max_y - margin),
+                  index(MERCATOR_EXTENT - min_y + margin) + 1))
+
+
+def get(key: Hashable) -> Optional[bytes]:
+    """returns a cached tile, None if it is not cached or older than GEOAPI_TILE_CACHE_MAX_AGE"""
+    cache = tile_cache()
+    entry = cache.get(key)
+    if entry is None:
+        return None
+    created_at, tile = entry
+    if time() - created_at > float(config.API_CONFIG['GEOAPI_TILE_CACHE_MAX_AGE']):
+        cache.discard(key)
+        return None
+    return tile
+
+
+def generation() -> int:
+    """returns the invalidation generation, to be passed to put with a tile read after this call"""
+    return _GENERATION
+
+
+def put(key: Hashable, tile: bytes, read_generation: int) -> None:
+    """caches a tile, unless an invalidation happened since read_generation"""
+    if read_generation == _GENERATION:
+        tile_cache().put(key, (time(), tile), len(tile))
+
+
+def _reaches() -> Dict[str, float]:
+    """tile formats in the cache and how far beyond a tile their content reaches,
+    as a share of the tile size (the vector tile buffer, the heatmap kernel radius)"""
+    return {
+        'mvt': int(config.API_CONFIG['GEOAPI_TILE_BUFFER']) /
+               int(config.API_CONFIG['GEOAPI_TILE_EXTENT']),
+        'png': int(config.API_CONFIG['GEOAPI_HEATMAP_RADIUS']) /
+               int(config.API_CONFIG['GEOAPI_HEATMAP_SIZE'])
+    }
+
+
+def invalidate(lon_lat_bounds: Tuple[float, float, float, float]) -> None:
+    """discards the cached tiles of every format and zoom within reach of longitude/latitude
+    bounds, clears the cache if that is more tiles than it can hold"""
+    global _GENERATION  # pylint: disable=global-statement
+    _GENERATION += 1
+    cache = tile_cache()
+    max_zoom = int(config.API_CONFIG['GEOAPI_TILE_MAX_ZOOM'])
+    min_lon, min_lat, max_lon, max_lat = lon_lat_bounds
+    bounds = to_mercator(min_lon, min_lat) + to_mercator(max_lon, max_lat)
+    keys = []
+    for tile_format, reach in _reaches().items():
+        for zoom in range(max_zoom + 1):
+            columns, rows = tiles_in_bounds(zoom, bounds, tile_size(zoom) * reach)
+            if len(keys) + len(columns) * len(rows) > cache.stats()['max_entries']:
+                cache.clear()
+                return
+            keys.extend((tile_format, zoom, x, y) for x in columns for y in rows)
+    for key in keys:
+        cache.discard(key)
+
+
+def clear() -> None:
+    """discards all cached tiles"""
+    global _GENERATION  # pylint: disable=global-statement
+    _GENERATION += 1
+    tile_cache().clear()
@@ -0,0 +1,169 @@
+"""Process Pools for CPU bound work
+
+Work such as image decoding and encoding is run in worker processes so that it never blocks
+the event loop. Each pool bounds the number of jobs in flight (queued or running),
+rejects work beyond that bound and times out jobs that take too long.
+
+A worker process that dies (e.g. out of memory on a huge image) breaks the whole executor
+and fails every job in it. The pool then starts a new executor and runs the failed jobs
+once more, one at a time in a process of their own, so only the job that kills its worker
+fails. A timed out job keeps its worker busy, so its executor is replaced as well and its
+processes are stopped, the other jobs in it are run again the same way.
+"""
+
+import asyncio
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, Dict, Optional
+import geoapi.config.api_configurator as config
+from geoapi.common.exceptions import ServiceUnavailableError, ResourceTimeoutError
+
+# shared pool for image conversion, see get_image_pool()
+_IMAGE_POOL: Optional['WorkerPool'] = None
+
+
+def get_image_pool() -> 'WorkerPool':
+    """returns the shared image conversion pool, created from the configuration on first use"""
+    global _IMAGE_POOL  # pylint: disable=global-statement
+    if _IMAGE_POOL is None:
+        _IMAGE_POOL = WorkerPool(
+            name='image_pool',
+            max_workers=int(config.API_CONFIG['GEOAPI_IMAGE_POOL_WORKERS']),
+            max_pending=int(config.API_CONFIG['GEOAPI_IMAGE_POOL_MAX_PENDING']),
+            timeout=float(config.API_CONFIG['GEOAPI_IMAGE_POOL_TIMEOUT']))
+    return _IMAGE_POOL
+
+
+def shutdown_pools() -> None:
+    """shuts down the shared pools, called on api shutdown"""
+    global _IMAGE_POOL  # pylint: disable=global-statement
+    if _IMAGE_POOL is not None:
+        _IMAGE_POOL.shutdown()
+        _IMAGE_POOL = None
+
+
+class WorkerPool():
+    """Process pool with a bounded number of jobs in flight and per job timeouts"""
+
+    def __init__(self, name: str, max_workers: int, max_pending: int,
+                 timeout: float):
+        self._name = name
+        self._max_workers = max_workers
+        self._max_pending = max_pending
+        self._timeout = timeout
+        self._executor = ProcessPoolExecutor(max_workers=max_workers)
+        # jobs submitted and not finished, the processes of a timed out job are stopped
+        self._pending = 0
+        self._counters = {
+            'completed': 0,
+            'failed': 0,
+            'rejected': 0,
+            'timeouts': 0,
+            'retries': 0,
+            'restarts': 0
+        }
+        # jobs run again after a worker died, one at a time
+        self._isolation_lock = asyncio.Lock()
+        self.logger = logging.getLogger(__name__)
+
+    def _restart(self, executor: ProcessPoolExecutor) -> None:
+        """replaces a broken or blocked executor, unless a failed job already replaced it"""
+        if executor is self._executor:
+            self._counters['restarts'] += 1
+            self._executor = ProcessPoolExecutor(max_workers=self._max_workers)
+
+    @staticmethod
+    def _stop(executor: ProcessPoolExecutor) -> None:
+        """stops the processes of an executor, there is no api to stop a running job.
+        The executor breaks and cleans up by itself, its other jobs fail with BrokenProcessPool"""
+        for process in list(executor._processes.values()):  # pylint: disable=protected-access
+            process.terminate()
+
+    async def _run_in(self, executor: ProcessPoolExecutor, func: Callable[..., Any],
+                      *args: Any) -> Any:
+        """runs func(*args) in an executor, stops the executor if the job times out"""
+        try:
+            return await asyncio.wait_for(
+                asyncio.get_event_loop().run_in_executor(executor, func, *args),
+                self._timeout)
+        except asyncio.TimeoutError:
+            self._counters['timeouts'] += 1
+            self._restart(executor)
+            self._stop(executor)
+            msg = '{} job timed out after {} sec'.format(self._name,
+                                                         self._timeout)
+            self.logger.error(msg)
+            raise ResourceTimeoutError(msg)
+
+    async def _run_isolated(self, func: Callable[..., Any], *args: Any) -> Any:
+        """runs func(*args) alone in a process of its own, one job at a time"""
+        async with self._isolation_lock:
+            executor = ProcessPoolExecutor(max_workers=1)
+            stopped = False
+            try:
+                return await self._run_in(executor, func, *args)
+            except BrokenProcessPool:
+                stopped = True
+                msg = '{} job failed, its worker process died'.format(self._name)
+                self.logger.error(msg)
+                raise ServiceUnavailableError(msg)
+            except ResourceTimeoutError:
+                stopped = True
+                raise
+            finally:
+                if not stopped:
+                    executor.shutdown(wait=False)
+
+    async def run(self, func: Callable[..., Any], *args: Any) -> Any:
+        """Runs func(*args) in a worker process
+
+        Args:
+            func (Callable): picklable module level function
+            *args: picklable arguments
+
+        Raises:
+            ServiceUnavailableError: if the pool already has max_pending jobs in flight
+                or the job kills its worker process
+            ResourceTimeoutError: if the job does not finish within the timeout
+
+        Returns:
+            Any: the result of func
+        """
+        if self._pending >= self._max_pending:
+            self._counters['rejected'] += 1
+            msg = '{} is saturated - {} jobs in flight'.format(
+                self._name, self._pending)
+            self.logger.error(msg)
+            raise ServiceUnavailableError(msg)
+        self._pending += 1
+        try:
+            executor = self._executor
+            try:
+                result = await self._run_in(executor, func, *args)
+            except BrokenProcessPool:
+                # a worker died and failed every job of the executor, each is run again alone
+                # so a job that kills its worker again only fails itself
+                self._restart(executor)
+                self._counters['retries'] += 1
+                result = await self._run_isolated(func, *args)
+        except Exception:
+            self._counters['failed'] += 1
+            raise
+        finally:
+            self._pending -= 1
+        self._counters['completed'] += 1
+        return result
+
+    def shutdown(self) -> None:
+        """stops the worker processes"""
+        self._executor.shutdown(wait=False)
+
+    def stats(self) -> Dict[str, Any]:
+        """returns pool counters and saturation (jobs in flight / max_pending)"""
+        return dict(self._counters,
+                    workers=self._max_workers,
+                    pending=self._pending,
+                    max_pending=self._max_pending,
+                    saturation=round(self._pending / self._max_pending, 4)
+                    if self._max_pending else 1.0)
@@ -0,0 +1,37 @@
+"""
+configuration and logging setup shared by the api (geoapi.main) and the command line tools
+- kept apart from geoapi.main so the tools load the configuration without importing the api
+"""
+
+import logging
+from pathlib import Path
+import geoapi.config.api_configurator as config
+import geoapi.log.api_logger as api_logger
+
+
+def init() -> logging.Logger:
+    """Loads the configuration and sets up logging
+
+    Returns:
+        logging.Logger: the configured root logger
+    """
+
+    # get api configuration
+    # - default embedded config file path
+    embedded_config_ini_filepath: Path = Path('geoapi/config/config.ini')
+    # environmental variable for external config file path (if not using default above)
+    config_ini_env_key: str = 'GEOAPI_CONFIG_INI'
+    api_config, external_config_load_error = config.init(
+        embedded_config_ini_filepath, config_ini_env_key)
+    # set the global config dictionary so other modules can import and use it
+    config.API_CONFIG = api_config
+
+    # get logging
+    api_log_level = config.API_CONFIG['GEOAPI_LOG_LEVEL']
+    levelnum = logging.getLevelName(api_log_level.upper())
+    logger = api_logger.init(level=levelnum)
+    if external_config_load_error:
+        logger.error(
+            'Unable to load external supplied config.ini file. \
+            Using default embedded config.ini file')
+    return logger
@@ -1,16 +1,19 @@
 """Command Object for all commands that modify Real Property table data
 """
 
+import json
 import logging
 import decimal
-from typing import Optional, List
+from typing import Optional, List, Tuple, Set, Any
 from dataclasses import dataclass, asdict
 import databases
 import sqlalchemy
 from geoalchemy2.types import WKBElement
 from asyncpg.exceptions import UniqueViolationError
 import geoapi.common.spatial_utils as spatial_utils
+import geoapi.common.tiles as tiles
 from geoapi.common.json_models import RealPropertyIn
+from geoapi.data.geocode_replica import NOTIFY_CHANNEL, notify_payloads
 
 
 @dataclass
@@ -44,8 +47,40 @@ class RealPropertyDB():
                    image_url=real_property_in.image_url)
 
 
-# pylint: disable=too-few-public-methods
-# (there will be more in the future)
+def _wkb_bytes(geoalchemy_element: Optional[WKBElement]) -> Optional[bytes]:
+    """returns the wkb of a geoalchemy element as bytes for binary COPY"""
+    if geoalchemy_element is None:
+        return None
+    return bytes(geoalchemy_element.data)
+
+
+# length of the id column of the properties table (and of the bulk staging table)
+MAX_ID_LENGTH = 100
+
+# staging table for bulk inserts, geographies are copied as wkb
+_BULK_TABLE = 'properties_bulk'
+_BULK_COLUMNS = ['id', 'geocode_geo', 'parcel_geo', 'building_geo',
+                 'image_bounds', 'image_url']
+_CREATE_BULK_TABLE = """
+    CREATE TEMPORARY TABLE {bulk_table} (
+        id varchar(100) NOT NULL,
+        geocode_geo bytea NULL,
+        parcel_geo bytea NULL,
+        building_geo bytea NULL,
+        image_bounds float8[] NULL,
+        image_url text NULL
+    ) ON COMMIT DROP
+"""
+_INSERT_FROM_BULK = """
+    INSERT INTO {table} (id, geocode_geo, parcel_geo, building_geo, image_bounds, image_url)
+    SELECT id, ST_GeogFromWKB(geocode_geo), ST_GeogFromWKB(parcel_geo),
+        ST_GeogFromWKB(building_geo), image_bounds, image_url
+    FROM {bulk_table}
+    ON CONFLICT (id) DO NOTHING
+    RETURNING id
+"""
+
+
 class RealPropertyCommands():
     """Repository for all DB Transaction Operations
     Different from the repository for all query operations."""
@@ -75,6 +110,13 @@ class RealPropertyCommands():
         transaction = await self._connection.transaction()
         try:
             await self._connection.execute(insert_query)
+            # delivered on commit, keeps geocode replicas current
+            await self._connection.execute(
+                'SELECT pg_notify(:channel, :payload)',
+                values={
+                    'channel': NOTIFY_CHANNEL,
+                    'payload': json.dumps([real_property_db.id])
+                })
         except UniqueViolationError as uve:
             self.logger.error('Duplicate id - details: %s', uve.as_dict())
             await transaction.rollback()
@@ -86,4 +128,76 @@ class RealPropertyCommands():
             raise
         else:
             await transaction.commit()
+            property_bounds = spatial_utils.bounds([
+                real_property_in.geocode_geo, real_property_in.parcel_geo,
+                real_property_in.building_geo
+            ])
+            if property_bounds is not None:
+                tiles.invalidate(property_bounds)
             return True
+
+    @staticmethod
+    def to_copy_record(real_property_db: RealPropertyDB) -> Tuple[Any, ...]:
+        """returns a record for binary COPY into the bulk staging table"""
+        return (real_property_db.id,
+                _wkb_bytes(real_property_db.geocode_geo),
+                _wkb_bytes(real_property_db.parcel_geo),
+                _wkb_bytes(real_property_db.building_geo),
+                real_property_db.image_bounds,
+                real_property_db.image_url)
+
+    @classmethod
+    def to_valid_copy_record(cls, real_property_in: RealPropertyIn) -> Tuple[Any, ...]:
+        """returns a record for binary COPY into the bulk staging table,
+        checking what pydantic does not: the geometries convert to wkb and the id fits the table
+
+        Raises:
+            ValueError: if the id is longer than MAX_ID_LENGTH or a geometry is malformed
+        """
+        if len(real_property_in.id) > MAX_ID_LENGTH:
+            raise ValueError('id is longer than {} characters'.format(MAX_ID_LENGTH))
+        try:
+            real_property_db = RealPropertyDB.from_real_property_in(real_property_in)
+        except Exception as exc:  # pylint: disable=broad-except
+            # shapely raises anything from KeyError to IndexError for malformed geojson
+            raise ValueError('invalid geometry: {}'.format(str(exc) or type(exc).__name__))
+        return cls.to_copy_record(real_property_db)
+
+    async def copy_records(self, records: List[Tuple[Any, ...]]) -> Set[str]:
+        """Copies records made by to_copy_record into the Real Property Table in one transaction
+
+        Args:
+            records (List[Tuple[Any, ...]]): copy records, ids must be unique within the list
+
+        Returns:
+            Set[str]: ids that were inserted, ids that already exist are skipped
+        """
+
+        async with self._connection.connection() as connection:
+            # asyncpg connection for COPY
+            raw_connection = connection.raw_connection
+            transaction = await connection.transaction()
+            try:
+                await raw_connection.execute(
+                    _CREATE_BULK_TABLE.format(bulk_table=_BULK_TABLE))
+                await raw_connection.copy_records_to_table(
+                    _BULK_TABLE, records=records, columns=_BULK_COLUMNS)
+                created_rows = await raw_connection.fetch(
+                    _INSERT_FROM_BULK.format(
+                        table=self._real_property_table.name,
+                        bulk_table=_BULK_TABLE))
+                if created_rows:
+                    # the new ids packed in a few notifications, keeps geocode replicas current
+                    await raw_connection.execute(
+                        'SELECT pg_notify($1, payload) FROM unnest($2::text[]) AS payload',
+                        NOTIFY_CHANNEL,
+                        notify_payloads(created_row['id'] for created_row in created_rows))
+            except Exception as exc:
+                self.logger.exception(str(exc))
+                await transaction.rollback()
+                raise
+            else:
+                await transaction.commit()
+        if created_rows:
+            tiles.clear()
+        return {created_row['id'] for created_row in created_rows}
@@ -7,12 +7,16 @@ Returns:
         command and query objects for each table
 """
 
+from typing import Optional
 import databases
 import sqlalchemy
 from sqlalchemy.dialects import postgresql
-from geoalchemy2.types import Geography
+from geoalchemy2.types import Geography, Geometry
 from geoapi.data.queries import RealPropertyQueries
+from geoapi.data.map_queries import MapQueries
 from geoapi.data.commands import RealPropertyCommands
+from geoapi.data.geocode_replica import GeocodeReplica
+import geoapi.config.api_configurator as config
 
 
 class DB():
@@ -38,9 +42,27 @@ class DB():
                               postgresql.ARRAY(postgresql.DOUBLE_PRECISION),
                               nullable=True),
             sqlalchemy.Column("image_url", sqlalchemy.String, nullable=True),
+            # derived columns maintained by the db on write, see geoapi.data.migrations
+            sqlalchemy.Column("parcel_area",
+                              postgresql.DOUBLE_PRECISION,
+                              nullable=True),
+            sqlalchemy.Column("building_area",
+                              postgresql.DOUBLE_PRECISION,
+                              nullable=True),
+            sqlalchemy.Column("bbox",
+                              Geometry(geometry_type='GEOMETRY', srid=4326),
+                              nullable=True),
+            sqlalchemy.Column("change_txid", sqlalchemy.BigInteger, nullable=True),
+            sqlalchemy.Column("modified_at",
+                              sqlalchemy.DateTime(timezone=True),
+                              nullable=True),
         )
+        self._geocode_replica = GeocodeReplica(
+            database_url, real_property_table.name) if int(
+                config.API_CONFIG['GEOAPI_GEOCODE_REPLICA']) else None
         self._real_property_queries = RealPropertyQueries(
-            self._connection, real_property_table)
+            self._connection, real_property_table, self._geocode_replica)
+        self._map_queries = MapQueries(self._connection, real_property_table)
         self._real_property_commands = RealPropertyCommands(
             self._connection, real_property_table)
 
@@ -53,6 +75,15 @@ class DB():
         """
         return self._connection
 
+    @property
+    def geocode_replica(self) -> Optional[GeocodeReplica]:
+        """In-memory replica of the property geocodes, None unless GEOAPI_GEOCODE_REPLICA is 1
+
+        Returns:
+            Optional[GeocodeReplica]: replica to start and stop with the api
+        """
+        return self._geocode_replica
+
     @property
     def real_property_queries(self) -> RealPropertyQueries:
         """Query Object for the Real Property SQL Alchemy Table
@@ -63,6 +94,16 @@ class DB():
         """
         return self._real_property_queries
 
+    @property
+    def map_queries(self) -> MapQueries:
+        """Query Object for the maps of the Real Property SQL Alchemy Table
+        Provides access to the aggregation, vector tile and heatmap queries
+
+        Returns:
+            MapQueries: Read Only Map Queries to the Real Property Table
+        """
+        return self._map_queries
+
     @property
     def real_property_commands(self) -> RealPropertyCommands:
         """Command Object for the Real Property SQL Alchemy Table
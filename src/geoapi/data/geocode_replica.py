@@ -0,0 +1,370 @@
+"""In-Memory Replica of the Property Geocodes
+
+An optional in-process spatial index that answers find queries without a db round trip.
+Property ids and geocode longitudes/latitudes are held in compact arrays, indexed by a
+shapely STRtree. The replica is loaded from the properties table on startup and kept current
+with Postgres LISTEN/NOTIFY: inserts notify NOTIFY_CHANNEL with a json array of the new
+property ids (see notify_payloads), updates of geocodes and deletions notify an empty payload
+(a trigger, see geoapi.data.migrations), which triggers a full reload.
+Notifications are applied a burst at a time: all queued payloads are read with one query
+for their ids, or with one reload if any of them is empty.
+
+The STRtree is immutable, so new and changed geocodes are held in a small pending list that
+is scanned linearly, replaced or removed geocodes are masked out of the tree, and both are
+merged into a rebuilt tree once they reach GEOAPI_GEOCODE_REPLICA_REBUILD_SIZE.
+
+The replica is stale while its LISTEN connection is down or notifications wait to be applied,
+find falls back to the db once the staleness exceeds GEOAPI_GEOCODE_REPLICA_MAX_STALENESS seconds.
+"""
+
+import asyncio
+import json
+import logging
+import math
+from collections import deque
+from time import time
+from typing import Any, Deque, Dict, Iterable, List, Optional, Set, Tuple
+import asyncpg
+import numpy as np
+import pyproj
+import shapely
+from shapely import geometry
+from shapely.ops import transform
+from shapely.strtree import STRtree
+import geoapi.config.api_configurator as config
+import geoapi.common.projections as projections
+
+# channel of the property write notifications, payload is a json array of property ids
+# or empty if any geocode may have changed
+NOTIFY_CHANNEL = 'properties_geocode'
+# notification payloads must be shorter than 8000 bytes
+_MAX_PAYLOAD_BYTES = 7999
+
+_LOAD = """
+    SELECT id, ST_X(geocode_geo::geometry) AS lon, ST_Y(geocode_geo::geometry) AS lat
+    FROM {table}
+    WHERE geocode_geo IS NOT NULL
+"""
+_LOAD_IDS = _LOAD + ' AND id = ANY($1::text[])'
+
+# shortest meridian degree in meters (at the equator), for a search box that is never too small
+_METERS_PER_DEGREE = 110574.0
+# geodesic distances on the ellipsoid used by geography ST_DWithin
+_GEOD = pyproj.Geod(ellps='WGS84')
+# STRtree.query returns the positions of the hits from shapely 2 on, the indexed geometries before
+_QUERY_RETURNS_POSITIONS = int(shapely.__version__.split('.')[0]) >= 2
+
+
+def notify_payloads(property_ids: Iterable[str]) -> List[str]:
+    """packs property ids into as few notification payloads as fit the payload size limit"""
+    payloads = []
+    batch: List[str] = []
+    for property_id in property_ids:
+        if batch and len(json.dumps(batch + [property_id]).encode()) > _MAX_PAYLOAD_BYTES:
+            payloads.append(json.dumps(batch))
+            batch = []
+        batch.append(property_id)
+    if batch:
+        payloads.append(json.dumps(batch))
+    return payloads
+
+
+class _Snapshot():
+    """immutable indexed geocodes"""
+
+    def __init__(self, ids: List[str], lons: np.ndarray, lats: np.ndarray):
+        self.ids = ids
+        self.lons = lons
+        self.lats = lats
+        self.points = [geometry.Point(lon, lat) for lon, lat in zip(lons, lats)]
+        self.tree = STRtree(self.points)
+        if not _QUERY_RETURNS_POSITIONS:
+            # the tree returns the indexed point objects themselves, mapped back by identity
+            self.positions = {id(point): position for position, point in enumerate(self.points)}
+
+    def query(self, search_box) -> np.ndarray:
+        """array positions of the geocodes in a lon/lat box"""
+        hits = self.tree.query(search_box)
+        if _QUERY_RETURNS_POSITIONS:
+            return np.asarray(hits, dtype=np.int64)
+        return np.fromiter((self.positions[id(point)] for point in hits),
+                           dtype=np.int64)
+
+
+class GeocodeReplica():
+    """In-memory replica of the property geocodes, see module docs"""
+
+    def __init__(self, database_url: str, table_name: str):
+        self._database_url = database_url
+        self._table_name = table_name
+        self._max_distance = int(
+            config.API_CONFIG['GEOAPI_GEOCODE_REPLICA_MAX_DISTANCE'])
+        self._max_staleness = float(
+            config.API_CONFIG['GEOAPI_GEOCODE_REPLICA_MAX_STALENESS'])
+        self._rebuild_size = int(
+            config.API_CONFIG['GEOAPI_GEOCODE_REPLICA_REBUILD_SIZE'])
+        self._snapshot = _Snapshot([], np.empty(0), np.empty(0))
+        self._known_ids: Set[str] = set()
+        # geocodes notified since the last tree build
+        self._pending_ids: List[str] = []
+        self._pending_lons: List[float] = []
+        self._pending_lats: List[float] = []
+        # ids in the tree whose geocode was changed or removed since the last tree build
+        self._masked_ids: Set[str] = set()
+        self._listener: Optional[asyncpg.Connection] = None
+        # received time and payload of the notifications not applied yet
+        self._notifications: Deque[Tuple[float, str]] = deque()
+        self._notified: Optional[asyncio.Event] = None
+        # received time of the oldest notification of the burst being applied
+        self._applying_since: Optional[float] = None
+        self._task: Optional['asyncio.Future[None]'] = None
+        self._loaded_at: Optional[float] = None
+        # None while listening, otherwise the time since the replica may have missed writes
+        self._stale_since: Optional[float] = time()
+        self._counters = {
+            'answered': 0,
+            'fallbacks': 0,
+            'notifications': 0,
+            'bursts': 0,
+            'rebuilds': 0,
+            'reloads': 0
+        }
+        self.logger = logging.getLogger(__name__)
+
+    async def start(self) -> None:
+        """loads the replica and starts listening for writes, a failed load is retried
+        in the background and find falls back to the db until it succeeds"""
+        self._notified = asyncio.Event()
+        try:
+            await self._connect_and_load()
+        except Exception as exc:  # pylint: disable=broad-except
+            # logged and retried, the api works without the replica
+            self.logger.error('geocode replica load failed: %s', str(exc))
+        self._task = asyncio.ensure_future(self._run())
+
+    async def stop(self) -> None:
+        """stops listening and closes the listener connection"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self._close_listener()
+
+    def _on_notification(self, connection, pid, channel, payload) -> None:  # pylint: disable=unused-argument
+        self._notifications.append((time(), payload))
+        self._notified.set()
+
+    async def _close_listener(self) -> None:
+        if self._listener is not None and not self._listener.is_closed():
+            await self._listener.close()
+        self._listener = None
+
+    async def _connect_and_load(self) -> None:
+        """listens first, so writes made during the load are applied afterwards"""
+        await self._close_listener()
+        self._listener = await asyncpg.connect(self._database_url)
+        await self._listener.add_listener(NOTIFY_CHANNEL, self._on_notification)
+        await self._reload()
+        self._stale_since = None
+
+    async def _reload(self) -> None:
+        # the load covers every write notified so far, later ones are applied after it
+        self._notifications.clear()
+        db_rows = await self._listener.fetch(
+            _LOAD.format(table=self._table_name))
+        ids = [db_row['id'] for db_row in db_rows]
+        lons = np.array([db_row['lon'] for db_row in db_rows], dtype=np.float64)
+        lats = np.array([db_row['lat'] for db_row in db_rows], dtype=np.float64)
+        snapshot = await asyncio.get_event_loop().run_in_executor(
+            None, _Snapshot, ids, lons, lats)
+        self._snapshot = snapshot
+        self._known_ids = set(ids)
+        self._pending_ids, self._pending_lons, self._pending_lats = [], [], []
+        self._masked_ids = set()
+        self._loaded_at = time()
+        self._counters['reloads'] += 1
+        self.logger.info('geocode replica loaded: %d geocodes', len(ids))
+
+    async def _rebuild(self) -> None:
+        """merges the pending geocodes into a new tree without the masked ones,
+        built off the event loop"""
+        snapshot = self._snapshot
+        kept = np.array([property_id not in self._masked_ids for property_id in snapshot.ids],
+                        dtype=bool)
+        ids = [property_id for property_id, is_kept in zip(snapshot.ids, kept)
+               if is_kept] + self._pending_ids
+        lons = np.concatenate([snapshot.lons[kept], self._pending_lons])
+        lats = np.concatenate([snapshot.lats[kept], self._pending_lats])
+        self._snapshot = await asyncio.get_event_loop().run_in_executor(
+            None, _Snapshot, ids, lons, lats)
+        self._pending_ids, self._pending_lons, self._pending_lats = [], [], []
+        self._masked_ids = set()
+        self._counters['rebuilds'] += 1
+
+    def _remove(self, property_ids: Set[str]) -> None:
+        """drops the geocodes of properties, from the pending list or masked in the tree"""
+        removed = property_ids & self._known_ids
+        if not removed:
+            return
+        self._known_ids -= removed
+        kept = [position for position, property_id in enumerate(self._pending_ids)
+                if property_id not in removed]
+        self._pending_ids = [self._pending_ids[position] for position in kept]
+        self._pending_lons = [self._pending_lons[position] for position in kept]
+        self._pending_lats = [self._pending_lats[position] for position in kept]
+        self._masked_ids |= removed
+
+    async def _refresh(self, property_ids: Set[str]) -> None:
+        """replaces the geocodes of properties with their current ones, if any"""
+        db_rows = await self._listener.fetch(
+            _LOAD_IDS.format(table=self._table_name), list(property_ids))
+        self._remove(property_ids)
+        for db_row in db_rows:
+            self._known_ids.add(db_row['id'])
+            self._pending_ids.append(db_row['id'])
+            self._pending_lons.append(db_row['lon'])
+            self._pending_lats.append(db_row['lat'])
+        if len(self._pending_ids) + len(self._masked_ids) >= self._rebuild_size:
+            await self._rebuild()
+
+    async def _apply_burst(self) -> None:
+        """applies all queued write notifications, with one query or reload"""
+        self._applying_since = self._notifications[0][0]
+        payloads = [payload for _, payload in self._notifications]
+        self._notifications.clear()
+        self._counters['notifications'] += len(payloads)
+        self._counters['bursts'] += 1
+        try:
+            if not all(payloads):
+                await self._reload()
+            else:
+                await self._refresh({property_id for payload in payloads
+                                     for property_id in json.loads(payload)})
+        finally:
+            self._applying_since = None
+
+    async def _run(self) -> None:
+        """applies notifications, reconnects and reloads if the listener connection is lost"""
+        while True:
+            try:
+                if self._listener is None or self._listener.is_closed():
+                    await self._connect_and_load()
+                if not self._notifications:
+                    self._notified.clear()
+                    try:
+                        await asyncio.wait_for(self._notified.wait(), timeout=5)
+                    except asyncio.TimeoutError:
+                        continue
+                await self._apply_burst()
+            except asyncio.CancelledError:
+                raise
+            except Exception as exc:  # pylint: disable=broad-except
+                # logged and retried, find falls back to the db while stale
+                self.logger.error('geocode replica listener failed: %s',
+                                  str(exc))
+                if self._stale_since is None:
+                    self._stale_since = time()
+                await self._close_listener()
+                await asyncio.sleep(5)
+
+    def staleness(self) -> float:
+        """seconds since the replica may have missed writes (the listener is down) or since
+        the oldest notification that is not applied yet, 0 while it is current"""
+        if self._stale_since is None and self._listener is not None and self._listener.is_closed():
+            self._stale_since = time()
+        if self._applying_since is not None:
+            unapplied_since: Optional[float] = self._applying_since
+        else:
+            unapplied_since = self._notifications[0][0] if self._notifications else None
+        since = [at for at in (self._stale_since, unapplied_since) if at is not None]
+        return time() - min(since) if since else 0.0
+
+    def find(self, location_geo: Dict, distance: int) -> Optional[List[str]]:
+        """Searches for properties with a geocode within a given distance of a geometry
+
+        Args:
+            location_geo (Dict): geojson geometry
+            distance (int): distance in meters
+
+        Returns:
+            Optional[List[str]]: list of property ids, None if the replica cannot answer
+                (not loaded, too stale, distance above GEOAPI_GEOCODE_REPLICA_MAX_DISTANCE
+                or a search area crossing the antimeridian or near the poles)
+        """
+
+        if (self._loaded_at is None or distance > self._max_distance or
+                self.staleness() > self._max_staleness):
+            self._counters['fallbacks'] += 1
+            return None
+        shapely_geometry = geometry.shape(location_geo)
+        min_x, min_y, max_x, max_y = shapely_geometry.bounds
+        delta_lat = distance / _METERS_PER_DEGREE
+        max_abs_lat = max(abs(min_y), abs(max_y)) + delta_lat
+        if max_abs_lat > 85:
+            self._counters['fallbacks'] += 1
+            return None
+        delta_lon = delta_lat / math.cos(math.radians(max_abs_lat))
+        if min_x - delta_lon < -180 or max_x + delta_lon > 180:
+            self._counters['fallbacks'] += 1
+            return None
+        search_box = geometry.box(min_x - delta_lon, min_y - delta_lat,
+                                  max_x + delta_lon, max_y + delta_lat)
+
+        # candidates in the search box, from the tree and the pending geocodes
+        snapshot = self._snapshot
+        positions = snapshot.query(search_box)
+        if self._masked_ids:
+            positions = np.array([position for position in positions
+                                  if snapshot.ids[position] not in self._masked_ids],
+                                 dtype=np.int64)
+        pending_lons = np.array(self._pending_lons, dtype=np.float64)
+        pending_lats = np.array(self._pending_lats, dtype=np.float64)
+        pending_positions = np.flatnonzero(
+            (pending_lons >= search_box.bounds[0]) &
+            (pending_lons <= search_box.bounds[2]) &
+            (pending_lats >= search_box.bounds[1]) &
+            (pending_lats <= search_box.bounds[3]))
+        ids = ([snapshot.ids[position] for position in positions] +
+               [self._pending_ids[position] for position in pending_positions])
+        lons = np.concatenate([snapshot.lons[positions],
+                               pending_lons[pending_positions]])
+        lats = np.concatenate([snapshot.lats[positions],
+                               pending_lats[pending_positions]])
+        self._counters['answered'] += 1
+        if not ids:
+            return []
+
+        # exact distances - geodesic for a point, in the local projected crs otherwise
+        if shapely_geometry.geom_type == 'Point':
+            _, _, distances = _GEOD.inv(np.full(len(ids), shapely_geometry.x),
+                                        np.full(len(ids), shapely_geometry.y),
+                                        lons, lats)
+            within = np.asarray(distances) <= distance
+        else:
+            project = projections.get_transformer(
+                projections.source_crs(),
+                projections.projected_crs_for_geometry(shapely_geometry))
+            geometry_projected = transform(project.transform, shapely_geometry)
+            xs, ys = project.transform(lons, lats)
+            within = np.array([
+                geometry_projected.distance(geometry.Point(x, y)) <= distance
+                for x, y in zip(xs, ys)
+            ])
+        return [property_id for property_id, is_within in zip(ids, within)
+                if is_within]
+
+    def stats(self) -> Dict[str, Any]:
+        """returns replica counters, size and staleness"""
+        staleness = self.staleness()
+        return dict(self._counters,
+                    entries=len(self._known_ids),
+                    pending=len(self._pending_ids),
+                    masked=len(self._masked_ids),
+                    backlog=len(self._notifications),
+                    listening=self._stale_since is None,
+                    staleness_seconds=round(staleness, 3),
+                    seconds_since_load=round(time() - self._loaded_at, 3)
+                    if self._loaded_at is not None else None)
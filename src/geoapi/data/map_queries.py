@@ -0,0 +1,279 @@
+"""Query Object for the map queries of the Real Property table:
+aggregation grid cells, vector tiles and heatmap tiles
+"""
+
+import logging
+from typing import List, Tuple
+import databases
+import sqlalchemy
+import geoapi.config.api_configurator as config
+import geoapi.common.spatial_utils as spatial_utils
+import geoapi.common.tiles as tiles
+import geoapi.common.heatmap as heatmap
+import geoapi.common.worker_pool as worker_pool
+from geoapi.common.exceptions import ResourceNotFoundError
+from geoapi.common.json_models import AggregateCellOut
+
+# Mapbox vector tile with the layers parcels, buildings (id and area properties) and geocodes (id)
+# of the web mercator tile with bounds xmin, ymin, xmax, ymax.
+# Properties are selected with the bbox column (index assisted, see geoapi.data.migrations)
+# against the tile grown by margin meters, the tile buffer. Polygons are simplified
+# by tolerance meters (zoom dependent) and left out below the polygon zoom (polygons false).
+# ST_AsMVTGeom clips to the buffered tile and returns NULL for geometries outside it.
+_TILE = """
+    WITH bounds AS (
+        SELECT ST_MakeEnvelope(:xmin, :ymin, :xmax, :ymax, 3857) AS tile
+    ), property AS (
+        SELECT property.id, property.geocode_geo, property.parcel_geo, property.building_geo,
+            property.parcel_area, property.building_area
+        FROM {table} AS property, bounds
+        WHERE property.bbox && ST_Transform(ST_Expand(bounds.tile, :margin), 4326)
+    ), parcels AS (
+        SELECT property.id, round(property.parcel_area)::bigint AS area,
+            ST_AsMVTGeom(
+                ST_SimplifyPreserveTopology(ST_Transform(property.parcel_geo::geometry, 3857),
+                                            :tolerance),
+                bounds.tile::box2d, :extent, :buffer, true) AS geom
+        FROM property, bounds
+        WHERE :polygons AND property.parcel_geo IS NOT NULL
+    ), buildings AS (
+        SELECT property.id, round(property.building_area)::bigint AS area,
+            ST_AsMVTGeom(
+                ST_SimplifyPreserveTopology(ST_Transform(property.building_geo::geometry, 3857),
+                                            :tolerance),
+                bounds.tile::box2d, :extent, :buffer, true) AS geom
+        FROM property, bounds
+        WHERE :polygons AND property.building_geo IS NOT NULL
+    ), geocodes AS (
+        SELECT property.id,
+            ST_AsMVTGeom(ST_Transform(property.geocode_geo::geometry, 3857),
+                         bounds.tile::box2d, :extent, :buffer, true) AS geom
+        FROM property, bounds
+        WHERE property.geocode_geo IS NOT NULL
+    )
+    SELECT
+        COALESCE((SELECT ST_AsMVT(parcels, 'parcels', :extent, 'geom')
+                  FROM parcels WHERE parcels.geom IS NOT NULL), '')
+        || COALESCE((SELECT ST_AsMVT(buildings, 'buildings', :extent, 'geom')
+                     FROM buildings WHERE buildings.geom IS NOT NULL), '')
+        || COALESCE((SELECT ST_AsMVT(geocodes, 'geocodes', :extent, 'geom')
+                     FROM geocodes WHERE geocodes.geom IS NOT NULL), '') AS tile
+"""
+
+# properties with a geocode aggregated per web mercator grid cell of cell_size meters,
+# for the cells with column min_x to max_x and row min_y to max_y (lon/lat bounds
+# min_lon to max_lat), see geoapi.common.tiles. Cell sizes with a precomputed summary
+# (see geoapi.data.summary) are read from property_cells, others are aggregated on the fly
+# with the bbox index. The summary check is a one time filter, only one branch runs.
+_AGGREGATE = """
+    WITH summary AS (
+        SELECT EXISTS (
+            SELECT 1 FROM property_cell_sizes WHERE cell_size = :cell_size) AS available
+    )
+    SELECT cell.x, cell.y, cell.property_count, cell.parcel_area, cell.building_area
+    FROM property_cells AS cell
+    WHERE (SELECT available FROM summary)
+        AND cell.cell_size = :cell_size AND cell.property_count > 0
+        AND cell.x BETWEEN :min_x AND :max_x AND cell.y BETWEEN :min_y AND :max_y
+    UNION ALL
+    SELECT cell.x, cell.y, count(*), COALESCE(SUM(property.parcel_area), 0),
+        COALESCE(SUM(property.building_area), 0)
+    FROM {table} AS property
+    CROSS JOIN LATERAL mercator_cell(property.geocode_geo, :cell_size) AS cell
+    WHERE NOT (SELECT available FROM summary)
+        AND property.bbox && ST_MakeEnvelope(:min_lon, :min_lat, :max_lon, :max_lat, 4326)
+        AND cell.x BETWEEN :min_x AND :max_x AND cell.y BETWEEN :min_y AND :max_y
+    GROUP BY cell.x, cell.y
+    ORDER BY y, x
+"""
+
+# building areas of the geocodes within margin meters of the web mercator tile
+# xmin, ymin, xmax, ymax (the heatmap kernel radius), summed per pixel of pixel meters,
+# as arrays of tile pixel columns (from the west) and rows (from the north) and of building
+# areas in ground pixel areas: the web mercator scale is 1 / cos(latitude).
+# Selected with the bbox index, at most (size + 2 * radius)^2 pixels leave the db.
+_HEATMAP = """
+    SELECT
+        COALESCE(array_agg(cell.pixel_column), '{{}}') AS columns,
+        COALESCE(array_agg(cell.pixel_row), '{{}}') AS rows,
+        COALESCE(array_agg(cell.weight), '{{}}') AS weights
+    FROM (
+        SELECT
+            floor((ST_X(point.geom) - :xmin) / :pixel) AS pixel_column,
+            floor((:ymax - ST_Y(point.geom)) / :pixel) AS pixel_row,
+            sum(property.building_area
+                / (:pixel * cos(radians(ST_Y(property.geocode_geo::geometry))))^2) AS weight
+        FROM {table} AS property
+        CROSS JOIN LATERAL (
+            SELECT ST_Transform(property.geocode_geo::geometry, 3857) AS geom
+        ) AS point
+        WHERE property.bbox && ST_Transform(
+                ST_Expand(ST_MakeEnvelope(:xmin, :ymin, :xmax, :ymax, 3857), :margin), 4326)
+            AND property.geocode_geo IS NOT NULL AND property.building_area > 0
+        GROUP BY pixel_column, pixel_row
+    ) AS cell
+    WHERE cell.pixel_column >= -:radius AND cell.pixel_column < :size + :radius
+        AND cell.pixel_row >= -:radius AND cell.pixel_row < :size + :radius
+"""
+
+
+class MapQueries():
+    """Repository for the read only queries of the maps, tiles are kept in the tile cache
+    (see geoapi.common.tiles)"""
+
+    def __init__(self, connection: databases.Database,
+                 real_property_table: sqlalchemy.Table):
+        self._connection = connection
+        self._real_property_table = real_property_table
+        self.logger = logging.getLogger(__name__)
+
+    async def aggregate(self, bounds: Tuple[float, float, float, float],
+                        cell_size: float) -> List[AggregateCellOut]:
+        """Aggregates the properties per grid cell
+
+        Args:
+            bounds (Tuple[float, float, float, float]): min longitude, min latitude,
+                max longitude, max latitude, all cells intersecting the bounds are aggregated
+            cell_size (float): cell size in web mercator meters
+
+        Returns:
+            List[AggregateCellOut]: cells with at least one property, by row and column
+        """
+
+        columns, rows = tiles.cells_in_bounds(bounds, cell_size)
+        min_lon, _, _, max_lat = tiles.cell_bounds(columns[0], rows[0],
+                                                   cell_size)
+        _, min_lat, max_lon, _ = tiles.cell_bounds(columns[-1], rows[-1],
+                                                   cell_size)
+        db_rows = await self._connection.fetch_all(
+            _AGGREGATE.format(table=self._real_property_table.name),
+            values={
+                'cell_size': cell_size,
+                'min_x': columns[0],
+                'max_x': columns[-1],
+                'min_y': rows[0],
+                'max_y': rows[-1],
+                'min_lon': min_lon,
+                'min_lat': min_lat,
+                'max_lon': max_lon,
+                'max_lat': max_lat
+            })
+        cells = []
+        for db_row in db_rows:
+            cell_bbox = tiles.cell_bounds(db_row['x'], db_row['y'], cell_size)
+            cells.append(
+                AggregateCellOut(
+                    x=db_row['x'],
+                    y=db_row['y'],
+                    bbox=list(cell_bbox),
+                    count=db_row['property_count'],
+                    parcel_area=round(db_row['parcel_area']),
+                    building_area=round(db_row['building_area']),
+                    building_coverage=round(
+                        min(100 * db_row['building_area'] /
+                            spatial_utils.bbox_area(cell_bbox), 100), 4)))
+        return cells
+
+    async def tile(self, zoom: int, x: int, y: int) -> bytes:
+        """Gets a Mapbox vector tile of the properties, from the tile cache when possible
+
+        Args:
+            zoom (int): zoom level, 0 to GEOAPI_TILE_MAX_ZOOM
+            x (int): tile column, from the west
+            y (int): tile row, from the north
+
+        Raises:
+            ResourceNotFoundError: if the tile does not exist
+
+        Returns:
+            bytes: the encoded tile with the layers parcels, buildings and geocodes,
+                empty if there are no properties in the tile
+        """
+
+        if not tiles.is_valid(zoom, x, y):
+            msg = "Tile not found - z/x/y: {}/{}/{}".format(zoom, x, y)
+            self.logger.error(msg)
+            raise ResourceNotFoundError(msg)
+        key = ('mvt', zoom, x, y)
+        tile = tiles.get(key)
+        if tile is not None:
+            return tile
+
+        read_generation = tiles.generation()
+        extent = int(config.API_CONFIG['GEOAPI_TILE_EXTENT'])
+        buffer = int(config.API_CONFIG['GEOAPI_TILE_BUFFER'])
+        # one tile pixel in meters at this zoom
+        pixel = tiles.tile_size(zoom) / extent
+        xmin, ymin, xmax, ymax = tiles.tile_bounds(zoom, x, y)
+        db_row = await self._connection.fetch_one(
+            _TILE.format(table=self._real_property_table.name),
+            values={
+                'xmin': xmin,
+                'ymin': ymin,
+                'xmax': xmax,
+                'ymax': ymax,
+                'margin': pixel * buffer,
+                'tolerance': pixel * float(
+                    config.API_CONFIG['GEOAPI_TILE_SIMPLIFY_PIXELS']),
+                'extent': extent,
+                'buffer': buffer,
+                'polygons': zoom >= int(
+                    config.API_CONFIG['GEOAPI_TILE_MIN_ZOOM_POLYGONS'])
+            })
+        tile = bytes(db_row['tile'])
+        tiles.put(key, tile, read_generation)
+        return tile
+
+    async def heatmap(self, zoom: int, x: int, y: int) -> bytes:
+        """Gets a building density heatmap tile, from the tile cache when possible
+
+        Args:
+            zoom (int): zoom level, 0 to GEOAPI_TILE_MAX_ZOOM
+            x (int): tile column, from the west
+            y (int): tile row, from the north
+
+        Raises:
+            ResourceNotFoundError: if the tile does not exist
+            ServiceUnavailableError: if too many images are being rendered
+            ResourceTimeoutError: if rendering took too long
+
+        Returns:
+            bytes: PNG image of GEOAPI_HEATMAP_SIZE pixels, transparent where there are no buildings
+        """
+
+        if not tiles.is_valid(zoom, x, y):
+            msg = "Tile not found - z/x/y: {}/{}/{}".format(zoom, x, y)
+            self.logger.error(msg)
+            raise ResourceNotFoundError(msg)
+        key = ('png', zoom, x, y)
+        tile = tiles.get(key)
+        if tile is not None:
+            return tile
+
+        read_generation = tiles.generation()
+        size = int(config.API_CONFIG['GEOAPI_HEATMAP_SIZE'])
+        radius = int(config.API_CONFIG['GEOAPI_HEATMAP_RADIUS'])
+        pixel = tiles.tile_size(zoom) / size
+        xmin, ymin, xmax, ymax = tiles.tile_bounds(zoom, x, y)
+        db_row = await self._connection.fetch_one(
+            _HEATMAP.format(table=self._real_property_table.name),
+            values={
+                'xmin': xmin,
+                'ymin': ymin,
+                'xmax': xmax,
+                'ymax': ymax,
+                'pixel': pixel,
+                'margin': pixel * radius,
+                'size': size,
+                'radius': radius
+            })
+        if db_row['weights']:
+            # rasterized and encoded in a worker process, off the event loop
+            tile = await worker_pool.get_image_pool().run(
+                heatmap.render_png, db_row['columns'], db_row['rows'],
+                db_row['weights'], size, radius,
+                float(config.API_CONFIG['GEOAPI_HEATMAP_MAX_COVERAGE']))
+        else:
+            tile = heatmap.empty_png(size)
+        tiles.put(key, tile, read_generation)
+        return tile
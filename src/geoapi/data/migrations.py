@@ -0,0 +1,316 @@
+"""Versioned Schema Migrations for the Real Property table
+
+Migrations are applied in version order, each in its own transaction, and recorded in
+the schema_migrations table so every migration runs once per database.
+A transaction level advisory lock serializes runners, so several api workers
+starting together apply each migration exactly once.
+
+Run from the command line before the api is started or upgraded: the index builds and the
+backfills of existing rows block writes to the properties table while they run.
+The api applies them on startup only with GEOAPI_MIGRATE_ON_STARTUP set to 1 (e.g. for an
+empty development database), otherwise it only verifies the spatial indexes.
+
+Usage:
+    cd to the src folder and run:
+        python -m geoapi.data.migrations
+        python -m geoapi.data.migrations --verify
+"""
+
+import argparse
+import asyncio
+import logging
+import sys
+from dataclasses import dataclass
+from typing import List
+import databases
+import geoapi.config.api_configurator as config
+import geoapi.config.bootstrap as bootstrap
+
+# any constant shared by all runners, see pg_advisory_xact_lock
+_LOCK_ID = 8125170413
+
+_CREATE_MIGRATIONS_TABLE = """
+    CREATE TABLE IF NOT EXISTS schema_migrations (
+        version integer NOT NULL PRIMARY KEY,
+        description text NOT NULL,
+        applied_at timestamptz NOT NULL DEFAULT now()
+    )
+"""
+
+# spatial indexes every spatial query relies on, checked by verify()
+SPATIAL_INDEXES = ('properties_geocode_geo_idx', 'properties_parcel_geo_idx',
+                   'properties_building_geo_idx', 'properties_bbox_idx')
+
+
+@dataclass
+class Migration():
+    """A schema change, statements are run in order in one transaction"""
+    version: int
+    description: str
+    statements: List[str]
+
+
+MIGRATIONS = [
+    Migration(
+        version=1,
+        description='spatial indexes on the geographies',
+        statements=[
+            'CREATE INDEX IF NOT EXISTS properties_geocode_geo_idx '
+            'ON properties USING GIST (geocode_geo)',
+            'CREATE INDEX IF NOT EXISTS properties_parcel_geo_idx '
+            'ON properties USING GIST (parcel_geo)',
+            'CREATE INDEX IF NOT EXISTS properties_building_geo_idx '
+            'ON properties USING GIST (building_geo)',
+        ]),
+    Migration(
+        version=2,
+        description='derived parcel/building areas and bbox, maintained on write',
+        statements=[
+            'ALTER TABLE properties '
+            'ADD COLUMN IF NOT EXISTS parcel_area float8 NULL, '
+            'ADD COLUMN IF NOT EXISTS building_area float8 NULL, '
+            'ADD COLUMN IF NOT EXISTS bbox geometry(Geometry, 4326) NULL',
+            # areas in square meters on the spheroid, bbox of all the geographies
+            """
+            CREATE OR REPLACE FUNCTION properties_derived_columns() RETURNS trigger AS $$
+            BEGIN
+                NEW.parcel_area := ST_Area(NEW.parcel_geo);
+                NEW.building_area := ST_Area(NEW.building_geo);
+                NEW.bbox := ST_Envelope(ST_Collect(ARRAY[
+                    NEW.geocode_geo::geometry,
+                    NEW.parcel_geo::geometry,
+                    NEW.building_geo::geometry]));
+                RETURN NEW;
+            END;
+            $$ LANGUAGE plpgsql
+            """,
+            'DROP TRIGGER IF EXISTS properties_derived_columns ON properties',
+            'CREATE TRIGGER properties_derived_columns '
+            'BEFORE INSERT OR UPDATE OF geocode_geo, parcel_geo, building_geo '
+            'ON properties FOR EACH ROW EXECUTE PROCEDURE properties_derived_columns()',
+            # backfill, the trigger computes the columns
+            'UPDATE properties SET geocode_geo = geocode_geo',
+            'CREATE INDEX IF NOT EXISTS properties_bbox_idx '
+            'ON properties USING GIST (bbox)',
+        ]),
+    Migration(
+        version=3,
+        description='aggregation grid cells and their precomputed summaries',
+        statements=[
+            # column/row of the web mercator grid cell of cell_size meters containing a geocode,
+            # counted from the north west corner of the world, see geoapi.common.tiles
+            """
+            CREATE OR REPLACE FUNCTION mercator_cell(
+                geo geography, cell_size float8, OUT x bigint, OUT y bigint) AS $$
+                SELECT
+                    floor((20037508.342789244 * ST_X(point.geom) / 180 + 20037508.342789244)
+                          / cell_size)::bigint,
+                    floor((20037508.342789244 - 20037508.342789244 / pi() * ln(tan(
+                        pi() / 4 + radians(LEAST(GREATEST(ST_Y(point.geom), -85.0511287798066),
+                                                 85.0511287798066)) / 2))) / cell_size)::bigint
+                FROM (SELECT geo::geometry AS geom) AS point
+            $$ LANGUAGE sql IMMUTABLE STRICT
+            """,
+            # cell sizes with a summary, see geoapi.data.summary
+            'CREATE TABLE IF NOT EXISTS property_cell_sizes ('
+            'cell_size float8 NOT NULL PRIMARY KEY)',
+            'CREATE TABLE IF NOT EXISTS property_cells ('
+            'cell_size float8 NOT NULL, x bigint NOT NULL, y bigint NOT NULL, '
+            'property_count bigint NOT NULL, parcel_area float8 NOT NULL, '
+            'building_area float8 NOT NULL, '
+            'PRIMARY KEY (cell_size, x, y))',
+            # keeps the summaries current, the old row is taken out of its cells
+            # and the new row added, for every cell size with a summary
+            """
+            CREATE OR REPLACE FUNCTION properties_cells() RETURNS trigger AS $$
+            BEGIN
+                IF TG_OP IN ('UPDATE', 'DELETE') AND OLD.geocode_geo IS NOT NULL THEN
+                    UPDATE property_cells SET
+                        property_count = property_cells.property_count - 1,
+                        parcel_area = property_cells.parcel_area - COALESCE(OLD.parcel_area, 0),
+                        building_area = property_cells.building_area
+                            - COALESCE(OLD.building_area, 0)
+                    FROM property_cell_sizes AS size,
+                        LATERAL mercator_cell(OLD.geocode_geo, size.cell_size) AS cell
+                    WHERE property_cells.cell_size = size.cell_size
+                        AND property_cells.x = cell.x AND property_cells.y = cell.y;
+                END IF;
+                IF TG_OP IN ('INSERT', 'UPDATE') AND NEW.geocode_geo IS NOT NULL THEN
+                    INSERT INTO property_cells
+                        (cell_size, x, y, property_count, parcel_area, building_area)
+                    SELECT size.cell_size, cell.x, cell.y, 1,
+                        COALESCE(NEW.parcel_area, 0), COALESCE(NEW.building_area, 0)
+                    FROM property_cell_sizes AS size,
+                        LATERAL mercator_cell(NEW.geocode_geo, size.cell_size) AS cell
+                    ON CONFLICT (cell_size, x, y) DO UPDATE SET
+                        property_count = property_cells.property_count + 1,
+                        parcel_area = property_cells.parcel_area + EXCLUDED.parcel_area,
+                        building_area = property_cells.building_area + EXCLUDED.building_area;
+                END IF;
+                RETURN NULL;
+            END;
+            $$ LANGUAGE plpgsql
+            """,
+            'DROP TRIGGER IF EXISTS properties_cells ON properties',
+            'CREATE TRIGGER properties_cells '
+            'AFTER INSERT OR UPDATE OF geocode_geo, parcel_geo, building_geo OR DELETE '
+            'ON properties FOR EACH ROW EXECUTE PROCEDURE properties_cells()',
+        ]),
+    Migration(
+        version=4,
+        description='change tracking and deletion records for the change feed',
+        statements=[
+            # id of the transaction that last wrote the row, see the change feed query
+            'ALTER TABLE properties '
+            'ADD COLUMN IF NOT EXISTS change_txid bigint NULL, '
+            'ADD COLUMN IF NOT EXISTS modified_at timestamptz NULL',
+            # backfill before the trigger exists, existing rows are one change each
+            'UPDATE properties SET change_txid = txid_current(), modified_at = now()',
+            'CREATE TABLE IF NOT EXISTS property_deletions ('
+            'id varchar(100) NOT NULL PRIMARY KEY, change_txid bigint NOT NULL, '
+            'deleted_at timestamptz NOT NULL)',
+            # stamps every write, a deleted row leaves a deletion record
+            # that is dropped again if the id is inserted anew
+            """
+            CREATE OR REPLACE FUNCTION properties_changes() RETURNS trigger AS $$
+            BEGIN
+                IF TG_OP = 'DELETE' THEN
+                    INSERT INTO property_deletions (id, change_txid, deleted_at)
+                    VALUES (OLD.id, txid_current(), now())
+                    ON CONFLICT (id) DO UPDATE SET
+                        change_txid = EXCLUDED.change_txid,
+                        deleted_at = EXCLUDED.deleted_at;
+                    RETURN OLD;
+                END IF;
+                NEW.change_txid := txid_current();
+                NEW.modified_at := now();
+                IF TG_OP = 'INSERT' THEN
+                    DELETE FROM property_deletions WHERE id = NEW.id;
+                END IF;
+                RETURN NEW;
+            END;
+            $$ LANGUAGE plpgsql
+            """,
+            'DROP TRIGGER IF EXISTS properties_changes ON properties',
+            'CREATE TRIGGER properties_changes '
+            'BEFORE INSERT OR UPDATE OR DELETE '
+            'ON properties FOR EACH ROW EXECUTE PROCEDURE properties_changes()',
+            'CREATE INDEX IF NOT EXISTS properties_change_idx '
+            'ON properties (change_txid, id)',
+            'CREATE INDEX IF NOT EXISTS property_deletions_change_idx '
+            'ON property_deletions (change_txid, id)',
+        ]),
+    Migration(
+        version=5,
+        description='geocode replica notifications of geocode updates and deletions',
+        statements=[
+            # an empty payload per statement (notifications are merged per transaction),
+            # replicas reload, see geoapi.data.geocode_replica
+            """
+            CREATE OR REPLACE FUNCTION properties_geocode_notify() RETURNS trigger AS $$
+            BEGIN
+                PERFORM pg_notify('properties_geocode', '');
+                RETURN NULL;
+            END;
+            $$ LANGUAGE plpgsql
+            """,
+            'DROP TRIGGER IF EXISTS properties_geocode_notify ON properties',
+            'CREATE TRIGGER properties_geocode_notify '
+            'AFTER UPDATE OF geocode_geo OR DELETE '
+            'ON properties FOR EACH STATEMENT EXECUTE PROCEDURE properties_geocode_notify()',
+        ]),
+]
+
+
+async def migrate(connection: databases.Database) -> List[int]:
+    """Applies the pending migrations
+
+    Args:
+        connection (databases.Database): connected database
+
+    Returns:
+        List[int]: versions applied by this run, empty if the schema was current
+    """
+
+    logger = logging.getLogger(__name__)
+    applied = []
+    for migration in MIGRATIONS:
+        async with connection.transaction():
+            await connection.execute('SELECT pg_advisory_xact_lock(:lock_id)',
+                                     values={'lock_id': _LOCK_ID})
+            await connection.execute(_CREATE_MIGRATIONS_TABLE)
+            is_applied = await connection.fetch_val(
+                'SELECT count(*) FROM schema_migrations WHERE version = :version',
+                values={'version': migration.version})
+            if is_applied:
+                continue
+            logger.info('applying migration %d: %s', migration.version,
+                        migration.description)
+            for statement in migration.statements:
+                await connection.execute(statement)
+            await connection.execute(
+                'INSERT INTO schema_migrations (version, description) '
+                'VALUES (:version, :description)',
+                values={
+                    'version': migration.version,
+                    'description': migration.description
+                })
+        applied.append(migration.version)
+    return applied
+
+
+async def verify(connection: databases.Database) -> List[str]:
+    """Checks the spatial indexes
+
+    Args:
+        connection (databases.Database): connected database
+
+    Returns:
+        List[str]: names of the spatial indexes that are missing or invalid, empty if all are usable
+    """
+
+    db_rows = await connection.fetch_all(
+        'SELECT index_class.relname FROM pg_index '
+        'JOIN pg_class AS index_class ON index_class.oid = pg_index.indexrelid '
+        'WHERE pg_index.indisvalid AND index_class.relname = ANY(:names)',
+        values={'names': list(SPATIAL_INDEXES)})
+    valid = {db_row['relname'] for db_row in db_rows}
+    return [name for name in SPATIAL_INDEXES if name not in valid]
+
+
+async def run(database_url: str, verify_only: bool) -> List[str]:
+    """Migrates (unless verify_only) and verifies a database, returns the missing indexes"""
+    logger = logging.getLogger(__name__)
+    connection = databases.Database(database_url)
+    await connection.connect()
+    try:
+        if not verify_only:
+            applied = await migrate(connection)
+            logger.info('migrations applied: %s', applied or 'none, schema is current')
+        missing = await verify(connection)
+    finally:
+        await connection.disconnect()
+    if missing:
+        logger.error('missing or invalid spatial indexes: %s', missing)
+    return missing
+
+
+def main() -> None:
+    """Command line entry point"""
+    parser = argparse.ArgumentParser(
+        description='Apply the schema migrations and verify the spatial indexes')
+    parser.add_argument('--verify', action='store_true',
+                        help='only verify the spatial indexes, apply nothing')
+    parser.add_argument('--database-url', default=None,
+                        help='defaults to GEOAPI_DATABASE_URL')
+    args = parser.parse_args()
+
+    bootstrap.init()
+    missing = asyncio.get_event_loop().run_until_complete(
+        run(args.database_url or config.API_CONFIG['GEOAPI_DATABASE_URL'],
+            args.verify))
+    sys.exit(1 if missing else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,21 +1,228 @@
 """Query Object for all read-only queries to the Real Property table
 """
 
-import os
+import base64
+import binascii
+import json
 import logging
-from time import time
-from typing import List
-import asyncio
+from typing import Any, Dict, List, Optional, Tuple, AsyncGenerator
 import aiohttp
-import aiofiles
 import databases
-from PIL import Image
 import sqlalchemy
 from sqlalchemy.sql import select, func
+from geoalchemy2.types import Geometry
+import geoapi.config.api_configurator as config
 import geoapi.common.spatial_utils as spatial_utils
 import geoapi.common.decorators as decorators
+import geoapi.common.image_cache as image_cache
+import geoapi.common.raw_json as raw_json
 from geoapi.common.exceptions import ResourceNotFoundError, ResourceMissingDataError
 from geoapi.common.json_models import RealPropertyOut, GeometryAndDistanceIn, StatisticsOut
+from geoapi.common.json_models import GeometryAndDistanceLimitIn
+from geoapi.common.json_models import IdAndDistanceIn, StatisticsResultOut
+from geoapi.common.json_models import NearestIn, PropertyDistanceOut
+from geoapi.common.json_models import GeometryOutputIn
+from geoapi.common.json_models import ChangesOut, ChangeKindEnum, PropertyChangeOut
+from geoapi.data.geocode_replica import GeocodeReplica
+
+# statistics of the zones within distance meters of properties, in one round trip
+# for any number of (property id, distance) requests, one row per request in request order:
+# the zone is the geography buffer of the geocode, parcels and buildings are selected
+# with ST_DWithin on the geographies (index assisted), their areas on the spheroid
+# are precomputed on write (see geoapi.data.migrations),
+# building distances are from the building centroid to the geocode (zone center).
+# found is false if the property does not exist, located is false if it has no geocode.
+_STATISTICS = """
+    SELECT
+        request.position,
+        subject.id IS NOT NULL AS found,
+        subject.geocode_geo IS NOT NULL AS located,
+        round(zone.zone_area)::bigint AS zone_area,
+        round(parcels.parcel_area)::bigint AS parcel_area,
+        round(LEAST(100 * buildings.building_area / NULLIF(zone.zone_area, 0),
+                    100)::numeric, 2)::float8 AS zone_density,
+        buildings.buildings_area_distance
+    FROM unnest(CAST(:property_ids AS text[]), CAST(:distances AS float8[]))
+        WITH ORDINALITY AS request(property_id, distance, position)
+    LEFT JOIN {table} AS subject ON subject.id = request.property_id
+    CROSS JOIN LATERAL (
+        SELECT ST_Area(ST_Buffer(subject.geocode_geo, request.distance)) AS zone_area
+    ) AS zone
+    CROSS JOIN LATERAL (
+        SELECT COALESCE(SUM(parcel.parcel_area), 0) AS parcel_area
+        FROM {table} AS parcel
+        WHERE ST_DWithin(parcel.parcel_geo, subject.geocode_geo, request.distance)
+    ) AS parcels
+    CROSS JOIN LATERAL (
+        SELECT
+            COALESCE(SUM(round(building.area)), 0) AS building_area,
+            COALESCE(json_agg(json_build_object(
+                'area', round(building.area)::bigint,
+                'distance', round(building.distance)::bigint)), '[]') AS buildings_area_distance
+        FROM (
+            SELECT
+                building_area AS area,
+                ST_Distance(ST_Centroid(building_geo), subject.geocode_geo) AS distance
+            FROM {table}
+            WHERE ST_DWithin(building_geo, subject.geocode_geo, request.distance)
+        ) AS building
+    ) AS buildings
+    ORDER BY request.position
+"""
+
+# statistics of one property for many radii (rings) in one pass: parcels and buildings
+# within the largest radius are selected and measured once, then each is counted in every
+# ring its distance to the geocode falls into. One row per ring in request order,
+# no rows if the property does not exist, located is false if it has no geocode.
+_STATISTICS_RINGS = """
+    WITH subject AS (
+        SELECT geocode_geo FROM {table} WHERE id = :property_id
+    ), parcel AS (
+        SELECT property.parcel_area AS area,
+            ST_Distance(property.parcel_geo, subject.geocode_geo) AS gap
+        FROM {table} AS property, subject
+        WHERE ST_DWithin(property.parcel_geo, subject.geocode_geo, :max_distance)
+    ), building AS (
+        SELECT property.building_area AS area,
+            ST_Distance(property.building_geo, subject.geocode_geo) AS gap,
+            ST_Distance(ST_Centroid(property.building_geo), subject.geocode_geo) AS distance
+        FROM {table} AS property, subject
+        WHERE ST_DWithin(property.building_geo, subject.geocode_geo, :max_distance)
+    )
+    SELECT
+        ring.position,
+        subject.geocode_geo IS NOT NULL AS located,
+        round(zone.zone_area)::bigint AS zone_area,
+        round(parcels.parcel_area)::bigint AS parcel_area,
+        round(LEAST(100 * buildings.building_area / NULLIF(zone.zone_area, 0),
+                    100)::numeric, 2)::float8 AS zone_density,
+        buildings.buildings_area_distance
+    FROM subject
+    CROSS JOIN unnest(CAST(:distances AS float8[]))
+        WITH ORDINALITY AS ring(distance, position)
+    CROSS JOIN LATERAL (
+        SELECT ST_Area(ST_Buffer(subject.geocode_geo, ring.distance)) AS zone_area
+    ) AS zone
+    CROSS JOIN LATERAL (
+        SELECT COALESCE(SUM(parcel.area), 0) AS parcel_area
+        FROM parcel
+        WHERE parcel.gap <= ring.distance
+    ) AS parcels
+    CROSS JOIN LATERAL (
+        SELECT
+            COALESCE(SUM(round(building.area)), 0) AS building_area,
+            COALESCE(json_agg(json_build_object(
+                'area', round(building.area)::bigint,
+                'distance', round(building.distance)::bigint)), '[]') AS buildings_area_distance
+        FROM building
+        WHERE building.gap <= ring.distance
+    ) AS buildings
+    ORDER BY ring.position
+"""
+
+# properties with a geocode within distance meters of a geojson geometry
+_FIND = """
+    SELECT id
+    FROM {table}
+    WHERE ST_DWithin(geocode_geo,
+                     ST_SetSRID(ST_GeomFromGeoJSON(:location_geo), 4326)::geography,
+                     :distance)
+"""
+
+# the k properties with a geocode nearest to a geojson geometry, nearest first.
+# The inner query is ordered by the index assisted <-> operator, so the geocode index
+# is walked in distance order and only k rows are read whatever their distance.
+_NEAREST = """
+    SELECT nearest.id,
+        ST_Distance(nearest.geocode_geo,
+                    ST_SetSRID(ST_GeomFromGeoJSON(:location_geo), 4326)::geography) AS distance
+    FROM (
+        SELECT id, geocode_geo
+        FROM {table}
+        WHERE geocode_geo IS NOT NULL
+        ORDER BY geocode_geo <-> ST_SetSRID(ST_GeomFromGeoJSON(:location_geo), 4326)::geography
+        LIMIT :k
+    ) AS nearest
+    ORDER BY distance, nearest.id
+"""
+
+# as _FIND for large geometries, split into parts of at most max_vertices vertices
+# so each part probes the index with a small bounding box
+_FIND_SUBDIVIDED = """
+    SELECT DISTINCT property.id
+    FROM ST_Subdivide(ST_SetSRID(ST_GeomFromGeoJSON(:location_geo), 4326),
+                      :max_vertices) AS part
+    JOIN {table} AS property
+        ON ST_DWithin(property.geocode_geo, part::geography, :distance)
+"""
+
+# _FIND for many geometries at once, one row per (query position, property id),
+# properties of a query nearest first and at most max_count of them (NULL for all)
+_FIND_MANY = """
+    SELECT query.position, found.id
+    FROM unnest(CAST(:location_geos AS text[]), CAST(:distances AS float8[]),
+                CAST(:max_counts AS integer[]))
+        WITH ORDINALITY AS query(location_geo, distance, max_count, position)
+    CROSS JOIN LATERAL (
+        SELECT ST_SetSRID(ST_GeomFromGeoJSON(query.location_geo), 4326)::geography AS geo
+    ) AS location
+    CROSS JOIN LATERAL (
+        SELECT property.id, ST_Distance(property.geocode_geo, location.geo) AS distance
+        FROM {table} AS property
+        WHERE ST_DWithin(property.geocode_geo, location.geo, query.distance)
+        ORDER BY distance, property.id
+        LIMIT query.max_count
+    ) AS found
+    ORDER BY query.position, found.distance, found.id
+"""
+
+# all properties ordered by id for the columnar export, geographies as wkb
+_EXPORT = """
+    SELECT id,
+        ST_AsBinary(geocode_geo) AS geocode_geo,
+        ST_AsBinary(parcel_geo) AS parcel_geo,
+        ST_AsBinary(building_geo) AS building_geo,
+        image_bounds,
+        image_url
+    FROM {table}
+    ORDER BY id
+"""
+
+
+# positions (writing transaction id, property id) of the changes after a position, oldest
+# first: rows of the table (inserted or updated) and deletion records, see migration 4.
+# Only transactions older than every transaction still in flight are read (the xmin of
+# the snapshot), a write committing late can't fall behind a position already handed out.
+_CHANGES = """
+    SELECT change.change_txid, change.id, change.deleted
+    FROM (
+        SELECT change_txid, id, false AS deleted FROM {table}
+        UNION ALL
+        SELECT change_txid, id, true AS deleted FROM property_deletions
+    ) AS change
+    WHERE (change.change_txid, change.id) > (:since_txid, :since_id)
+        AND change.change_txid < txid_snapshot_xmin(txid_current_snapshot())
+    ORDER BY change.change_txid, change.id
+    LIMIT :limit
+"""
+
+
+def _encode_change_token(change_txid: int, property_id: str) -> str:
+    """opaque since token of a change feed position"""
+    return base64.urlsafe_b64encode(json.dumps(
+        [change_txid, property_id]).encode()).decode().rstrip('=')
+
+
+def _decode_change_token(token: str) -> Tuple[int, str]:
+    """position of a since token, raises ValueError if it is not a token"""
+    try:
+        change_txid, property_id = json.loads(
+            base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)))
+    except (TypeError, ValueError, binascii.Error):
+        raise ValueError('Invalid change token: {}'.format(token))
+    if not isinstance(change_txid, int) or not isinstance(property_id, str):
+        raise ValueError('Invalid change token: {}'.format(token))
+    return change_txid, property_id
 
 
 class RealPropertyQueries():
@@ -23,56 +230,342 @@ class RealPropertyQueries():
     Different from repository for all transaction operations."""
 
     def __init__(self, connection: databases.Database,
-                 real_property_table: sqlalchemy.Table):
+                 real_property_table: sqlalchemy.Table,
+                 geocode_replica: Optional[GeocodeReplica] = None):
         self._connection = connection
         self._real_property_table = real_property_table
+        self._geocode_replica = geocode_replica
         self.logger = logging.getLogger(__name__)
 
-    async def get_all(self) -> List[RealPropertyOut]:
-        """Gets all the records
+    @staticmethod
+    def _simplified(column, simplify: Optional[float]):
+        """a polygon geography column simplified with a tolerance of simplify meters,
+        in web mercator where the tolerance is scaled by 1 / cos(latitude) of the polygon"""
+        if not simplify:
+            return column
+        geometry = sqlalchemy.cast(column, Geometry(srid=4326))
+        tolerance = simplify / func.cos(
+            func.radians(func.ST_Y(func.ST_Centroid(geometry))))
+        return func.ST_Transform(
+            func.ST_SimplifyPreserveTopology(func.ST_Transform(geometry, 3857),
+                                             tolerance), 4326)
+
+    def _select_geo_json(self, output: Optional[GeometryOutputIn] = None):
+        """select of all columns with the geography columns encoded as geojson text by the db,
+        coordinates are rounded to GEOAPI_GEOJSON_PRECISION decimal places.
+        With output the polygons are simplified and coordinates rounded as requested, and
+        the column full_geometry_bytes has the geojson size without simplification and rounding
+        """
+        table = self._real_property_table
+        default_precision = int(config.API_CONFIG['GEOAPI_GEOJSON_PRECISION'])
+        precision = default_precision
+        simplify = None
+        if output is not None:
+            simplify = output.simplify
+            if output.precision is not None:
+                precision = output.precision
+        columns = [
+            table.c.id,
+            func.ST_AsGeoJSON(table.c.geocode_geo,
+                              precision).label('geocode_geo'),
+            func.ST_AsGeoJSON(self._simplified(table.c.parcel_geo, simplify),
+                              precision).label('parcel_geo'),
+            func.ST_AsGeoJSON(self._simplified(table.c.building_geo, simplify),
+                              precision).label('building_geo'),
+            table.c.image_bounds,
+            table.c.image_url,
+        ]
+        if output is not None:
+            geocode_bytes, parcel_bytes, building_bytes = (
+                func.coalesce(
+                    func.octet_length(func.ST_AsGeoJSON(column, default_precision)), 0)
+                for column in (table.c.geocode_geo, table.c.parcel_geo,
+                               table.c.building_geo))
+            columns.append((geocode_bytes + parcel_bytes +
+                            building_bytes).label('full_geometry_bytes'))
+        return select(columns)
+
+    @staticmethod
+    def _count_geometry_bytes(db_rows, output: Optional[GeometryOutputIn]) -> None:
+        """adds the geojson sizes of rows selected with output to its byte counts"""
+        if output is None:
+            return
+        for db_row in db_rows:
+            output.geometry_bytes += sum(
+                len(db_row[name] or '')
+                for name in ('geocode_geo', 'parcel_geo', 'building_geo'))
+            output.full_geometry_bytes += db_row['full_geometry_bytes']
+
+    async def _fetch_page(self, limit: int, after: Optional[str],
+                          output: Optional[GeometryOutputIn]) -> Tuple[List[Any], Optional[str]]:
+        """rows of a page (geography columns as geojson text) and the cursor of the next page"""
+        select_query = self._select_geo_json(output)
+        if after is not None:
+            select_query = select_query.where(
+                self._real_property_table.c.id > after)
+        # one extra row tells if there is a next page
+        select_query = select_query.order_by(
+            self._real_property_table.c.id).limit(limit + 1)
+        db_rows = await self._connection.fetch_all(select_query)
+        if not db_rows and after is None:
+            msg = "No Properties found!"
+            self.logger.error(msg)
+            raise ResourceNotFoundError(msg)
+        next_cursor = db_rows[limit - 1]["id"] if len(db_rows) > limit else None
+        self._count_geometry_bytes(db_rows[:limit], output)
+        return db_rows[:limit], next_cursor
 
-        TODO: add paging
+    async def get_page(self, limit: int, after: Optional[str] = None,
+                       output: Optional[GeometryOutputIn] = None
+                      ) -> Tuple[List[RealPropertyOut], Optional[str]]:
+        """Gets a page of records ordered by id, using keyset pagination on id
+
+        Args:
+            limit (int): maximum number of records in the page
+            after (Optional[str]): cursor - only records with an id after this id are returned,
+                None for the first page
+            output (Optional[GeometryOutputIn]): simplification and precision of the geometries,
+                the geometry byte counts of the page are added to it
 
         Raises:
             ResourceNotFoundError: if the table is empty
 
         Returns:
-            List[RealPropertyOut]: List of outgoing geojson based objects
+            Tuple[List[RealPropertyOut], Optional[str]]: List of outgoing geojson based objects
+                and the cursor for the next page, None if this is the last page
         """
 
-        select_query = self._real_property_table.select()
-        db_rows = await self._connection.fetch_all(select_query)
-        if not db_rows:
-            msg = "No Properties found!"
-            self.logger.error(msg)
-            raise ResourceNotFoundError(msg)
-        out_list = [RealPropertyOut.from_db(db_row) for db_row in db_rows]
-        return out_list
+        db_rows, next_cursor = await self._fetch_page(limit, after, output)
+        out_list = [RealPropertyOut.from_db_geo_json(db_row) for db_row in db_rows]
+        return out_list, next_cursor
 
-    async def get(self, property_id: str) -> RealPropertyOut:
-        """Gets a single record
+    async def get_page_json(self, limit: int, after: Optional[str] = None,
+                            output: Optional[GeometryOutputIn] = None
+                           ) -> Tuple[str, Optional[str]]:
+        """Gets a page of records ordered by id like get_page, as a json array
+        stitched from the geojson text of the db (see geoapi.common.raw_json)
+
+        Raises:
+            ResourceNotFoundError: if the table is empty
+
+        Returns:
+            Tuple[str, Optional[str]]: json of the list of outgoing geojson based objects
+                and the cursor for the next page, None if this is the last page
+        """
+
+        db_rows, next_cursor = await self._fetch_page(limit, after, output)
+        return raw_json.property_list_json(db_rows), next_cursor
+
+    async def _iterate_db_rows(self, after: Optional[str],
+                               output: Optional[GeometryOutputIn]
+                              ) -> AsyncGenerator[Any, None]:
+        """rows ordered by id (geography columns as geojson text) from a server side cursor,
+        closing the generator closes the cursor and releases its connection"""
+        select_query = self._select_geo_json(output)
+        if after is not None:
+            select_query = select_query.where(
+                self._real_property_table.c.id > after)
+        select_query = select_query.order_by(self._real_property_table.c.id)
+        db_rows = self._connection.iterate(select_query)
+        try:
+            async for db_row in db_rows:
+                self._count_geometry_bytes([db_row], output)
+                yield db_row
+        finally:
+            await db_rows.aclose()
+
+    async def iterate_all(self, after: Optional[str] = None,
+                          output: Optional[GeometryOutputIn] = None
+                         ) -> AsyncGenerator[RealPropertyOut, None]:
+        """Streams all the records ordered by id from a server side cursor,
+        so memory use does not depend on the table size
 
         Args:
-            property_id (str): property id to search for
+            after (Optional[str]): only records with an id after this id are returned
+            output (Optional[GeometryOutputIn]): simplification and precision of the geometries,
+                the geometry byte counts are added to it as records are streamed
+
+        Yields:
+            RealPropertyOut: Outgoing geojson based object
+        """
+
+        db_rows = self._iterate_db_rows(after, output)
+        try:
+            async for db_row in db_rows:
+                yield RealPropertyOut.from_db_geo_json(db_row)
+        finally:
+            await db_rows.aclose()
+
+    async def iterate_all_json(self, as_feature: bool, after: Optional[str] = None,
+                               output: Optional[GeometryOutputIn] = None
+                              ) -> AsyncGenerator[str, None]:
+        """Streams all the records like iterate_all, each as json
+        stitched from the geojson text of the db (see geoapi.common.raw_json)
+
+        Args:
+            as_feature (bool): json of a Geojson Feature (see RealPropertyOut.to_feature)
+                instead of the outgoing geojson based object
+
+        Yields:
+            str: json of an outgoing geojson based object or Feature
+        """
+
+        encode = raw_json.feature_json if as_feature else raw_json.property_json
+        db_rows = self._iterate_db_rows(after, output)
+        try:
+            async for db_row in db_rows:
+                yield encode(db_row)
+        finally:
+            await db_rows.aclose()
+
+    async def export_batches(self, batch_size: int
+                            ) -> AsyncGenerator[List[Any], None]:
+        """Streams all the records ordered by id in batches from a server side cursor,
+        so memory use is bounded by the batch size whatever the table size
+
+        Args:
+            batch_size (int): records per batch
+
+        Yields:
+            List[Any]: a batch of records with the columns id, geocode_geo, parcel_geo,
+                building_geo (wkb), image_bounds and image_url
+        """
+
+        async with self._connection.connection() as connection:
+            # asyncpg connection, the cursor is read a batch per round trip
+            raw_connection = connection.raw_connection
+            async with connection.transaction():
+                # the cursor is closed with the transaction, when the batches are read
+                # or the generator is closed (aclose) by its consumer
+                cursor = await raw_connection.cursor(
+                    _EXPORT.format(table=self._real_property_table.name))
+                while True:
+                    db_rows = await cursor.fetch(batch_size)
+                    if not db_rows:
+                        return
+                    yield db_rows
+
+    async def changes(self, limit: int, since: Optional[str] = None) -> ChangesOut:
+        """Gets a page of the changes after a since token, oldest first,
+        using keyset pagination on the position (writing transaction id, property id)
+
+        Args:
+            limit (int): maximum number of changes in the page
+            since (Optional[str]): token of the next_token of the previous page,
+                None to start from the beginning (every property is an upsert)
 
         Raises:
-            ResourceNotFoundError: if property id not found
+            ValueError: if since is not a change token
 
         Returns:
-            RealPropertyOut: Outgoing geojson based object
+            ChangesOut: changes, the token to continue from and whether more changes are ready
         """
 
-        select_query = self._real_property_table.select().where(
+        since_txid, since_id = _decode_change_token(since) if since else (0, '')
+        # one extra row tells if there are more changes
+        positions = await self._connection.fetch_all(
+            _CHANGES.format(table=self._real_property_table.name),
+            values={
+                'since_txid': since_txid,
+                'since_id': since_id,
+                'limit': limit + 1
+            })
+        has_more = len(positions) > limit
+        positions = positions[:limit]
+        upsert_ids = [
+            position['id'] for position in positions if not position['deleted']
+        ]
+        real_properties = {}
+        if upsert_ids:
+            select_query = self._select_geo_json().where(
+                self._real_property_table.c.id.in_(upsert_ids))
+            for db_row in await self._connection.fetch_all(select_query):
+                real_properties[db_row['id']] = RealPropertyOut.from_db_geo_json(
+                    db_row)
+        changes = []
+        for position in positions:
+            if position['deleted']:
+                changes.append(
+                    PropertyChangeOut(id=position['id'],
+                                      change=ChangeKindEnum.delete))
+            elif position['id'] in real_properties:
+                changes.append(
+                    PropertyChangeOut(id=position['id'],
+                                      change=ChangeKindEnum.upsert,
+                                      property=real_properties[position['id']]))
+            # else deleted since the positions were read, its deletion record follows
+        next_token = (_encode_change_token(positions[-1]['change_txid'],
+                                           positions[-1]['id'])
+                      if positions else _encode_change_token(since_txid, since_id))
+        return ChangesOut(changes=changes, next_token=next_token, has_more=has_more)
+
+    async def _fetch_one(self, property_id: str,
+                         output: Optional[GeometryOutputIn]) -> Any:
+        """row of a property (geography columns as geojson text)"""
+        select_query = self._select_geo_json(output).where(
             self._real_property_table.c.id == property_id)
         db_row = await self._connection.fetch_one(select_query)
         if not db_row:
             msg = "Property not found - id: {}".format(property_id)
             self.logger.error(msg)
             raise ResourceNotFoundError(msg)
-        return RealPropertyOut.from_db(db_row)
+        self._count_geometry_bytes([db_row], output)
+        return db_row
+
+    async def get(self, property_id: str,
+                  output: Optional[GeometryOutputIn] = None) -> RealPropertyOut:
+        """Gets a single record
+
+        Args:
+            property_id (str): property id to search for
+            output (Optional[GeometryOutputIn]): simplification and precision of the geometries,
+                the geometry byte counts of the record are added to it
+
+        Raises:
+            ResourceNotFoundError: if property id not found
+
+        Returns:
+            RealPropertyOut: Outgoing geojson based object
+        """
+
+        return RealPropertyOut.from_db_geo_json(
+            await self._fetch_one(property_id, output))
+
+    async def get_json(self, property_id: str,
+                       output: Optional[GeometryOutputIn] = None) -> str:
+        """Gets a single record like get, as json
+        stitched from the geojson text of the db (see geoapi.common.raw_json)
+
+        Raises:
+            ResourceNotFoundError: if property id not found
+
+        Returns:
+            str: json of the outgoing geojson based object
+        """
+
+        return raw_json.property_json(await self._fetch_one(property_id, output))
+
+    def _find_statement(self, geometry_distance: GeometryAndDistanceIn
+                       ) -> Tuple[str, Dict[str, Any]]:
+        """sql and values of the find query, query geometries with more than
+        GEOAPI_FIND_SUBDIVIDE_VERTICES positions are subdivided (0 never subdivides)"""
+        max_vertices = int(config.API_CONFIG['GEOAPI_FIND_SUBDIVIDE_VERTICES'])
+        values = {
+            'location_geo': json.dumps(geometry_distance.location_geo),
+            'distance': geometry_distance.distance
+        }
+        if 0 < max_vertices < spatial_utils.vertex_count(
+                geometry_distance.location_geo):
+            values['max_vertices'] = max_vertices
+            return _FIND_SUBDIVIDED.format(
+                table=self._real_property_table.name), values
+        return _FIND.format(table=self._real_property_table.name), values
 
     async def find(self, geometry_distance: GeometryAndDistanceIn) -> List[str]:
-        """Searches for properties within a given distance of a geometry
+        """Searches for properties within a given distance of a geometry.
+        Answered by the geocode replica if there is one and it can answer, otherwise
+        the geometry and distance are sent as is and matched with ST_DWithin on the
+        geocode geography, so the spatial index on geocode_geo is used for any distance.
 
         Args:
             geometry_distance (GeometryAndDistanceIn): geojson based geometry and distance in object
@@ -84,34 +577,96 @@ class RealPropertyQueries():
             List[str]: list of property ids
         """
 
-        geoalchemy_element_buffered = spatial_utils.buffer(
-            geometry_distance.location_geo, geometry_distance.distance)
-        select_query = select([self._real_property_table.c.id]).where(
-            self._real_property_table.c.geocode_geo.ST_Intersects(
-                geoalchemy_element_buffered))
-        db_rows = await self._connection.fetch_all(select_query)
-        if not db_rows:
+        if not geometry_distance.location_geo:
+            msg = "No Properties found!"
+            self.logger.error(msg)
+            raise ResourceNotFoundError(msg)
+        out_list = None
+        if self._geocode_replica is not None:
+            out_list = self._geocode_replica.find(geometry_distance.location_geo,
+                                                  geometry_distance.distance)
+        if out_list is None:
+            query, values = self._find_statement(geometry_distance)
+            db_rows = await self._connection.fetch_all(query, values=values)
+            out_list = [db_row["id"] for db_row in db_rows]
+        if not out_list:
             msg = "No Properties found!"
             self.logger.error(msg)
             raise ResourceNotFoundError(msg)
-        out_list = [db_row["id"] for db_row in db_rows]
         return out_list
 
-    # helpers for parallel running of queries
-    async def _query_parcels(self, select_query_parcels):
-        parcel_area = await self._connection.fetch_val(select_query_parcels)
-        return parcel_area
+    async def nearest(self, nearest_in: NearestIn) -> List[PropertyDistanceOut]:
+        """Gets the k properties nearest to a geometry, with their distances
 
-    async def _query_buildings(self, select_query_buildings):
-        db_rows = await self._connection.fetch_all(select_query_buildings)
-        return db_rows
+        Args:
+            nearest_in (NearestIn): geojson based geometry and k
 
-    async def statistics(self, property_id: str, distance: int) -> StatisticsOut:
-        """Gets statistics for data near a property
+        Raises:
+            ResourceNotFoundError: if no properties found
+
+        Returns:
+            List[PropertyDistanceOut]: property ids and distances in meters, nearest first
+        """
+
+        db_rows = await self._connection.fetch_all(
+            _NEAREST.format(table=self._real_property_table.name),
+            values={
+                'location_geo': json.dumps(nearest_in.location_geo),
+                'k': nearest_in.k
+            }) if nearest_in.location_geo else []
+        if not db_rows:
+            msg = "No Properties found!"
+            self.logger.error(msg)
+            raise ResourceNotFoundError(msg)
+        return [
+            PropertyDistanceOut(id=db_row["id"], distance=db_row["distance"])
+            for db_row in db_rows
+        ]
 
-        TODO: replace the property geocode with a redis geocode cache
-            and maintain db sync with postgres with a redis queue.  Also, refactor
-            to reduce 'too many locals'
+    async def find_many(self, geometry_distances: List[GeometryAndDistanceLimitIn]
+                       ) -> List[List[str]]:
+        """Searches for properties within given distances of many geometries in one query
+
+        Args:
+            geometry_distances (List[GeometryAndDistanceLimitIn]): geojson based geometries,
+                distances and optional limits
+
+        Returns:
+            List[List[str]]: property ids per input geometry, in input order,
+                nearest first and empty if none are found
+        """
+
+        out_list: List[List[str]] = [[] for _ in geometry_distances]
+        # geometries without coordinates never match
+        positions = [
+            position for position, geometry_distance in enumerate(geometry_distances)
+            if geometry_distance.location_geo
+        ]
+        if not positions:
+            return out_list
+        db_rows = await self._connection.fetch_all(
+            _FIND_MANY.format(table=self._real_property_table.name),
+            values={
+                'location_geos': [
+                    json.dumps(geometry_distances[position].location_geo)
+                    for position in positions
+                ],
+                'distances': [
+                    geometry_distances[position].distance for position in positions
+                ],
+                'max_counts': [
+                    geometry_distances[position].limit for position in positions
+                ],
+            })
+        for db_row in db_rows:
+            # ordinality starts at 1
+            out_list[positions[db_row["position"] - 1]].append(db_row["id"])
+        return out_list
+
+    async def statistics(self, property_id: str, distance: int) -> StatisticsOut:
+        """Gets statistics for data near a property.
+        Computed in a single statement by the db on the geographies, so only the summary
+        and the building area/distance pairs leave the db.
 
         Args:
             property_id (str): property id
@@ -125,76 +680,104 @@ class RealPropertyQueries():
             StatisticsOut: A summary statistics outgoing object
         """
 
-        # get property geocode
-        select_query = select([
-            self._real_property_table.c.geocode_geo
-        ]).where(self._real_property_table.c.id == property_id)
-        db_row = await self._connection.fetch_one(select_query)
-        if db_row is None:
+        db_row = (await self._statistics_rows([property_id], [distance]))[0]
+        if not db_row["found"]:
             msg = "Property not found - id: {}".format(property_id)
             self.logger.error(msg)
             raise ResourceNotFoundError(msg)
-        if db_row["geocode_geo"] is None:
+        if not db_row["located"]:
             msg = "Property missing geocode_geo data - id: {}".format(
                 property_id)
             self.logger.error(msg)
             raise ResourceMissingDataError(msg)
-        # get zone - buffer around property
-        geojson_obj = spatial_utils.to_geo_json(db_row["geocode_geo"])
-        geoalchemy_element_buffered = spatial_utils.buffer(
-            geojson_obj, distance)
-        area_distance = spatial_utils.area_distance(geoalchemy_element_buffered,
-                                                    None)
-        zone_area = area_distance['area']
-
-        # get parcel area
-        select_query_parcels = select(
-            [func.sum(self._real_property_table.c.parcel_geo.ST_Area())]).where(
-                self._real_property_table.c.parcel_geo.ST_Intersects(
-                    geoalchemy_element_buffered))
-
-        # get buildings
-        select_query_buildings = select(
-            [self._real_property_table.c.building_geo]).where(
-                self._real_property_table.c.building_geo.ST_Intersects(
-                    geoalchemy_element_buffered))
-
-        # run queries in parallel
-        parcel_area, db_rows = await asyncio.gather(
-            self._query_parcels(select_query_parcels),
-            self._query_buildings(select_query_buildings),
-        )
-
-        # get parcel area result
-        if not parcel_area:
-            parcel_area = 0
-        parcel_area = round(parcel_area)
-
-        # get distance and area for buildings
-        if db_rows:
-            area_distance_list = [
-                spatial_utils.area_distance(db_row["building_geo"], geojson_obj)
-                for db_row in db_rows
-            ]
-            building_area = sum(
-                [area_distance['area'] for area_distance in area_distance_list])
-        else:
-            area_distance_list = []
-            building_area = 0
-        buildings_area_distance = area_distance_list
-
-        # get final zone density
-        zone_density_percentage = 100 * building_area / zone_area
-        if zone_density_percentage > 100.00:
-            zone_density_percentage = 100.00
-        zone_density = round(zone_density_percentage, 2)
-
-        statistics_out = StatisticsOut(
-            parcel_area=parcel_area,
-            buildings_area_distance=buildings_area_distance,
-            zone_area=zone_area,
-            zone_density=zone_density)
-        return statistics_out
+        return self._statistics_out(db_row)
+
+    async def statistics_rings(self, property_id: str,
+                               distances: List[int]) -> List[StatisticsOut]:
+        """Gets statistics for data near a property for several search radii in one pass,
+        the parcels and buildings within the largest radius are read and measured once
+
+        Args:
+            property_id (str): property id
+            distances (List[int]): search radii in meters
+
+        Raises:
+            ResourceNotFoundError: if no property found for the given property id
+            ResourceMissingDataError: if given property does not have geometry info to locate itself
+
+        Returns:
+            List[StatisticsOut]: A summary statistics outgoing object per radius, in the order given
+        """
+
+        db_rows = await self._connection.fetch_all(
+            _STATISTICS_RINGS.format(table=self._real_property_table.name),
+            values={
+                'property_id': property_id,
+                'distances': distances,
+                'max_distance': max(distances)
+            })
+        if not db_rows:
+            msg = "Property not found - id: {}".format(property_id)
+            self.logger.error(msg)
+            raise ResourceNotFoundError(msg)
+        if not db_rows[0]["located"]:
+            msg = "Property missing geocode_geo data - id: {}".format(
+                property_id)
+            self.logger.error(msg)
+            raise ResourceMissingDataError(msg)
+        return [self._statistics_out(db_row) for db_row in db_rows]
+
+    async def statistics_many(self, id_distances: List[IdAndDistanceIn],
+                              chunk_size: int
+                             ) -> AsyncGenerator[StatisticsResultOut, None]:
+        """Gets statistics for data near many properties, one query per chunk of requests
+
+        Args:
+            id_distances (List[IdAndDistanceIn]): property ids and search radii in meters
+            chunk_size (int): number of requests per query
+
+        Yields:
+            StatisticsResultOut: statistics or the reason there are none, per request
+                in request order, a chunk at a time as each chunk query finishes
+        """
+
+        for start in range(0, len(id_distances), chunk_size):
+            chunk = id_distances[start:start + chunk_size]
+            db_rows = await self._statistics_rows(
+                [id_distance.property_id for id_distance in chunk],
+                [id_distance.distance for id_distance in chunk])
+            for id_distance, db_row in zip(chunk, db_rows):
+                result = StatisticsResultOut(
+                    index=start + db_row["position"] - 1,
+                    property_id=id_distance.property_id,
+                    distance=id_distance.distance)
+                if not db_row["found"]:
+                    result.message = "Property not found - id: {}".format(
+                        id_distance.property_id)
+                elif not db_row["located"]:
+                    result.message = "Property missing geocode_geo data - id: {}".format(
+                        id_distance.property_id)
+                else:
+                    result.statistics = self._statistics_out(db_row)
+                yield result
+
+    async def _statistics_rows(self, property_ids: List[str],
+                               distances: List[int]) -> List[Any]:
+        return await self._connection.fetch_all(
+            _STATISTICS.format(table=self._real_property_table.name),
+            values={
+                'property_ids': property_ids,
+                'distances': distances
+            })
+
+    @staticmethod
+    def _statistics_out(db_row) -> StatisticsOut:
+        return StatisticsOut(
+            parcel_area=db_row["parcel_area"],
+            buildings_area_distance=json.loads(
+                db_row["buildings_area_distance"]),
+            zone_area=db_row["zone_area"],
+            zone_density=db_row["zone_density"])
 
     @decorators.logtime_async(1)
     async def get_image(self, property_id) -> str:
@@ -208,7 +791,8 @@ class RealPropertyQueries():
             ResourceMissingDataError: if property does not have a url for image
 
         Returns:
-            str: image file name/path
+            str: image file name/path, pinned in the image cache until released
+                (see ImageCache.release) once it is sent
         """
 
         # get property image url
@@ -225,42 +809,11 @@ class RealPropertyQueries():
             self.logger.error(msg)
             raise ResourceMissingDataError(msg)
 
-        # get image
-        # with temporary placeholder for progress reporting, add logging etc.
-        # timeouts on url not found, badly formed urls, etc. not handled
-        total_size = 0
-        start = time()
-        print_size = 0.0
-        file_name = os.path.join('geoapi/static/tmp',
-                                 os.path.basename(db_row["image_url"]))
-        timeout = aiohttp.ClientTimeout(
-            total=5 * 60, connect=30)  # could put in config eventually
+        # get image - from the image cache, downloaded and converted only when needed
         try:
-            async with aiohttp.ClientSession(timeout=timeout) as session:
-                async with session.get(db_row["image_url"]) as r:
-                    async with aiofiles.open(file_name, 'wb') as fd:
-                        self.logger.info('file download started: %s', db_row["image_url"])
-                        while True:
-                            chunk = await r.content.read(16144)
-                            if not chunk:
-                                break
-                            await fd.write(chunk)
-                            total_size += len(chunk)
-                            print_size += len(chunk)
-                            if (print_size / (1024 * 1024)
-                               ) > 100:  # print every 100MB download
-                                msg = f'{time() - start:0.2f}s, downloaded: {total_size / (1024 * 1024):0.0f}MB'
-                                self.logger.info(msg)
-                                print_size = (print_size / (1024 * 1024)) - 100
-                        self.logger.info('file downloaded: %s', file_name)
-                        log_msg = f'total time: {time() - start:0.2f}s, total size: {total_size / (1024 * 1024):0.0f}MB'
-                        self.logger.info(log_msg)
-            # convert to jpeg
-            file_name_jpg = os.path.splitext(file_name)[0] + ".jpg"
-            img = Image.open(file_name)
-            img.save(file_name_jpg, "JPEG", quality=100)
-
+            image_path = await image_cache.get_image_cache().get(
+                db_row["image_url"])
         except aiohttp.client_exceptions.ServerTimeoutError as ste:
             self.logger.error('Time out: %s', str(ste))
             raise
-        return file_name_jpg
+        return str(image_path)
@@ -0,0 +1,112 @@
+"""Precomputed Aggregation Summaries
+
+The aggregation endpoint groups properties into web mercator grid cells on the fly.
+For the hottest zooms the cells can be precomputed into the property_cells table
+(see migration 3): a refresh registers the cell size of a zoom and rebuilds its cells,
+afterwards a trigger keeps them current on every write and the endpoint reads them
+instead of aggregating the properties.
+
+Usage:
+    cd to the src folder and run:
+        python -m geoapi.data.summary --zooms 4 6 8 10
+        python -m geoapi.data.summary --zooms 4 --remove
+"""
+
+import argparse
+import asyncio
+import logging
+from typing import List
+import databases
+import geoapi.config.api_configurator as config
+import geoapi.config.bootstrap as bootstrap
+import geoapi.common.tiles as tiles
+
+_REBUILD = """
+    INSERT INTO property_cells (cell_size, x, y, property_count, parcel_area, building_area)
+    SELECT :cell_size, cell.x, cell.y, count(*),
+        COALESCE(SUM(property.parcel_area), 0), COALESCE(SUM(property.building_area), 0)
+    FROM {table} AS property
+    CROSS JOIN LATERAL mercator_cell(property.geocode_geo, :cell_size) AS cell
+    WHERE property.geocode_geo IS NOT NULL
+    GROUP BY cell.x, cell.y
+"""
+
+
+async def refresh(connection: databases.Database, table_name: str,
+                  cell_sizes: List[float]) -> None:
+    """Registers cell sizes and rebuilds their summaries
+
+    Args:
+        connection (databases.Database): connected database, migrated
+        table_name (str): properties table
+        cell_sizes (List[float]): cell sizes in web mercator meters, see tiles.cell_size
+    """
+
+    logger = logging.getLogger(__name__)
+    for cell_size in cell_sizes:
+        async with connection.transaction():
+            # writes wait for the rebuild, none is missed by both the rebuild and the trigger
+            await connection.execute(
+                'LOCK TABLE {table} IN SHARE MODE'.format(table=table_name))
+            await connection.execute(
+                'INSERT INTO property_cell_sizes (cell_size) VALUES (:cell_size) '
+                'ON CONFLICT DO NOTHING',
+                values={'cell_size': cell_size})
+            await connection.execute(
+                'DELETE FROM property_cells WHERE cell_size = :cell_size',
+                values={'cell_size': cell_size})
+            await connection.execute(_REBUILD.format(table=table_name),
+                                     values={'cell_size': cell_size})
+        logger.info('summary refreshed for cell size %s', cell_size)
+
+
+async def remove(connection: databases.Database, cell_sizes: List[float]) -> None:
+    """Drops the summaries of cell sizes, they are aggregated on the fly again
+
+    Args:
+        connection (databases.Database): connected database, migrated
+        cell_sizes (List[float]): cell sizes in web mercator meters, see tiles.cell_size
+    """
+
+    async with connection.transaction():
+        await connection.execute(
+            'DELETE FROM property_cell_sizes WHERE cell_size = ANY(:cell_sizes)',
+            values={'cell_sizes': cell_sizes})
+        await connection.execute(
+            'DELETE FROM property_cells WHERE cell_size = ANY(:cell_sizes)',
+            values={'cell_sizes': cell_sizes})
+
+
+async def run(database_url: str, cell_sizes: List[float], drop: bool) -> None:
+    """Refreshes or removes (drop) the summaries of cell sizes in a database"""
+    connection = databases.Database(database_url)
+    await connection.connect()
+    try:
+        if drop:
+            await remove(connection, cell_sizes)
+        else:
+            await refresh(connection, 'properties', cell_sizes)
+    finally:
+        await connection.disconnect()
+
+
+def main() -> None:
+    """Command line entry point"""
+    parser = argparse.ArgumentParser(
+        description='Precompute the aggregation grid cells of zooms')
+    parser.add_argument('--zooms', type=int, nargs='+', required=True,
+                        help='zooms of the aggregation endpoint to precompute')
+    parser.add_argument('--remove', action='store_true',
+                        help='drop the summaries of the zooms instead')
+    parser.add_argument('--database-url', default=None,
+                        help='defaults to GEOAPI_DATABASE_URL')
+    args = parser.parse_args()
+
+    bootstrap.init()
+    asyncio.get_event_loop().run_until_complete(
+        run(args.database_url or config.API_CONFIG['GEOAPI_DATABASE_URL'],
+            [tiles.cell_size(zoom) for zoom in args.zooms], args.remove))
+
+
+if __name__ == '__main__':
+    main()
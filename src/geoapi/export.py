@@ -0,0 +1,118 @@
+"""Columnar Export of the Property Table
+
+Writes all properties to an Arrow IPC stream or a GeoParquet file, read from a server side
+cursor and encoded a batch at a time (see geoapi.common.columnar), the same output as
+GET /properties/export/. Memory use is bounded by the batch size.
+
+Usage:
+    cd to the src folder and run:
+        python -m geoapi.export path/to/properties.parquet
+        python -m geoapi.export path/to/properties.arrows --format arrow
+"""
+
+import argparse
+import asyncio
+import json
+import time
+from pathlib import Path
+from typing import Dict
+import aiofiles
+import geoapi.config.api_configurator as config
+import geoapi.config.bootstrap as bootstrap
+import geoapi.common.columnar as columnar
+from geoapi.common.json_models import ExportFormatEnum
+from geoapi.data.db import DB
+
+_FORMATS_BY_SUFFIX = {
+    '.arrow': ExportFormatEnum.arrow,
+    '.arrows': ExportFormatEnum.arrow,
+    '.parquet': ExportFormatEnum.parquet,
+}
+
+
+async def export(target_path: Path, export_format: ExportFormatEnum,
+                 database_url: str, batch_size: int) -> Dict[str, float]:
+    """Exports the properties table to a file
+
+    Args:
+        target_path (Path): output file, written to a temporary name and renamed into place
+        export_format (ExportFormatEnum): Arrow IPC stream or GeoParquet
+        database_url (str): database to export
+        batch_size (int): records per batch
+
+    Returns:
+        Dict[str, float]: rows, bytes, seconds and rows per second
+    """
+
+    db_api = DB(database_url)
+    await db_api.connection.connect()
+    start = time.perf_counter()
+    rows = 0
+    written = 0
+    temporary_path = target_path.with_name(target_path.name + '.tmp')
+    try:
+
+        async def counted_batches():
+            nonlocal rows
+            db_batches = db_api.real_property_queries.export_batches(batch_size)
+            try:
+                async for db_rows in db_batches:
+                    rows += len(db_rows)
+                    yield db_rows
+            finally:
+                await db_batches.aclose()
+
+        chunks = columnar.encode(counted_batches(), export_format)
+        try:
+            async with aiofiles.open(temporary_path, 'wb') as target_file:
+                async for chunk in chunks:
+                    await target_file.write(chunk)
+                    written += len(chunk)
+        finally:
+            await chunks.aclose()
+        temporary_path.replace(target_path)
+    finally:
+        await db_api.connection.disconnect()
+        if temporary_path.exists():
+            temporary_path.unlink()
+    seconds = time.perf_counter() - start
+    return {
+        'rows': rows,
+        'bytes': written,
+        'seconds': round(seconds, 3),
+        'rows_per_second': round(rows / seconds, 1) if seconds else 0.0
+    }
+
+
+def main() -> None:
+    """Command line entry point"""
+    parser = argparse.ArgumentParser(
+        description='Export the properties table as Arrow IPC or GeoParquet')
+    parser.add_argument('target', type=Path, help='output file')
+    parser.add_argument('--format', dest='export_format',
+                        choices=[export_format.value for export_format in ExportFormatEnum],
+                        help='output format, detected from the file suffix by default')
+    parser.add_argument('--batch-size', type=int, default=None,
+                        help='rows per batch, defaults to GEOAPI_EXPORT_BATCH_SIZE')
+    parser.add_argument('--database-url', default=None,
+                        help='defaults to GEOAPI_DATABASE_URL')
+    args = parser.parse_args()
+
+    logger = bootstrap.init()
+    export_format = (ExportFormatEnum(args.export_format) if args.export_format
+                     else _FORMATS_BY_SUFFIX.get(args.target.suffix.lower()))
+    if export_format is None:
+        parser.error('unknown file format, use --format')
+    report = asyncio.get_event_loop().run_until_complete(
+        export(target_path=args.target,
+               export_format=export_format,
+               database_url=args.database_url or
+               config.API_CONFIG['GEOAPI_DATABASE_URL'],
+               batch_size=args.batch_size or
+               int(config.API_CONFIG['GEOAPI_EXPORT_BATCH_SIZE'])))
+    logger.info('export finished: %s', report)
+    print(json.dumps(report))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,283 @@
+"""Offline Bulk Ingestion of Property Files
+
+Streams features from a large vector file, converts them to copy records in a process pool
+and pipelines the converted batches into the properties table with binary COPY.
+Memory use is bounded by the batch size and the number of batches in flight.
+
+Supported files:
+    ndjson (.ndjson, .geojsonl, .geojsons, .jsonl) - one RealPropertyIn json object
+        or one Geojson Feature per line
+    geojson (.geojson, .json) - a Geojson FeatureCollection, read incrementally (needs ijson)
+    geopackage (.gpkg) - a layer of features (needs Fiona)
+Features have the property geocode as their geometry (see --geometry-field)
+and the other property fields as their properties.
+
+Progress is checkpointed after every committed batch, so an interrupted run
+continues where it stopped when started again with the same checkpoint file.
+Existing property ids are skipped, never overwritten.
+
+Usage:
+    cd to the src folder and run:
+        python -m geoapi.ingest path/to/properties.ndjson --workers 4
+"""
+
+import argparse
+import asyncio
+import collections
+import itertools
+import json
+import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Tuple
+import geoapi.config.api_configurator as config
+import geoapi.config.bootstrap as bootstrap
+from geoapi.common.json_models import RealPropertyIn
+from geoapi.data.commands import RealPropertyCommands
+from geoapi.data.db import DB
+
+_FORMATS_BY_SUFFIX = {
+    '.ndjson': 'ndjson',
+    '.geojsonl': 'ndjson',
+    '.geojsons': 'ndjson',
+    '.jsonl': 'ndjson',
+    '.geojson': 'geojson',
+    '.json': 'geojson',
+    '.gpkg': 'geopackage',
+}
+
+# geography fields that can arrive as geojson text, e.g. from geopackage attribute columns
+_GEOGRAPHY_FIELDS = ('geocode_geo', 'parcel_geo', 'building_geo',
+                     'image_bounds')
+
+
+def _read_ndjson(path: Path, layer: str) -> Iterator[bytes]:  # pylint: disable=unused-argument
+    with open(path, 'rb') as ndjson_file:
+        for line in ndjson_file:
+            if line.strip():
+                yield line
+
+
+def _read_geojson(path: Path, layer: str) -> Iterator[Dict]:  # pylint: disable=unused-argument
+    import ijson  # pylint: disable=import-outside-toplevel
+    with open(path, 'rb') as geojson_file:
+        yield from ijson.items(geojson_file, 'features.item', use_float=True)
+
+
+def _read_geopackage(path: Path, layer: str) -> Iterator[Dict]:
+    import fiona  # pylint: disable=import-outside-toplevel
+    with fiona.open(str(path), layer=layer) as collection:
+        for feature in collection:
+            yield {
+                'type': 'Feature',
+                'id': feature.get('id'),
+                'geometry': dict(feature['geometry']) if feature['geometry'] else None,
+                'properties': dict(feature['properties']),
+            }
+
+
+_READERS = {
+    'ndjson': _read_ndjson,
+    'geojson': _read_geojson,
+    'geopackage': _read_geopackage,
+}
+
+
+def _to_real_property_in(raw_row: Any, geometry_field: str) -> RealPropertyIn:
+    """returns a property from a raw feature, property object or ndjson line"""
+    if isinstance(raw_row, bytes):
+        raw_row = json.loads(raw_row)
+    if raw_row.get('type') != 'Feature':
+        return RealPropertyIn(**raw_row)
+    properties = dict(raw_row.get('properties') or {})
+    for field in _GEOGRAPHY_FIELDS:
+        if isinstance(properties.get(field), str):
+            properties[field] = json.loads(properties[field])
+    return RealPropertyIn.from_feature(dict(raw_row, properties=properties),
+                                       geometry_field)
+
+
+def convert_batch(raw_rows: List[Any],
+                  geometry_field: str) -> Tuple[List[Tuple[Any, ...]], int]:
+    """Converts raw rows to copy records, runs in the worker processes
+
+    Args:
+        raw_rows (List[Any]): features, property objects or ndjson lines
+        geometry_field (str): property field that receives the feature geometry
+
+    Returns:
+        Tuple[List[Tuple[Any, ...]], int]: copy records with unique ids
+            and the count of invalid rows
+    """
+    records = []
+    seen_ids = set()
+    invalid = 0
+    for raw_row in raw_rows:
+        try:
+            real_property_in = _to_real_property_in(raw_row, geometry_field)
+            record = RealPropertyCommands.to_valid_copy_record(real_property_in)
+        except Exception:  # pylint: disable=broad-except
+            # any bad row is counted and skipped, the run continues
+            invalid += 1
+            continue
+        if real_property_in.id in seen_ids:
+            continue
+        seen_ids.add(real_property_in.id)
+        records.append(record)
+    return records, invalid
+
+
+def _batches(raw_rows: Iterator[Any], batch_size: int) -> Iterator[List[Any]]:
+    while True:
+        batch = list(itertools.islice(raw_rows, batch_size))
+        if not batch:
+            return
+        yield batch
+
+
+class Checkpoint():
+    """Resumable progress of an ingestion run, stored as json next to the source file"""
+
+    def __init__(self, checkpoint_path: Path, source_path: Path):
+        self._checkpoint_path = checkpoint_path
+        self.state: Dict[str, Any] = {
+            'source': str(source_path.resolve()),
+            'rows': 0,
+            'created': 0,
+            'conflicts': 0,
+            'invalid': 0,
+        }
+        if checkpoint_path.exists():
+            with open(checkpoint_path) as checkpoint_file:
+                saved_state = json.load(checkpoint_file)
+            if saved_state.get('source') == self.state['source']:
+                self.state.update(saved_state)
+
+    def advance(self, rows: int, created: int, conflicts: int,
+                invalid: int) -> None:
+        """records a committed batch, written atomically so a crash never leaves a partial file"""
+        self.state['rows'] += rows
+        self.state['created'] += created
+        self.state['conflicts'] += conflicts
+        self.state['invalid'] += invalid
+        temporary_path = self._checkpoint_path.with_name(
+            self._checkpoint_path.name + '.tmp')
+        with open(temporary_path, 'w') as checkpoint_file:
+            json.dump(self.state, checkpoint_file)
+        os.replace(temporary_path, self._checkpoint_path)
+
+
+async def ingest(source_path: Path, file_format: str, layer: str,
+                 geometry_field: str, database_url: str, batch_size: int,
+                 workers: int, checkpoint: Checkpoint) -> Dict[str, Any]:
+    """Loads a file into the properties table
+
+    Returns:
+        Dict[str, Any]: rows read, created, conflicts, invalid, seconds
+            and rows_per_second of this run
+    """
+
+    logger = logging.getLogger(__name__)
+    db_api = DB(database_url)
+    await db_api.connection.connect()
+    loop = asyncio.get_event_loop()
+    start = time.perf_counter()
+    last_report = start
+    run_totals = collections.Counter()
+    skipped = checkpoint.state['rows']
+    if skipped:
+        logger.info('resuming after %d rows', skipped)
+
+    async def copy_batch(row_count: int, converted) -> None:
+        records, invalid = await converted
+        created_ids = await db_api.real_property_commands.copy_records(
+            records) if records else set()
+        created = len(created_ids)
+        conflicts = row_count - invalid - created
+        checkpoint.advance(row_count, created, conflicts, invalid)
+        run_totals.update(rows=row_count,
+                          created=created,
+                          conflicts=conflicts,
+                          invalid=invalid)
+
+    try:
+        raw_rows = itertools.islice(
+            _READERS[file_format](source_path, layer), skipped, None)
+        # converted batches waiting for COPY, bounds memory
+        in_flight: collections.deque = collections.deque()
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            for batch in _batches(raw_rows, batch_size):
+                in_flight.append((len(batch),
+                                  loop.run_in_executor(pool, convert_batch,
+                                                       batch, geometry_field)))
+                if len(in_flight) > workers:
+                    await copy_batch(*in_flight.popleft())
+                if time.perf_counter() - last_report > 10:
+                    last_report = time.perf_counter()
+                    logger.info('%d rows, %.0f rows/sec', run_totals['rows'],
+                                run_totals['rows'] / (last_report - start))
+            while in_flight:
+                await copy_batch(*in_flight.popleft())
+    finally:
+        await db_api.connection.disconnect()
+
+    seconds = time.perf_counter() - start
+    report: Dict[str, Any] = dict(rows=run_totals['rows'],
+                                  created=run_totals['created'],
+                                  conflicts=run_totals['conflicts'],
+                                  invalid=run_totals['invalid'])
+    report['seconds'] = round(seconds, 2)
+    report['rows_per_second'] = round(run_totals['rows'] / seconds) if seconds else 0
+    return report
+
+
+def main() -> None:
+    """Command line entry point"""
+    parser = argparse.ArgumentParser(
+        description='Bulk load a property file into the properties table')
+    parser.add_argument('source', type=Path, help='ndjson, geojson or gpkg file')
+    parser.add_argument('--format', dest='file_format',
+                        choices=sorted(_READERS),
+                        help='file format, detected from the file suffix by default')
+    parser.add_argument('--layer', default=None, help='geopackage layer name')
+    parser.add_argument('--geometry-field', default='geocode_geo',
+                        choices=['geocode_geo', 'parcel_geo', 'building_geo',
+                                 'image_bounds'],
+                        help='property field that receives the feature geometry')
+    parser.add_argument('--batch-size', type=int, default=None,
+                        help='rows per COPY, defaults to GEOAPI_BULK_CHUNK_SIZE')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                        help='conversion processes')
+    parser.add_argument('--checkpoint', type=Path, default=None,
+                        help='checkpoint file, defaults to <source>.checkpoint')
+    parser.add_argument('--database-url', default=None,
+                        help='defaults to GEOAPI_DATABASE_URL')
+    args = parser.parse_args()
+
+    logger = bootstrap.init()
+    file_format = args.file_format or _FORMATS_BY_SUFFIX.get(
+        args.source.suffix.lower())
+    if file_format is None:
+        parser.error('unknown file format, use --format')
+    checkpoint = Checkpoint(
+        args.checkpoint or args.source.with_name(args.source.name + '.checkpoint'),
+        args.source)
+    report = asyncio.get_event_loop().run_until_complete(
+        ingest(source_path=args.source,
+               file_format=file_format,
+               layer=args.layer,
+               geometry_field=args.geometry_field,
+               database_url=args.database_url or
+               config.API_CONFIG['GEOAPI_DATABASE_URL'],
+               batch_size=args.batch_size or
+               int(config.API_CONFIG['GEOAPI_BULK_CHUNK_SIZE']),
+               workers=max(args.workers or 1, 1),
+               checkpoint=checkpoint))
+    logger.info('ingest finished: %s', report)
+    print(json.dumps(report))
+
+
+if __name__ == '__main__':
+    main()
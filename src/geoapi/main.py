@@ -9,11 +9,10 @@ TODO: change uvicorn to hypercorn and insure http/2 usage with uviloop
 """
 
 import logging
-from pathlib import Path
 import uvicorn
 from fastapi import FastAPI
 import geoapi.config.api_configurator as config
-import geoapi.log.api_logger as api_logger
+from geoapi.config.bootstrap import init
 import geoapi.api
 
 
@@ -32,25 +31,7 @@ def main() -> FastAPI:
             source rundev.sh
     """
 
-    # get api configuration
-    # - default embedded config file path
-    embedded_config_ini_filepath: Path = Path('geoapi/config/config.ini')
-    # environmental variable for external config file path (if not using default above)
-    config_ini_env_key: str = 'GEOAPI_CONFIG_INI'
-    api_config, external_config_load_error = config.init(
-        embedded_config_ini_filepath, config_ini_env_key)
-    # set the global config dictionary so other modules can import and use it
-    config.API_CONFIG = api_config
-
-    # get logging
-    api_log_level = config.API_CONFIG['GEOAPI_LOG_LEVEL']
-    levelnum = logging.getLevelName(api_log_level.upper())
-    logger = api_logger.init(level=levelnum)
-    if external_config_load_error:
-        logger.error(
-            'Unable to load external supplied config.ini file. \
-            Using default embedded config.ini file')
-
+    logger = init()
     try:
         fast_api = geoapi.api.create_api(
             database_url=config.API_CONFIG['GEOAPI_DATABASE_URL'],
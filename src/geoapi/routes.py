@@ -4,17 +4,118 @@ Returns:
     APIRouter: FastAPI Router with all routes configured
 """
 
-from typing import List
+import json
+from typing import List, Dict, Any, AsyncGenerator, AsyncIterator, Callable, Optional, Tuple
 import aiohttp
-from fastapi import APIRouter, HTTPException
-from starlette.responses import FileResponse
+from fastapi import APIRouter, HTTPException, Query
+from starlette.requests import Request
+from starlette.responses import Response, StreamingResponse
 from asyncpg.exceptions import UniqueViolationError
 from geoapi.common.exceptions import ResourceNotFoundError, ResourceMissingDataError
+from geoapi.common.exceptions import ServiceUnavailableError, ResourceTimeoutError
 from geoapi.data.db import DB
+from geoapi.data.commands import RealPropertyCommands
+import geoapi.config.api_configurator as config
+import geoapi.common.image_cache as image_cache
+import geoapi.common.worker_pool as worker_pool
+import geoapi.common.tiles as tiles
+import geoapi.common.columnar as columnar
+import geoapi.common.responses as responses
 from geoapi.common.json_models import RealPropertyIn
 from geoapi.common.json_models import RealPropertyOut
-from geoapi.common.json_models import GeometryAndDistanceIn
-from geoapi.common.json_models import StatisticsOut
+from geoapi.common.json_models import GeometryAndDistanceIn, GeometryAndDistanceLimitIn
+from geoapi.common.json_models import NearestIn, PropertyDistanceOut
+from geoapi.common.json_models import AggregateCellOut, GeometryOutputIn
+from geoapi.common.json_models import StatisticsOut, IdAndDistanceIn
+from geoapi.common.json_models import StreamFormatEnum, ExportFormatEnum, ChangesOut
+from geoapi.common.json_models import BulkResultOut, BulkRowStatusEnum
+
+_STREAM_MEDIA_TYPES = {
+    StreamFormatEnum.ndjson: 'application/x-ndjson',
+    StreamFormatEnum.geojson: 'application/geo+json',
+}
+
+
+def _geometry_output(simplify: Optional[float],
+                     precision: Optional[int]) -> Optional[GeometryOutputIn]:
+    """requested resolution of the outgoing geometries, None for full resolution"""
+    if simplify is None and precision is None:
+        return None
+    return GeometryOutputIn(simplify=simplify, precision=precision)
+
+
+def _geometry_bytes_headers(output: Optional[GeometryOutputIn]) -> Dict[str, str]:
+    """headers reporting the geojson bytes sent and saved by the requested resolution"""
+    if output is None:
+        return {}
+    return {
+        'X-Geometry-Bytes': str(output.geometry_bytes),
+        'X-Geometry-Bytes-Full': str(output.full_geometry_bytes),
+        'X-Geometry-Bytes-Saved': str(output.bytes_saved())
+    }
+
+
+def _raw_json_response(content: str, headers: Dict[str, str]) -> Response:
+    """response of json stitched by the queries (see geoapi.common.raw_json),
+    FastAPI sends it as it is instead of validating it against the response_model,
+    and ignores the headers set on the injected response, so they are passed here"""
+    return Response(content, media_type='application/json', headers=headers)
+
+
+def _real_property_from_line(line: bytes) -> RealPropertyIn:
+    """returns a property from one ndjson line"""
+    return RealPropertyIn(**json.loads(line))
+
+
+async def _bulk_create(real_property_commands: RealPropertyCommands,
+                       raw_rows: AsyncIterator[Any],
+                       real_property_factory: Callable[[Any], RealPropertyIn],
+                       chunk_size: int) -> BulkResultOut:
+    """validates and converts rows, inserts the valid ones a chunk at a time,
+    ids repeated within the request are reported as conflicts"""
+    results: List[Dict[str, Any]] = []
+    seen_ids = set()
+    chunk: List[Tuple[Any, ...]] = []
+    chunk_results: List[Dict[str, Any]] = []
+
+    async def flush():
+        created_ids = await real_property_commands.copy_records(chunk)
+        for result in chunk_results:
+            result['status'] = (BulkRowStatusEnum.created
+                                if result['id'] in created_ids else
+                                BulkRowStatusEnum.conflict)
+        chunk.clear()
+        chunk_results.clear()
+
+    async for raw_row in raw_rows:
+        result: Dict[str, Any] = {'index': len(results)}
+        results.append(result)
+        try:
+            real_property = real_property_factory(raw_row)
+            result['id'] = real_property.id
+            # malformed geometries pass pydantic and only fail converting to wkb
+            copy_record = real_property_commands.to_valid_copy_record(real_property)
+        except (ValueError, TypeError, AttributeError) as exc:
+            result['status'] = BulkRowStatusEnum.invalid
+            result['message'] = str(exc)
+            continue
+        if real_property.id in seen_ids:
+            result['status'] = BulkRowStatusEnum.conflict
+            continue
+        seen_ids.add(real_property.id)
+        chunk.append(copy_record)
+        chunk_results.append(result)
+        if len(chunk) >= chunk_size:
+            await flush()
+    if chunk:
+        await flush()
+
+    statuses = [result['status'] for result in results]
+    return BulkResultOut(
+        created=statuses.count(BulkRowStatusEnum.created),
+        conflicts=statuses.count(BulkRowStatusEnum.conflict),
+        invalid=statuses.count(BulkRowStatusEnum.invalid),
+        results=results)
 
 
 # pylint: disable=unused-variable
@@ -58,6 +159,8 @@ def create_routes(api_db: DB) -> APIRouter:
             HTTPException(404): Raised if no property with property_id found in the db
             HTTPException(422): Raised if property with property_id does not have image url
             HTTPException(500): Raised if server timed out getting image
+            HTTPException(503): Raised if too many images are being converted
+            HTTPException(504): Raised if converting the image took too long
 
         Returns:
 
@@ -79,13 +182,20 @@ def create_routes(api_db: DB) -> APIRouter:
                     'message': 'Server timeout while getting image.',
                     'detail': ste.args[0]
                 }) from ste
+        except ServiceUnavailableError as sue:
+            raise HTTPException(status_code=503,
+                                detail={'message': sue.args[0]})
+        except ResourceTimeoutError as rte:
+            raise HTTPException(status_code=504,
+                                detail={'message': rte.args[0]})
         else:
-            return FileResponse(image_file, media_type="image/jpeg")
+            return responses.CachedImageResponse(image_file, media_type="image/jpeg")
 
     @router.get("/properties/{property_id}/statistics/",
                 response_model=StatisticsOut)
     async def get_statistics_near_property(property_id: str,
-                                           distance: int = 10) -> StatisticsOut:
+                                           distance: int = Query(10, gt=0)
+                                          ) -> StatisticsOut:
         """Get statistics for data near a property
 
         Args:
@@ -115,13 +225,333 @@ def create_routes(api_db: DB) -> APIRouter:
         else:
             return statistics_out
 
+    @router.get("/properties/{property_id}/statistics/rings/",
+                response_model=List[StatisticsOut])
+    async def get_ring_statistics_near_property(
+            property_id: str, distances: List[int] = Query(...)
+    ) -> List[StatisticsOut]:
+        """Get statistics for data near a property for several distances in one pass
+
+        Args:
+
+            property_id (str): property id,
+            distances (List[int]): Distances (in meters, above 0) to buffer the property,
+                e.g. ?distances=10&distances=50&distances=100. At most
+                GEOAPI_STATISTICS_MAX_RINGS distances.
+
+        Raises:
+
+            HTTPException(404): Raised if no property with property_id found in the db
+            HTTPException(422): Raised if property with property_id does not have enough data
+                to calculate statistics, if there are too many distances or a distance is not
+                above 0
+
+        Returns:
+
+            List[StatisticsOut]: outgoing statistics object per distance, in the order given
+        """
+        max_rings = int(config.API_CONFIG['GEOAPI_STATISTICS_MAX_RINGS'])
+        if len(distances) > max_rings:
+            raise HTTPException(
+                status_code=422,
+                detail={
+                    'message':
+                        'Too many distances, at most {} per request.'.format(
+                            max_rings)
+                })
+        if min(distances) <= 0:
+            raise HTTPException(
+                status_code=422,
+                detail={'message': 'Distances must be above 0.'})
+        try:
+            statistics_out_list = await api_db.real_property_queries.statistics_rings(
+                property_id, distances)
+        except ResourceNotFoundError as rnf:
+            raise HTTPException(status_code=404,
+                                detail={'message': rnf.args[0]})
+        except ResourceMissingDataError as rmd:
+            raise HTTPException(status_code=422,
+                                detail={'message': rmd.args[0]})
+        else:
+            return statistics_out_list
+
+    @router.post("/properties/statistics/batch/")
+    async def get_statistics_near_properties(
+            id_distances: List[IdAndDistanceIn]) -> StreamingResponse:
+        """Get statistics for data near many properties, streamed as ndjson
+
+        Requests are computed GEOAPI_STATISTICS_BATCH_CHUNK_SIZE at a time, each chunk with
+        one db query, and the results of a chunk are streamed as soon as it is done.
+
+        Args:
+
+            id_distances (List[IdAndDistanceIn]): list of property id and distance (in meters,
+                above 0) objects. At most GEOAPI_STATISTICS_BATCH_MAX_ITEMS objects.
+
+            Example:
+                [
+                    {"property_id": "f1650f2a99824f349643ad234abff6a2", "distance": 50},
+                    {"property_id": "3290ec7dd190478aab124f6f2f32bdd7", "distance": 100}
+                ]
+
+        Raises:
+
+            HTTPException(422): Raised if there are more than GEOAPI_STATISTICS_BATCH_MAX_ITEMS
+                objects
+
+        Returns:
+
+            StreamingResponse: ndjson, one StatisticsResultOut object per line in request order,
+                with the statistics or a message if the property is not found or has no geocode
+        """
+        max_items = int(config.API_CONFIG['GEOAPI_STATISTICS_BATCH_MAX_ITEMS'])
+        if len(id_distances) > max_items:
+            raise HTTPException(
+                status_code=422,
+                detail={
+                    'message':
+                        'Too many properties, at most {} per request.'.format(
+                            max_items)
+                })
+        chunk_size = int(config.API_CONFIG['GEOAPI_STATISTICS_BATCH_CHUNK_SIZE'])
+
+        async def results() -> AsyncGenerator[str, None]:
+            async for result in api_db.real_property_queries.statistics_many(
+                    id_distances, chunk_size):
+                yield result.json() + '\n'
+
+        return StreamingResponse(
+            results(), media_type=_STREAM_MEDIA_TYPES[StreamFormatEnum.ndjson])
+
+    async def nearest(nearest_in: NearestIn) -> List[PropertyDistanceOut]:
+        max_k = int(config.API_CONFIG['GEOAPI_NEAREST_MAX_K'])
+        if nearest_in.k > max_k:
+            raise HTTPException(
+                status_code=422,
+                detail={'message': 'k must be at most {}.'.format(max_k)})
+        try:
+            out_list = await api_db.real_property_queries.nearest(nearest_in)
+        except ResourceNotFoundError as rnf:
+            raise HTTPException(status_code=404,
+                                detail={'message': rnf.args[0]})
+        else:
+            return out_list
+
+    # nearest, export, changes and aggregate are declared before /properties/{property_id}/,
+    # which would match them as an id
+    @router.get("/properties/nearest/", response_model=List[PropertyDistanceOut])
+    async def get_nearest_properties(lon: float, lat: float,
+                                     k: int = Query(10, ge=1)
+                                    ) -> List[PropertyDistanceOut]:
+        """Get the k properties nearest to a point, with their distances
+
+        Args:
+
+            lon (float): longitude of the point
+            lat (float): latitude of the point
+            k (int): number of properties, at most GEOAPI_NEAREST_MAX_K. Defaults to 10.
+
+        Raises:
+
+            HTTPException(404): Raised if there are no properties with a geocode
+            HTTPException(422): Raised if k is above GEOAPI_NEAREST_MAX_K
+
+        Returns:
+
+            List[PropertyDistanceOut]: property ids and distances (in meters), nearest first
+        """
+        return await nearest(
+            NearestIn(location_geo={
+                "type": "Point",
+                "coordinates": [lon, lat]
+            },
+                      k=k))
+
+    @router.post("/properties/nearest/", response_model=List[PropertyDistanceOut])
+    async def find_nearest_properties(
+            nearest_in: NearestIn) -> List[PropertyDistanceOut]:
+        """Get the k properties nearest to a geometry, with their distances
+
+        Args:
+
+            nearest_in (NearestIn): Geojson based geometry and the number of properties k,
+                at most GEOAPI_NEAREST_MAX_K.
+
+            Example:
+                {
+                    "k": 5,
+                    "location_geo": {"type": "Point", "coordinates": [-73.748751,40.918548]}
+                }
+
+        Raises:
+
+            HTTPException(404): Raised if there are no properties with a geocode
+            HTTPException(422): Raised if k is above GEOAPI_NEAREST_MAX_K
+
+        Returns:
+
+            List[PropertyDistanceOut]: property ids and distances (in meters), nearest first
+        """
+        return await nearest(nearest_in)
+
+    @router.get(
+        "/properties/export/",
+        responses={
+            200: {
+                "content": {
+                    "application/vnd.apache.arrow.stream": {},
+                    "application/vnd.apache.parquet": {}
+                },
+                "description": "All properties in a columnar format.",
+            }
+        },
+    )
+    async def export_properties(
+            export_format: ExportFormatEnum = Query(ExportFormatEnum.arrow,
+                                                    alias='format')
+    ) -> StreamingResponse:
+        """Export all property records in a columnar format, for bulk analysis
+
+        Properties are read from a server side cursor and encoded a batch of
+        GEOAPI_EXPORT_BATCH_SIZE records at a time. Geography columns are WKB,
+        described by GeoParquet "geo" schema metadata in both formats.
+        Also available from the command line: python -m geoapi.export
+
+        Args:
+
+            format (ExportFormatEnum): 'arrow' (Arrow IPC stream) or 'parquet' (GeoParquet).
+                Defaults to 'arrow'.
+
+        Returns:
+
+            StreamingResponse: the properties ordered by id, with the columns id, geocode_geo,
+                parcel_geo, building_geo, image_bounds and image_url
+        """
+        batch_size = int(config.API_CONFIG['GEOAPI_EXPORT_BATCH_SIZE'])
+        return responses.ClosingStreamingResponse(
+            columnar.encode(
+                api_db.real_property_queries.export_batches(batch_size),
+                export_format),
+            media_type=columnar.MEDIA_TYPES[export_format],
+            headers={
+                'Content-Disposition':
+                    'attachment; filename="properties{}"'.format(
+                        columnar.FILE_EXTENSIONS[export_format])
+            })
+
+    @router.get("/properties/changes/", response_model=ChangesOut)
+    async def get_property_changes(since: str = None,
+                                   limit: int = Query(100, ge=1, le=1000)
+                                  ) -> ChangesOut:
+        """Get the properties inserted, updated or deleted since a token, to keep copies in sync
+
+        Every write is tracked by the db (see geoapi.data.migrations), deletions
+        leave a deletion record. Changes are ordered by the transaction that made them,
+        a property changed several times is reported at its latest change only.
+        Start without a token (every property is reported as an upsert),
+        then pass the next_token of each response as since.
+
+        Args:
+
+            since (str): optional - opaque token, the next_token of the previous response
+            limit (int): maximum number of changes in the response. Defaults to 100.
+
+            Example: /properties/changes/?since=WzEyMzQsICJmMTY1MCJd&limit=500
+
+        Raises:
+
+            HTTPException(422): Raised if since is not a token from this api
+
+        Returns:
+
+            ChangesOut: the changes after the token, oldest first, with the property
+                for upserts, the next token and whether more changes are ready (has_more)
+        """
+        try:
+            return await api_db.real_property_queries.changes(limit, since)
+        except ValueError as value_error:
+            raise HTTPException(status_code=422,
+                                detail={'message': value_error.args[0]})
+
+    @router.get("/properties/aggregate/", response_model=List[AggregateCellOut])
+    async def aggregate_properties(bbox: str,
+                                   zoom: int = Query(None, ge=0),
+                                   cell_size: float = Query(None, gt=0)
+                                  ) -> List[AggregateCellOut]:
+        """Get property counts, parcel areas and building coverage per grid cell, for density maps
+
+        Cells are squares of the web mercator grid, either of a zoom
+        (GEOAPI_AGGREGATE_TILE_CELLS cells across a tile of the zoom) or of a cell size.
+        Properties are counted in the cell of their geocode. Zooms precomputed with
+        geoapi.data.summary are read from the summary table.
+
+        Args:
+
+            bbox (str): min longitude,min latitude,max longitude,max latitude,
+                all cells intersecting the box are returned
+            zoom (int): web map zoom, either zoom or cell_size is required
+            cell_size (float): cell size in web mercator meters
+
+            Example: /properties/aggregate/?bbox=-74.0,40.7,-73.5,41.0&zoom=10
+
+        Raises:
+
+            HTTPException(422): Raised if bbox is not 4 numbers, if not exactly one of zoom
+                and cell_size is given or if there are more than GEOAPI_AGGREGATE_MAX_CELLS cells
+
+        Returns:
+
+            List[AggregateCellOut]: cells with at least one property, by row and column
+        """
+        try:
+            bounds = tuple(float(value) for value in bbox.split(','))
+        except ValueError:
+            bounds = ()
+        if (len(bounds) != 4 or not -180 <= bounds[0] <= bounds[2] <= 180 or
+                not -90 <= bounds[1] <= bounds[3] <= 90):
+            raise HTTPException(
+                status_code=422,
+                detail={
+                    'message':
+                        'bbox must be min longitude,min latitude,max longitude,max latitude.'
+                })
+        if (zoom is None) == (cell_size is None):
+            raise HTTPException(
+                status_code=422,
+                detail={'message': 'Exactly one of zoom and cell_size is required.'})
+        if zoom is not None:
+            cell_size = tiles.cell_size(zoom)
+        max_cells = int(config.API_CONFIG['GEOAPI_AGGREGATE_MAX_CELLS'])
+        columns, rows = tiles.cells_in_bounds(bounds, cell_size)
+        if len(columns) * len(rows) > max_cells:
+            raise HTTPException(
+                status_code=422,
+                detail={
+                    'message':
+                        'Too many cells, at most {} per request.'.format(
+                            max_cells)
+                })
+        return await api_db.map_queries.aggregate(bounds, cell_size)
+
     @router.get("/properties/{property_id}/", response_model=RealPropertyOut)
-    async def get_property(property_id: str) -> RealPropertyOut:
+    async def get_property(property_id: str,
+                           response: Response,
+                           simplify: float = Query(None, gt=0),
+                           precision: int = Query(None, ge=0, le=15)
+                          ) -> RealPropertyOut:
         """Get a single property record
 
         Args:
 
             property_id (str): string representation of a UUID without dashes
+            simplify (float): optional - simplify the parcel and building polygons
+                with a tolerance in meters
+            precision (int): optional - decimal places of the coordinates,
+                defaults to GEOAPI_GEOJSON_PRECISION
+
+            With simplify or precision, the X-Geometry-Bytes, X-Geometry-Bytes-Full and
+            X-Geometry-Bytes-Saved headers report the geojson bytes of the geometries
+            sent and at full resolution.
 
         Raises:
 
@@ -132,21 +562,64 @@ def create_routes(api_db: DB) -> APIRouter:
             RealPropertyOut: RealPropertyOut is the Geojson based
             Data Transfer Object for outgoing data from the API.
         """
+        output = _geometry_output(simplify, precision)
+        raw_json = int(config.API_CONFIG['GEOAPI_RAW_JSON'])
         try:
-            real_property = await api_db.real_property_queries.get(property_id)
+            if raw_json:
+                property_json = await api_db.real_property_queries.get_json(
+                    property_id, output)
+            else:
+                real_property = await api_db.real_property_queries.get(
+                    property_id, output)
         except ResourceNotFoundError as rnf:
             raise HTTPException(status_code=404,
                                 detail={'message': rnf.args[0]})
-        else:
-            return real_property
+        headers = _geometry_bytes_headers(output)
+        if raw_json:
+            return _raw_json_response(property_json, headers)
+        response.headers.update(headers)
+        return real_property
 
-    @router.get("/properties/", response_model=List[RealPropertyOut])
-    async def get_all_properties() -> List[RealPropertyOut]:
-        """Get all property records
+    @router.get(
+        "/properties/",
+        response_model=List[RealPropertyOut],
+        responses={
+            200: {
+                "content": {
+                    "application/x-ndjson": {},
+                    "application/geo+json": {}
+                },
+                "description":
+                    "A page of properties, or all properties when streamed.",
+            }
+        },
+    )
+    async def get_all_properties(request: Request,
+                                 response: Response,
+                                 limit: int = Query(100, ge=1, le=1000),
+                                 after: str = None,
+                                 stream: StreamFormatEnum = None,
+                                 simplify: float = Query(None, gt=0),
+                                 precision: int = Query(None, ge=0, le=15)
+                                ) -> List[RealPropertyOut]:
+        """Get property records, a page at a time ordered by id (or streamed)
 
-        Todo:
+        Args:
 
-            Add paging support
+            limit (int): maximum number of properties in the page. Defaults to 100.
+            after (str): cursor - only properties after this property id are returned,
+                use the url in the Link header (rel="next") to get the next page
+            stream (StreamFormatEnum): optional - stream all properties (after the cursor)
+                instead of a page, as 'ndjson' (one json object per line)
+                or 'geojson' (a FeatureCollection with the geocode as the feature geometry)
+            simplify (float): optional - simplify the parcel and building polygons
+                with a tolerance in meters
+            precision (int): optional - decimal places of the coordinates,
+                defaults to GEOAPI_GEOJSON_PRECISION
+
+            With simplify or precision, the X-Geometry-Bytes, X-Geometry-Bytes-Full and
+            X-Geometry-Bytes-Saved headers of a page report the geojson bytes of the geometries
+            sent and at full resolution (streams are not reported).
 
         Raises:
 
@@ -158,18 +631,43 @@ def create_routes(api_db: DB) -> APIRouter:
                 which are the Geojson based Data Transfer Objects
                 for outgoing data from the API.
         """
+        output = _geometry_output(simplify, precision)
+        raw_json = int(config.API_CONFIG['GEOAPI_RAW_JSON'])
+        if stream is not None:
+            if raw_json:
+                property_texts = api_db.real_property_queries.iterate_all_json(
+                    stream == StreamFormatEnum.geojson, after, output)
+            else:
+                property_texts = responses.encode_properties(
+                    api_db.real_property_queries.iterate_all(after, output),
+                    stream)
+            return responses.ClosingStreamingResponse(
+                responses.stream_properties(property_texts, stream),
+                media_type=_STREAM_MEDIA_TYPES[stream])
         try:
-            out_list = await api_db.real_property_queries.get_all()
+            if raw_json:
+                page_json, next_cursor = await api_db.real_property_queries.get_page_json(
+                    limit, after, output)
+            else:
+                out_list, next_cursor = await api_db.real_property_queries.get_page(
+                    limit, after, output)
         except ResourceNotFoundError as rnf:
             raise HTTPException(status_code=404,
                                 detail={'message': rnf.args[0]})
-        else:
-            return out_list
+        headers = _geometry_bytes_headers(output)
+        if next_cursor is not None:
+            next_url = request.url.include_query_params(limit=limit,
+                                                        after=next_cursor)
+            headers['Link'] = '<{}>; rel="next"'.format(next_url)
+        if raw_json:
+            return _raw_json_response(page_json, headers)
+        response.headers.update(headers)
+        return out_list
 
     @router.post("/properties/find/", response_model=List[str])
     async def find_properties_near_location(
             geometry_distance: GeometryAndDistanceIn) -> List[str]:
-        """Get property records based on buffer around a geometry
+        """Get property records within a distance of a geometry
 
         Todo:
 
@@ -203,6 +701,51 @@ def create_routes(api_db: DB) -> APIRouter:
         else:
             return out_list
 
+    @router.post("/properties/find/batch/", response_model=List[List[str]])
+    async def find_properties_near_locations(
+            geometry_distances: List[GeometryAndDistanceLimitIn]
+    ) -> List[List[str]]:
+        """Get property records within distances of many geometries, in one db query
+
+        Args:
+
+            geometry_distances (List[GeometryAndDistanceLimitIn]): list of geometry and distance
+                objects (see find), each with an optional limit on the number of property ids.
+                At most GEOAPI_FIND_BATCH_MAX_ITEMS objects.
+
+            Example:
+                [
+                    {
+                        "distance": 1000,
+                        "location_geo": {"type": "Point", "coordinates": [-73.748751,40.918548]},
+                        "limit": 10
+                    },
+                    {
+                        "distance": 50,
+                        "location_geo": {"type": "Point", "coordinates": [-80.0782213,26.8849731]}
+                    }
+                ]
+
+        Raises:
+
+            HTTPException(422): Raised if there are more than GEOAPI_FIND_BATCH_MAX_ITEMS objects
+
+        Returns:
+
+            List[List[str]]: List of property ids per input object, in input order,
+                nearest first. An empty list if no properties are found for an object.
+        """
+        max_items = int(config.API_CONFIG['GEOAPI_FIND_BATCH_MAX_ITEMS'])
+        if len(geometry_distances) > max_items:
+            raise HTTPException(
+                status_code=422,
+                detail={
+                    'message':
+                        'Too many geometries, at most {} per request.'.format(
+                            max_items)
+                })
+        return await api_db.real_property_queries.find_many(geometry_distances)
+
     @router.post("/properties/", response_model=RealPropertyOut)
     async def create_property(real_property: RealPropertyIn) -> RealPropertyOut:
         """Insert a single property record
@@ -275,4 +818,167 @@ def create_routes(api_db: DB) -> APIRouter:
         else:
             return new_real_property
 
+    @router.post("/properties/bulk/", response_model=BulkResultOut)
+    async def create_properties_bulk(request: Request) -> BulkResultOut:
+        """Insert many property records in one request
+
+        The body is either a Geojson FeatureCollection (content type application/json
+        or application/geo+json) where each feature has the property geocode as its geometry
+        and the other property fields as its properties
+        (the format of GET /properties/?stream=geojson),
+        or newline delimited RealPropertyIn json objects (content type application/x-ndjson,
+        the format of GET /properties/?stream=ndjson).
+        Rows are validated and loaded into the db in chunks, existing ids are not overwritten.
+
+        Raises:
+
+            HTTPException(400): Raised if the body is not valid json
+            HTTPException(422): Raised if a json body is not a Geojson FeatureCollection
+
+        Returns:
+
+            BulkResultOut: counts of created, conflicting and invalid rows,
+                and the outcome of each row in request order
+        """
+        chunk_size = int(config.API_CONFIG['GEOAPI_BULK_CHUNK_SIZE'])
+        content_type = request.headers.get('content-type', '')
+        if content_type.startswith('application/x-ndjson'):
+            return await _bulk_create(api_db.real_property_commands,
+                                      responses.ndjson_lines(request),
+                                      _real_property_from_line, chunk_size)
+        try:
+            body = await request.json()
+        except ValueError as err:
+            raise HTTPException(
+                status_code=400,
+                detail={'message': 'Request body is not valid json.'}) from err
+        if not isinstance(body, dict) or body.get('type') != 'FeatureCollection':
+            raise HTTPException(
+                status_code=422,
+                detail={
+                    'message':
+                        'Request body must be a Geojson FeatureCollection or ndjson.'
+                })
+        return await _bulk_create(api_db.real_property_commands,
+                                  responses.features(body), RealPropertyIn.from_feature,
+                                  chunk_size)
+
+    @router.get(
+        "/tiles/{z}/{x}/{y}.mvt",
+        responses={
+            200: {
+                "content": {
+                    "application/vnd.mapbox-vector-tile": {}
+                },
+                "description": "Return the vector tile.",
+            }
+        },
+    )
+    async def get_tile(z: int, x: int, y: int) -> Response:  # pylint: disable=invalid-name
+        """Get a Mapbox vector tile of the properties for web maps
+
+        Tiles are web mercator tiles in the XYZ scheme (row 0 is the northernmost).
+        Parcel and building polygons are simplified by about one tile pixel and left out
+        below zoom GEOAPI_TILE_MIN_ZOOM_POLYGONS. Tiles are cached, a created property
+        invalidates the tiles it touches.
+
+        Args:
+
+            z (int): zoom level, 0 to GEOAPI_TILE_MAX_ZOOM
+            x (int): tile column, from the west
+            y (int): tile row, from the north
+
+            Example: /tiles/14/4835/6147.mvt
+
+        Raises:
+
+            HTTPException(404): Raised if the tile does not exist
+
+        Returns:
+
+            the encoded tile with the layers parcels (id, area), buildings (id, area)
+                and geocodes (id), empty if there are no properties in the tile
+        """
+        try:
+            tile = await api_db.map_queries.tile(z, x, y)
+        except ResourceNotFoundError as rnf:
+            raise HTTPException(status_code=404,
+                                detail={'message': rnf.args[0]})
+        return Response(content=tile,
+                        media_type='application/vnd.mapbox-vector-tile')
+
+    @router.get(
+        "/heatmap/{z}/{x}/{y}.png",
+        responses={
+            200: {
+                "content": {
+                    "image/png": {}
+                },
+                "description": "Return the heatmap tile.",
+            }
+        },
+    )
+    async def get_heatmap(z: int, x: int, y: int) -> Response:  # pylint: disable=invalid-name
+        """Get a building density heatmap tile as a PNG overlay for web maps
+
+        Tiles are web mercator tiles in the XYZ scheme (row 0 is the northernmost).
+        The color shows the share of the ground covered by buildings, smoothed over
+        GEOAPI_HEATMAP_RADIUS pixels. Tiles are cached, a created property invalidates
+        the tiles it touches.
+
+        Args:
+
+            z (int): zoom level, 0 to GEOAPI_TILE_MAX_ZOOM
+            x (int): tile column, from the west
+            y (int): tile row, from the north
+
+            Example: /heatmap/16/19342/24590.png
+
+        Raises:
+
+            HTTPException(404): Raised if the tile does not exist
+            HTTPException(503): Raised if too many images are being rendered
+            HTTPException(504): Raised if rendering the image took too long
+
+        Returns:
+
+            the tile as a PNG image, transparent where there are no buildings
+        """
+        try:
+            tile = await api_db.map_queries.heatmap(z, x, y)
+        except ResourceNotFoundError as rnf:
+            raise HTTPException(status_code=404,
+                                detail={'message': rnf.args[0]})
+        except ServiceUnavailableError as sue:
+            raise HTTPException(status_code=503,
+                                detail={'message': sue.args[0]})
+        except ResourceTimeoutError as rte:
+            raise HTTPException(status_code=504,
+                                detail={'message': rte.args[0]})
+        return Response(content=tile, media_type='image/png')
+
+    @router.get("/metrics/", response_model=Dict[str, Dict[str, Any]])
+    async def get_metrics() -> Dict[str, Dict[str, Any]]:
+        """Get runtime metrics of the API
+
+        Returns:
+
+            Dict[str, Dict[str, Any]]: counters per subsystem,
+                image_cache: hits, revalidated, misses, evictions and current usage
+                image_pool: completed, failed, rejected and timed out jobs,
+                    jobs in flight and saturation (in flight / max in flight)
+                tile_cache: vector and heatmap tile hits, misses, evictions, hit_rate
+                    and current usage
+                geocode_replica (if enabled): finds answered and fallen back to the db,
+                    notifications, rebuilds, reloads, size and staleness_seconds
+        """
+        metrics = {
+            'image_cache': image_cache.get_image_cache().stats(),
+            'image_pool': worker_pool.get_image_pool().stats(),
+            'tile_cache': tiles.tile_cache().stats(),
+        }
+        if api_db.geocode_replica is not None:
+            metrics['geocode_replica'] = api_db.geocode_replica.stats()
+        return metrics
+
     return router
@@ -0,0 +1,279 @@
+"""Integration tester for the query plans of the db queries
+"""
+
+import asyncio
+import json
+import unittest
+import uuid
+import geoapi.main
+import geoapi.config.api_configurator as config
+import geoapi.common.tiles as tiles
+from geoapi.common.json_models import GeometryAndDistanceIn, RealPropertyIn, ChangeKindEnum
+from geoapi.data.db import DB
+from geoapi.data.geocode_replica import GeocodeReplica
+import geoapi.data.migrations as migrations
+import geoapi.data.summary as summary
+import geoapi.data.queries as queries
+import geoapi.data.map_queries as map_queries
+
+
+class IntegrationTestsQueryPlans(unittest.TestCase):
+    """Integration tester for query plans
+    """
+
+    def setUp(self):
+        geoapi.main.init()
+        self.db_api = DB(config.API_CONFIG['GEOAPI_DATABASE_URL'])
+
+    def explain(self, query: str, values: dict) -> str:
+        """returns the query plan of a query as text"""
+
+        async def run_explain():
+            await self.db_api.connection.connect()
+            try:
+                await migrations.migrate(self.db_api.connection)
+                async with self.db_api.connection.transaction():
+                    # the test table is tiny, the planner would prefer a sequential scan
+                    await self.db_api.connection.execute(
+                        'SET LOCAL enable_seqscan = off')
+                    db_rows = await self.db_api.connection.fetch_all(
+                        'EXPLAIN ' + query, values=values)
+            finally:
+                await self.db_api.connection.disconnect()
+            return '\n'.join(db_row['QUERY PLAN'] for db_row in db_rows)
+
+        return asyncio.get_event_loop().run_until_complete(run_explain())
+
+    def test_migrations_create_spatial_indexes(self):
+        """Test that after migrating all the spatial indexes are valid
+        and a second run applies nothing
+        """
+
+        async def run_migrations():
+            await self.db_api.connection.connect()
+            try:
+                await migrations.migrate(self.db_api.connection)
+                applied = await migrations.migrate(self.db_api.connection)
+                missing = await migrations.verify(self.db_api.connection)
+            finally:
+                await self.db_api.connection.disconnect()
+            return applied, missing
+
+        applied, missing = asyncio.get_event_loop().run_until_complete(
+            run_migrations())
+        self.assertEqual(applied, [])
+        self.assertEqual(missing, [])
+
+    def test_find_uses_geocode_index(self):
+        """Test that find probes the geocode index, also for very large distances
+        """
+        for distance in (25, 10000000):
+            geometry_distance = GeometryAndDistanceIn(
+                distance=distance,
+                location_geo={"type": "Point", "coordinates": [-73.748751, 40.918548]})
+            query, values = self.db_api.real_property_queries._find_statement(  # pylint: disable=protected-access
+                geometry_distance)
+            plan = self.explain(query, values)
+            self.assertIn('Index Scan', plan, plan)
+            self.assertIn('properties_geocode_geo_idx', plan, plan)
+
+    def test_nearest_uses_geocode_index(self):
+        """Test that nearest walks the geocode index in distance order
+        """
+        plan = self.explain(
+            queries._NEAREST.format(table='properties'),  # pylint: disable=protected-access
+            {'location_geo': '{"type": "Point", "coordinates": [-73.748751, 40.918548]}',
+             'k': 5})
+        self.assertIn('Index Scan using properties_geocode_geo_idx', plan, plan)
+
+    def test_tile_uses_bbox_index(self):
+        """Test that a vector tile selects its properties with the bbox index
+        """
+        xmin, ymin, xmax, ymax = tiles.tile_bounds(14, 4835, 6147)
+        plan = self.explain(
+            map_queries._TILE.format(table='properties'),  # pylint: disable=protected-access
+            {'xmin': xmin, 'ymin': ymin, 'xmax': xmax, 'ymax': ymax, 'margin': 38.2,
+             'tolerance': 0.6, 'extent': 4096, 'buffer': 64, 'polygons': True})
+        self.assertIn('properties_bbox_idx', plan, plan)
+
+    def test_aggregate_summary(self):
+        """Test that a precomputed summary gives the on the fly aggregation and is kept current
+        """
+        cell_size = tiles.cell_size(10)
+        bounds = (-74.0, 40.7, -73.5, 41.0)
+        property_in = RealPropertyIn(id=uuid.uuid4().hex,
+                                     geocode_geo={"type": "Point",
+                                                  "coordinates": [-73.7487, 40.9185]})
+
+        async def run_aggregates():
+            await self.db_api.connection.connect()
+            try:
+                await migrations.migrate(self.db_api.connection)
+                on_the_fly = await self.db_api.map_queries.aggregate(bounds, cell_size)
+                await summary.refresh(self.db_api.connection, 'properties', [cell_size])
+                precomputed = await self.db_api.map_queries.aggregate(bounds, cell_size)
+                await self.db_api.real_property_commands.create(property_in)
+                after_create = await self.db_api.map_queries.aggregate(bounds, cell_size)
+            finally:
+                await self.db_api.connection.execute(
+                    'DELETE FROM properties WHERE id = :id',
+                    values={'id': property_in.id})
+                await summary.remove(self.db_api.connection, [cell_size])
+                await self.db_api.connection.disconnect()
+            return on_the_fly, precomputed, after_create
+
+        on_the_fly, precomputed, after_create = asyncio.get_event_loop(
+        ).run_until_complete(run_aggregates())
+        self.assertEqual(precomputed, on_the_fly)
+        counts = {(cell.x, cell.y): cell.count for cell in after_create}
+        self.assertEqual(counts[(2417, 3073)],
+                         {(cell.x, cell.y): cell.count for cell in on_the_fly}[(2417, 3073)] + 1)
+
+    def test_changes_report_writes_and_deletions(self):
+        """Test that the change feed pages through all changes and then reports a new
+        property and its deletion
+        """
+        property_in = RealPropertyIn(id=uuid.uuid4().hex,
+                                     geocode_geo={"type": "Point",
+                                                  "coordinates": [-73.7487, 40.9185]})
+
+        async def run_changes():
+            await self.db_api.connection.connect()
+            try:
+                await migrations.migrate(self.db_api.connection)
+                real_property_queries = self.db_api.real_property_queries
+                page = await real_property_queries.changes(2)
+                pages = [page]
+                while page.has_more:
+                    page = await real_property_queries.changes(2, page.next_token)
+                    pages.append(page)
+                token = page.next_token
+                caught_up = await real_property_queries.changes(100, token)
+                await self.db_api.real_property_commands.create(property_in)
+                created = await real_property_queries.changes(100, token)
+                await self.db_api.connection.execute(
+                    'DELETE FROM properties WHERE id = :id',
+                    values={'id': property_in.id})
+                deleted = await real_property_queries.changes(100, created.next_token)
+            finally:
+                await self.db_api.connection.execute(
+                    'DELETE FROM properties WHERE id = :id',
+                    values={'id': property_in.id})
+                await self.db_api.connection.disconnect()
+            return pages, caught_up, created, deleted
+
+        pages, caught_up, created, deleted = asyncio.get_event_loop(
+        ).run_until_complete(run_changes())
+        self.assertTrue(all(len(page.changes) <= 2 for page in pages))
+        self.assertIn('f1650f2a99824f349643ad234abff6a2',
+                      [change.id for page in pages for change in page.changes])
+        self.assertEqual(caught_up.changes, [])
+        self.assertEqual(caught_up.next_token, pages[-1].next_token)
+        self.assertEqual([(change.id, change.change) for change in created.changes],
+                         [(property_in.id, ChangeKindEnum.upsert)])
+        self.assertEqual(created.changes[0].property.geocode_geo,
+                         property_in.geocode_geo)
+        self.assertEqual([(change.id, change.change) for change in deleted.changes],
+                         [(property_in.id, ChangeKindEnum.delete)])
+
+    def test_changes_use_change_index(self):
+        """Test that the change feed walks the change index from the since position
+        """
+        plan = self.explain(queries._CHANGES.format(table='properties'),  # pylint: disable=protected-access
+                            {'since_txid': 0, 'since_id': '', 'limit': 101})
+        self.assertIn('properties_change_idx', plan)
+
+    def test_raw_json_matches_models(self):
+        """Test that the json stitched from the db rows is the json of the models
+        """
+
+        async def run_queries():
+            await self.db_api.connection.connect()
+            try:
+                real_property_queries = self.db_api.real_property_queries
+                property_id = 'f1650f2a99824f349643ad234abff6a2'
+                real_property = await real_property_queries.get(property_id)
+                property_json = await real_property_queries.get_json(property_id)
+                page, _ = await real_property_queries.get_page(10)
+                page_json, _ = await real_property_queries.get_page_json(10)
+                features = [
+                    real_property.to_feature()
+                    async for real_property in real_property_queries.iterate_all()
+                ]
+                features_json = [
+                    feature_json async for feature_json in
+                    real_property_queries.iterate_all_json(as_feature=True)
+                ]
+            finally:
+                await self.db_api.connection.disconnect()
+            self.assertEqual(json.loads(property_json), json.loads(real_property.json()))
+            self.assertEqual(json.loads(page_json),
+                             [json.loads(real_property.json()) for real_property in page])
+            self.assertEqual([json.loads(feature_json) for feature_json in features_json],
+                             json.loads(json.dumps(features)))
+
+        asyncio.get_event_loop().run_until_complete(run_queries())
+
+    def test_geocode_replica_find(self):
+        """Test that the geocode replica finds what the db finds and picks up a new property,
+        a moved geocode and a deletion
+        """
+        replica = GeocodeReplica(config.API_CONFIG['GEOAPI_DATABASE_URL'],
+                                 'properties')
+        location_geo = {"type": "Point", "coordinates": [-73.748751, 40.918548]}
+        moved_geo = {"type": "Point", "coordinates": [-70, 40]}
+        property_in = RealPropertyIn(id=uuid.uuid4().hex,
+                                     geocode_geo={"type": "Point",
+                                                  "coordinates": [-73.7487, 40.9185]})
+
+        async def run_finds():
+            await self.db_api.connection.connect()
+            await migrations.migrate(self.db_api.connection)
+            await replica.start()
+            try:
+                for distance in (25, 5000, 100000):
+                    query, values = self.db_api.real_property_queries._find_statement(  # pylint: disable=protected-access
+                        GeometryAndDistanceIn(distance=distance,
+                                              location_geo=location_geo))
+                    db_rows = await self.db_api.connection.fetch_all(
+                        query, values=values)
+                    self.assertEqual(
+                        sorted(replica.find(location_geo, distance)),
+                        sorted(db_row['id'] for db_row in db_rows))
+                await self.db_api.real_property_commands.create(property_in)
+                for _ in range(50):
+                    if property_in.id in replica.find(location_geo, 25):
+                        break
+                    await asyncio.sleep(0.1)
+                self.assertIn(property_in.id, replica.find(location_geo, 25))
+                self.assertEqual(replica.stats()['staleness_seconds'], 0)
+                await self.db_api.connection.execute(
+                    "UPDATE properties SET geocode_geo = ST_GeogFromText('POINT(-70 40)') "
+                    'WHERE id = :id',
+                    values={'id': property_in.id})
+                for _ in range(50):
+                    if property_in.id not in replica.find(location_geo, 25):
+                        break
+                    await asyncio.sleep(0.1)
+                self.assertNotIn(property_in.id, replica.find(location_geo, 25))
+                self.assertIn(property_in.id, replica.find(moved_geo, 25))
+                await self.db_api.connection.execute(
+                    'DELETE FROM properties WHERE id = :id',
+                    values={'id': property_in.id})
+                for _ in range(50):
+                    if property_in.id not in replica.find(moved_geo, 25):
+                        break
+                    await asyncio.sleep(0.1)
+                self.assertNotIn(property_in.id, replica.find(moved_geo, 25))
+            finally:
+                await self.db_api.connection.execute(
+                    'DELETE FROM properties WHERE id = :id',
+                    values={'id': property_in.id})
+                await replica.stop()
+                await self.db_api.connection.disconnect()
+
+        asyncio.get_event_loop().run_until_complete(run_finds())
+
+
+if __name__ == '__main__':
+    unittest.main()
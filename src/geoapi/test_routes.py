@@ -1,10 +1,18 @@
 """Integration tester for all routes in the api
 """
 
+import asyncio
+import io
+import json
+import math
 import unittest
+import uuid
+from PIL import Image
 from starlette.testclient import TestClient
 from fastapi import FastAPI
 import geoapi.main
+import geoapi.config.api_configurator as config
+from geoapi.data.db import DB
 
 
 class IntegrationTestsRoutes(unittest.TestCase):
@@ -107,5 +115,409 @@ class IntegrationTestsRoutes(unittest.TestCase):
             )
             self.assertEqual(response.status_code, 409)
 
+    def test_get_statistics_near_property(self):
+        """Test of the statistics route, buildings are returned with area and distance
+        """
+        with TestClient(self.api) as client:
+            response = client.get(
+                "/geoapi/v1/properties/f1650f2a99824f349643ad234abff6a2/statistics/",
+                params={"distance": 50})
+            self.assertEqual(response.status_code, 200)
+            statistics = response.json()
+            self.assertGreater(statistics['zone_area'], 0)
+            self.assertGreater(len(statistics['buildings_area_distance']), 0)
+            for building in statistics['buildings_area_distance']:
+                self.assertGreater(building['area'], 0)
+                self.assertGreaterEqual(building['distance'], 0)
+            self.assertGreaterEqual(statistics['zone_density'], 0)
+            self.assertLessEqual(statistics['zone_density'], 100)
+            response = client.get(
+                "/geoapi/v1/properties/00000000000000000000000000000000/statistics/",
+                params={"distance": 50})
+            self.assertEqual(response.status_code, 404)
+
+    def test_get_ring_statistics_near_property(self):
+        """Test of the ring statistics route, one result per distance equal to the single results
+        """
+        with TestClient(self.api) as client:
+            response = client.get(
+                "/geoapi/v1/properties/f1650f2a99824f349643ad234abff6a2/statistics/rings/",
+                params=[("distances", 100), ("distances", 10), ("distances", 50)])
+            self.assertEqual(response.status_code, 200)
+            rings = response.json()
+            self.assertEqual(len(rings), 3)
+            for distance, ring in zip((100, 10, 50), rings):
+                single = client.get(
+                    "/geoapi/v1/properties/f1650f2a99824f349643ad234abff6a2/statistics/",
+                    params={"distance": distance}).json()
+                self.assertEqual(ring['zone_area'], single['zone_area'])
+                self.assertEqual(ring['parcel_area'], single['parcel_area'])
+                self.assertEqual(len(ring['buildings_area_distance']),
+                                 len(single['buildings_area_distance']))
+
+    def test_get_statistics_near_properties(self):
+        """Test of the batch statistics route, one ndjson result per request in request order
+        """
+        with TestClient(self.api) as client:
+            response = client.post(
+                "/geoapi/v1/properties/statistics/batch/",
+                json=[
+                    {"property_id": "f1650f2a99824f349643ad234abff6a2", "distance": 50},
+                    {"property_id": "00000000000000000000000000000000", "distance": 50},
+                    {"property_id": "3290ec7dd190478aab124f6f2f32bdd7", "distance": 100},
+                ])
+            self.assertEqual(response.status_code, 200)
+            results = [json.loads(line) for line in response.text.splitlines()]
+            self.assertEqual([result['index'] for result in results], [0, 1, 2])
+            single = client.get(
+                "/geoapi/v1/properties/f1650f2a99824f349643ad234abff6a2/statistics/",
+                params={"distance": 50}).json()
+            self.assertEqual(results[0]['statistics'], single)
+            self.assertIsNone(results[1]['statistics'])
+            self.assertIn('not found', results[1]['message'])
+            self.assertGreater(results[2]['statistics']['zone_area'], 0)
+            response = client.post(
+                "/geoapi/v1/properties/statistics/batch/",
+                json=[{"property_id": "f1650f2a99824f349643ad234abff6a2", "distance": 0}])
+            self.assertEqual(response.status_code, 422)
+            max_items = int(config.API_CONFIG['GEOAPI_STATISTICS_BATCH_MAX_ITEMS'])
+            response = client.post(
+                "/geoapi/v1/properties/statistics/batch/",
+                json=[{"property_id": "f1650f2a99824f349643ad234abff6a2", "distance": 50}] *
+                (max_items + 1))
+            self.assertEqual(response.status_code, 422)
+
+    def test_get_metrics(self):
+        """Test of the metrics route, counters are reported per subsystem
+        """
+        with TestClient(self.api) as client:
+            response = client.get("/geoapi/v1/metrics/")
+            self.assertEqual(response.status_code, 200)
+            metrics = response.json()
+            for subsystem in ('image_cache', 'image_pool', 'tile_cache'):
+                self.assertIn(subsystem, metrics)
+            self.assertIn('coalesced', metrics['image_cache'])
+            self.assertIn('saturation', metrics['image_pool'])
+            self.assertIn('hit_rate', metrics['tile_cache'])
+
+    def test_get_tile(self):
+        """Test of the vector tile route, tiles are cached until a created property touches them
+        """
+        with TestClient(self.api) as client:
+            tile_url = "/geoapi/v1/tiles/14/4835/6147.mvt"
+            response = client.get(tile_url)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.headers['content-type'],
+                             'application/vnd.mapbox-vector-tile')
+            self.assertGreater(len(response.content), 0)
+            hits = client.get("/geoapi/v1/metrics/").json()['tile_cache']['hits']
+            self.assertEqual(client.get(tile_url).content, response.content)
+            self.assertEqual(
+                client.get("/geoapi/v1/metrics/").json()['tile_cache']['hits'], hits + 1)
+            # a new property in the tile, without parcel and building
+            response_create = client.post(
+                "/geoapi/v1/properties/",
+                json={
+                    "id": uuid.uuid4().hex,
+                    "geocode_geo": {"type": "Point", "coordinates": [-73.7482, 40.9182]}
+                })
+            self.assertEqual(response_create.status_code, 200)
+            self.assertGreater(len(client.get(tile_url).content), len(response.content))
+            self.assertEqual(client.get("/geoapi/v1/tiles/3/8/0.mvt").status_code, 404)
+
+    def test_get_heatmap(self):
+        """Test of the heatmap route, buildings are colored and empty tiles are transparent
+        """
+        with TestClient(self.api) as client:
+            response = client.get("/geoapi/v1/heatmap/16/19342/24590.png")
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.headers['content-type'], 'image/png')
+            image = Image.open(io.BytesIO(response.content))
+            self.assertEqual(image.size, (256, 256))
+            self.assertGreater(image.getextrema()[3][1], 0)
+            self.assertEqual(client.get("/geoapi/v1/heatmap/16/19342/24590.png").content,
+                             response.content)
+            response = client.get("/geoapi/v1/heatmap/4/0/0.png")
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(Image.open(io.BytesIO(response.content)).getextrema()[3], (0, 0))
+
+    def test_export_properties(self):
+        """Test of the export route, in both formats, read back with pyarrow
+        """
+        import pyarrow as pa  # pylint: disable=import-outside-toplevel
+        import pyarrow.parquet as pq  # pylint: disable=import-outside-toplevel
+        with TestClient(self.api) as client:
+            response = client.get("/geoapi/v1/properties/export/?format=arrow")
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.headers['content-type'],
+                             'application/vnd.apache.arrow.stream')
+            arrow_table = pa.ipc.open_stream(response.content).read_all()
+            self.assertIn('f1650f2a99824f349643ad234abff6a2',
+                          arrow_table.column('id').to_pylist())
+            response = client.get("/geoapi/v1/properties/export/?format=parquet")
+            self.assertEqual(response.status_code, 200)
+            parquet_table = pq.read_table(io.BytesIO(response.content))
+            self.assertEqual(parquet_table.num_rows, arrow_table.num_rows)
+            self.assertEqual(
+                json.loads(parquet_table.schema.metadata[b'geo'])['primary_column'],
+                'geocode_geo')
+            response = client.get("/geoapi/v1/properties/export/?format=csv")
+            self.assertEqual(response.status_code, 422)
+
+    def test_export_properties_disconnect(self):
+        """Test that an export stops when the client disconnects, a batch into the stream,
+        and releases its connection
+        """
+        import pyarrow as pa  # pylint: disable=import-outside-toplevel
+        batch_size = config.API_CONFIG['GEOAPI_EXPORT_BATCH_SIZE']
+        config.API_CONFIG['GEOAPI_EXPORT_BATCH_SIZE'] = '1'
+        scope = {'type': 'http', 'http_version': '1.1', 'method': 'GET', 'scheme': 'http',
+                 'path': '/geoapi/v1/properties/export/', 'root_path': '',
+                 'query_string': b'format=arrow', 'headers': [],
+                 'client': ('testclient', 50000), 'server': ('testserver', 80)}
+        messages = []
+
+        async def run_export():
+            first_chunk = asyncio.Event()
+            requested = False
+
+            async def receive():
+                nonlocal requested
+                if not requested:
+                    requested = True
+                    return {'type': 'http.request', 'body': b'', 'more_body': False}
+                await first_chunk.wait()
+                return {'type': 'http.disconnect'}
+
+            async def send(message):
+                # like the server, sends after a disconnect are dropped silently
+                messages.append(message)
+                if message.get('body'):
+                    first_chunk.set()
+
+            await asyncio.wait_for(self.api(scope, receive, send), timeout=30)
+
+        try:
+            with TestClient(self.api) as client:
+                asyncio.get_event_loop().run_until_complete(run_export())
+                rows = client.get("/geoapi/v1/properties/export/?format=arrow")
+                self.assertEqual(rows.status_code, 200)
+        finally:
+            config.API_CONFIG['GEOAPI_EXPORT_BATCH_SIZE'] = batch_size
+        row_count = pa.ipc.open_stream(rows.content).read_all().num_rows
+        self.assertEqual(messages[0]['status'], 200)
+        self.assertLess(len(messages) - 1, row_count)
+        self.assertTrue(all(message.get('more_body') for message in messages[1:]))
+
+    def test_get_property_changes(self):
+        """Test of the change feed route, the next token continues the feed
+        """
+        with TestClient(self.api) as client:
+            response = client.get("/geoapi/v1/properties/changes/?limit=1")
+            self.assertEqual(response.status_code, 200)
+            page = response.json()
+            self.assertEqual(len(page['changes']), 1)
+            self.assertTrue(page['has_more'])
+            response = client.get("/geoapi/v1/properties/changes/",
+                                  params={'since': page['next_token'], 'limit': 1})
+            self.assertEqual(response.status_code, 200)
+            self.assertNotEqual(response.json()['changes'][0]['id'],
+                                page['changes'][0]['id'])
+            response = client.get("/geoapi/v1/properties/changes/?since=not-a-token")
+            self.assertEqual(response.status_code, 422)
+
+    def test_find_properties_near_location(self):
+        """Test of the find route, with a point and with a polygon large enough to be subdivided
+        """
+        with TestClient(self.api) as client:
+            response = client.post(
+                "/geoapi/v1/properties/find/",
+                json={
+                    "distance": 25,
+                    "location_geo": {"type": "Point", "coordinates": [-73.748751, 40.918548]}
+                })
+            self.assertEqual(response.status_code, 200)
+            self.assertIn('f1650f2a99824f349643ad234abff6a2', response.json())
+            # 1000 vertex ring around the test property
+            ring = [[-73.748751 + 0.01 * math.cos(2 * math.pi * index / 1000),
+                     40.918548 + 0.01 * math.sin(2 * math.pi * index / 1000)]
+                    for index in range(1000)]
+            ring.append(ring[0])
+            response = client.post(
+                "/geoapi/v1/properties/find/",
+                json={
+                    "distance": 10,
+                    "location_geo": {"type": "Polygon", "coordinates": [ring]}
+                })
+            self.assertEqual(response.status_code, 200)
+            self.assertIn('f1650f2a99824f349643ad234abff6a2', response.json())
+
+    def test_nearest_properties(self):
+        """Test of the nearest routes, k properties nearest first with distances
+        """
+        with TestClient(self.api) as client:
+            response = client.get("/geoapi/v1/properties/nearest/",
+                                  params={"lon": -73.748751, "lat": 40.918548, "k": 2})
+            self.assertEqual(response.status_code, 200)
+            nearest = response.json()
+            self.assertEqual(len(nearest), 2)
+            # other tests create properties at the same location, ties are ordered by id
+            response = client.get("/geoapi/v1/properties/nearest/",
+                                  params={"lon": -73.748751, "lat": 40.918548, "k": 10})
+            self.assertIn('f1650f2a99824f349643ad234abff6a2',
+                          [near['id'] for near in response.json() if near['distance'] < 1])
+            self.assertLess(nearest[0]['distance'], 1)
+            self.assertLessEqual(nearest[0]['distance'], nearest[1]['distance'])
+            response = client.post(
+                "/geoapi/v1/properties/nearest/",
+                json={"k": 2,
+                      "location_geo": {"type": "Point", "coordinates": [-73.748751, 40.918548]}})
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.json(), nearest)
+
+    def test_aggregate_properties(self):
+        """Test of the aggregate route, the test property is counted in its zoom 10 cell
+        """
+        with TestClient(self.api) as client:
+            response = client.get("/geoapi/v1/properties/aggregate/",
+                                  params={"bbox": "-74.0,40.7,-73.5,41.0", "zoom": 10})
+            self.assertEqual(response.status_code, 200)
+            cells = {(cell['x'], cell['y']): cell for cell in response.json()}
+            cell = cells[(2417, 3073)]
+            self.assertGreaterEqual(cell['count'], 1)
+            self.assertGreater(cell['building_area'], 0)
+            self.assertGreater(cell['building_coverage'], 0)
+            self.assertLessEqual(cell['bbox'][0], -73.748751)
+            self.assertGreaterEqual(cell['bbox'][3], 40.918548)
+            response = client.get("/geoapi/v1/properties/aggregate/",
+                                  params={"bbox": "-74.0,40.7,-73.5,41.0",
+                                          "cell_size": 4891.96981025128})
+            self.assertEqual({(cell['x'], cell['y']) for cell in response.json()}, set(cells))
+            response = client.get("/geoapi/v1/properties/aggregate/",
+                                  params={"bbox": "-180,-85,180,85", "zoom": 12})
+            self.assertEqual(response.status_code, 422)
+
+    def test_find_properties_near_locations(self):
+        """Test of the batch find route, ids are grouped per geometry and limited per geometry
+        """
+        with TestClient(self.api) as client:
+            response = client.post(
+                "/geoapi/v1/properties/find/batch/",
+                json=[
+                    {"distance": 25,
+                     "location_geo": {"type": "Point", "coordinates": [-73.748751, 40.918548]}},
+                    {"distance": 100000, "limit": 1,
+                     "location_geo": {"type": "Point", "coordinates": [-80.0782213, 26.8849731]}},
+                    {"distance": 10,
+                     "location_geo": {"type": "Point", "coordinates": [0, 0]}},
+                ])
+            self.assertEqual(response.status_code, 200)
+            found = response.json()
+            self.assertEqual(len(found), 3)
+            self.assertIn('f1650f2a99824f349643ad234abff6a2', found[0])
+            self.assertEqual(found[1], ['3290ec7dd190478aab124f6f2f32bdd7'])
+            self.assertEqual(found[2], [])
+
+    def test_get_property_resolution(self):
+        """Test of the simplify and precision parameters, the bytes saved are reported
+        """
+        with TestClient(self.api) as client:
+            response = client.get(
+                "/geoapi/v1/properties/f1650f2a99824f349643ad234abff6a2/",
+                params={"simplify": 2, "precision": 5})
+            self.assertEqual(response.status_code, 200)
+            for ring in response.json()['parcel_geo']['coordinates']:
+                for coordinate in ring:
+                    self.assertEqual([round(value, 5) for value in coordinate], coordinate)
+            self.assertGreater(int(response.headers['X-Geometry-Bytes-Saved']), 0)
+            self.assertEqual(int(response.headers['X-Geometry-Bytes-Full']) -
+                             int(response.headers['X-Geometry-Bytes']),
+                             int(response.headers['X-Geometry-Bytes-Saved']))
+            response = client.get("/geoapi/v1/properties/", params={"limit": 2, "precision": 4})
+            self.assertEqual(response.status_code, 200)
+            self.assertGreater(int(response.headers['X-Geometry-Bytes-Saved']), 0)
+            response = client.get("/geoapi/v1/properties/f1650f2a99824f349643ad234abff6a2/")
+            self.assertNotIn('X-Geometry-Bytes', response.headers)
+
+    def test_get_all_properties_paging(self):
+        """Test of the get all properties route, following the next page links
+        """
+        with TestClient(self.api) as client:
+            response = client.get("/geoapi/v1/properties/", params={"limit": 2})
+            self.assertEqual(response.status_code, 200)
+            first_page = [real_property['id'] for real_property in response.json()]
+            self.assertEqual(len(first_page), 2)
+            self.assertEqual(first_page, sorted(first_page))
+            self.assertIn('rel="next"', response.headers['link'])
+            next_url = response.headers['link'].split(';')[0].strip('<>')
+            response = client.get(next_url)
+            self.assertEqual(response.status_code, 200)
+            second_page = [real_property['id'] for real_property in response.json()]
+            self.assertGreater(second_page[0], first_page[-1])
+
+    def test_get_all_properties_stream(self):
+        """Test of the get all properties route, streamed as ndjson and geojson
+        """
+        with TestClient(self.api) as client:
+            response = client.get("/geoapi/v1/properties/", params={"stream": "ndjson"})
+            self.assertEqual(response.status_code, 200)
+            lines = [json.loads(line) for line in response.text.splitlines()]
+            self.assertGreaterEqual(len(lines), 5)
+            response = client.get("/geoapi/v1/properties/", params={"stream": "geojson"})
+            self.assertEqual(response.status_code, 200)
+            feature_collection = response.json()
+            self.assertEqual(feature_collection['type'], 'FeatureCollection')
+            self.assertEqual(len(feature_collection['features']), len(lines))
+
+    def test_create_properties_bulk(self):
+        """Test of the bulk create route with ndjson, reporting created, conflicting
+        and invalid rows, also rows that only fail converting to the db
+        (malformed geometry, id too long)
+        """
+        property_ids = [uuid.uuid4().hex for _ in range(4)]
+        rows = [
+            {"id": property_ids[0],
+             "geocode_geo": {"type": "Point", "coordinates": [-73.748751, 40.918548]}},
+            {"id": "f1650f2a99824f349643ad234abff6a2"},
+            {"id": property_ids[1], "image_url": "not a url"},
+            {"id": property_ids[2]},
+            {"id": property_ids[3], "geocode_geo": {"type": "Point"}},
+            {"id": "b" * 101},
+        ]
+        try:
+            with TestClient(self.api) as client:
+                response = client.post(
+                    "/geoapi/v1/properties/bulk/",
+                    data='\n'.join(json.dumps(row) for row in rows),
+                    headers={"content-type": "application/x-ndjson"})
+                self.assertEqual(response.status_code, 200)
+                bulk_result = response.json()
+                self.assertEqual(
+                    (bulk_result['created'], bulk_result['conflicts'], bulk_result['invalid']),
+                    (2, 1, 3))
+                self.assertEqual(
+                    [row_result['status'] for row_result in bulk_result['results']],
+                    ['created', 'conflict', 'invalid', 'created', 'invalid', 'invalid'])
+                response = client.get("/geoapi/v1/properties/{}/".format(property_ids[0]))
+                self.assertEqual(response.status_code, 200)
+        finally:
+            self._delete_properties(property_ids)
+
+    @staticmethod
+    def _delete_properties(property_ids):
+        """deletes properties created by a test"""
+        db_api = DB(config.API_CONFIG['GEOAPI_DATABASE_URL'])
+
+        async def delete():
+            await db_api.connection.connect()
+            try:
+                await db_api.connection.execute(
+                    'DELETE FROM properties WHERE id = ANY(:ids)',
+                    values={'ids': property_ids})
+            finally:
+                await db_api.connection.disconnect()
+
+        asyncio.get_event_loop().run_until_complete(delete())
+
 if __name__ == '__main__':
     unittest.main()
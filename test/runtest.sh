@@ -17,8 +17,8 @@ docker-compose -f docker-compose-test.yml up -d
 # export GEOAPI_LOG_CONFIG_YML=geoapi/log/logging.yml
 source .envtest
 
-# tests are run and result is stored
-cd ../src && python -m unittest discover -v -s geoapi
+# the schema migrations are applied to the fresh db, then tests are run and result is stored
+cd ../src && python -m geoapi.data.migrations && python -m unittest discover -v -s geoapi
 TESTSTATUS=$?
 # bring down the db container and delete the volume to refresh for next time
 cd ../test